@@ -0,0 +1,118 @@
+"""
+Mide el arranque en frío del bot: cuánto tarda, desde que se lanza el
+proceso, en contestar el primer 200 en /webhook. Es lo que ve WhatsApp
+cuando la instancia gratuita estaba dormida y la despierta un mensaje.
+
+Usa la verificación GET del webhook (hub.verify_token), que responde 200
+sin llamar a la Graph API, así que no hace falta red ni un token real.
+
+Uso:
+    python benchmark_arranque.py                      # servidor de Flask
+    python benchmark_arranque.py --servidor gunicorn  # como en Render
+    python benchmark_arranque.py --sin-precarga       # con BOT_PRECARGA=0
+    python benchmark_arranque.py --repeticiones 20
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+TOKEN_VERIFICACION = "benchmark-arranque"
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _comando_servidor(servidor, puerto):
+    if servidor == "gunicorn":
+        return [
+            sys.executable, "-m", "gunicorn", "--workers", "1",
+            "--bind", f"127.0.0.1:{puerto}", "bot_credito:app",
+        ]
+    return [
+        sys.executable, "-c",
+        f"import bot_credito; bot_credito.app.run(host='127.0.0.1', port={puerto})",
+    ]
+
+
+def medir_primer_200(servidor, precarga, tiempo_max=30.0):
+    """Lanza el servidor y devuelve los ms hasta el primer 200 en /webhook."""
+    puerto = _puerto_libre()
+    url = (
+        f"http://127.0.0.1:{puerto}/webhook"
+        f"?hub.verify_token={TOKEN_VERIFICACION}&hub.challenge=ok"
+    )
+    entorno = dict(
+        os.environ,
+        WHATSAPP_VERIFY_TOKEN=TOKEN_VERIFICACION,
+        BOT_PRECARGA="1" if precarga else "0",
+        BOT_LOG_NIVEL="WARNING",
+    )
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(
+        _comando_servidor(servidor, puerto), cwd=DIRECTORIO, env=entorno,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - inicio < tiempo_max:
+            if proceso.poll() is not None:
+                raise RuntimeError(f"El servidor terminó con código {proceso.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as respuesta:
+                    if respuesta.status == 200:
+                        return (time.perf_counter() - inicio) * 1000
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.005)
+        raise RuntimeError(f"Sin respuesta 200 después de {tiempo_max} s")
+    finally:
+        proceso.terminate()
+        try:
+            proceso.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+
+
+def medir_importacion():
+    """ms que tarda solo `import bot_credito` en un proceso nuevo."""
+    codigo = (
+        "import time; inicio = time.perf_counter(); import bot_credito; "
+        "print((time.perf_counter() - inicio) * 1000)"
+    )
+    salida = subprocess.run(
+        [sys.executable, "-c", codigo], cwd=DIRECTORIO, capture_output=True,
+        text=True, check=True, env=dict(os.environ, BOT_LOG_NIVEL="WARNING"),
+    )
+    return float(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servidor", choices=("flask", "gunicorn"), default="flask")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--sin-precarga", action="store_true")
+    args = parser.parse_args()
+
+    importaciones = [medir_importacion() for _ in range(args.repeticiones)]
+    primeros_200 = [
+        medir_primer_200(args.servidor, precarga=not args.sin_precarga)
+        for _ in range(args.repeticiones)
+    ]
+
+    for nombre, muestras in (("import bot_credito", importaciones), ("primer 200 en /webhook", primeros_200)):
+        print(
+            f"{nombre:24s} mediana {statistics.median(muestras):8.1f} ms   "
+            f"mín {min(muestras):8.1f} ms   máx {max(muestras):8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
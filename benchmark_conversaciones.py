@@ -0,0 +1,358 @@
+"""
+Mide qué tan rápido contesta el bot una conversación completa: reproduce
+miles de usuarios sintéticos que recorren todos los flujos (ahorro,
+inversión, jubilación, crédito, tienda, capacidad de pago, salud financiera
+y género) llamando a procesar_mensaje en el mismo proceso, sin red ni Graph
+API. Los usuarios se atienden intercalados, como llegan en la realidad, así
+que hay miles de sesiones vivas al mismo tiempo.
+
+Reporta la latencia p50/p95/p99 de cada paso (contexto["esperando"] antes
+del mensaje), los mensajes por segundo y la memoria máxima (RSS). Con
+--guardar escribe una línea base en JSON; con --comparar la vuelve a medir
+contra esa línea base y termina con código 1 si algún paso se volvió más
+lento, si bajaron los mensajes por segundo o si cambió la máquina de
+estados (pasos nuevos o que ya no se visitan, o respuestas distintas con la
+misma semilla).
+
+Uso:
+    python benchmark_conversaciones.py                        # 2000 usuarios
+    python benchmark_conversaciones.py --usuarios 10000 --semilla 7
+    python benchmark_conversaciones.py --guardar linea_base_conversaciones.json
+    python benchmark_conversaciones.py --comparar linea_base_conversaciones.json
+    BOT_SESIONES=sqlite python benchmark_conversaciones.py    # con el almacén SQLite
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+os.environ.setdefault("BOT_LOG_NIVEL", "WARNING")
+os.environ.setdefault("BOT_PRECARGA", "0")
+
+import bot_credito as bot  # noqa: E402
+
+SIN_PASO = "(sin paso)"
+MAX_MENSAJES_POR_USUARIO = 80
+
+
+# =========================================
+# Respuestas sintéticas
+# =========================================
+def _monto(aleatorio, minimo, maximo):
+    """Un monto escrito como lo escribiría una persona."""
+    valor = aleatorio.randrange(minimo, maximo + 1, 100) if maximo - minimo >= 100 else aleatorio.randint(minimo, maximo)
+    forma = aleatorio.random()
+    if forma < 0.5:
+        return str(valor)
+    if forma < 0.75:
+        return f"{valor:,}"
+    if forma < 0.9:
+        return f"${valor:,}"
+    if valor >= 1000 and valor % 1000 == 0:
+        return f"{valor // 1000} mil"
+    return str(valor)
+
+def _tasa(aleatorio):
+    tasa = aleatorio.choice((5, 8, 10, 12, 18, 24, 36, 45, 60, 79.9))
+    return aleatorio.choice((f"{tasa}", f"{tasa}%", f"{tasa} %"))
+
+def _plazo(aleatorio, con_unidad=True):
+    anios = aleatorio.randint(1, 30)
+    if not con_unidad:
+        return str(anios)
+    return aleatorio.choice((str(anios), f"{anios} años", f"{anios * 12} meses"))
+
+def _opcion(*opciones):
+    return lambda aleatorio: aleatorio.choice(opciones)
+
+def _fijo(texto):
+    return lambda aleatorio: texto
+
+# Qué contesta un usuario sintético en cada paso. Los menús a los que se
+# vuelve al terminar un flujo contestan "menú", y así termina la conversación.
+RESPUESTAS = {
+    "menu_ahorro": _fijo("menú"),
+    "menu_inversion": _fijo("menú"),
+    "menu_jubilacion": _fijo("menú"),
+    "menu_salud": _fijo("menú"),
+    "menu_genero": _fijo("menú"),
+    "menu_credito": _fijo("menú"),
+    "salud_pregunta": _opcion("1", "2", "3", "4", "5"),
+    "ahorro_meta": lambda a: _monto(a, 5000, 500000),
+    "ahorro_inicial": lambda a: _monto(a, 0, 4000),
+    "ahorro_tiempo_numero": lambda a: _plazo(a, con_unidad=a.random() < 0.5),
+    "ahorro_tiempo_unidad": _opcion("1", "2"),
+    "ahorro_frecuencia": _opcion("1", "2", "3", "4", "5"),
+    "ahorro_frecuencia_otro": _opcion("6", "24", "365"),
+    "inversion_monto_inicial": lambda a: _monto(a, 0, 200000),
+    "inversion_aportacion": lambda a: _monto(a, 100, 5000),
+    "inversion_tasa_anual": _tasa,
+    "inversion_tiempo_numero": lambda a: _plazo(a, con_unidad=a.random() < 0.5),
+    "inversion_tiempo_unidad": _opcion("1", "2"),
+    "inversion_frecuencia": _opcion("1", "2", "3", "4", "5"),
+    "inversion_frecuencia_otro": _opcion("6", "24", "365"),
+    "jubilacion_meta": lambda a: _monto(a, 500000, 5000000),
+    "jubilacion_ahorro_actual": lambda a: _monto(a, 0, 100000),
+    "jubilacion_tasa_anual": _tasa,
+    "jubilacion_tiempo_numero": lambda a: _plazo(a, con_unidad=a.random() < 0.5),
+    "jubilacion_tiempo_unidad": _opcion("1", "2"),
+    "jubilacion_frecuencia": _opcion("1", "2", "3", "4", "5"),
+    "jubilacion_frecuencia_otro": _opcion("6", "24", "365"),
+    "monto2": lambda a: _monto(a, 10000, 2000000),
+    "tasa_anual2": _tasa,
+    "anios2": _plazo,
+    "frecuencia2": _opcion("1", "2", "3", "4", "5"),
+    "frecuencia_otro2": _opcion("6", "24", "365"),
+    "abono_extra2": lambda a: _monto(a, 100, 5000),
+    "desde2": lambda a: str(a.randint(1, 12)),
+    "monto_credito": lambda a: _monto(a, 10000, 2000000),
+    "tasa_anual_credito": _tasa,
+    "anios_credito": _plazo,
+    "frecuencia_credito": _opcion("1", "2", "3", "4", "5"),
+    "frecuencia_otro_credito": _opcion("6", "24", "365"),
+    "ver_si_abonos1": _opcion("sí", "no"),
+    "abono_extra1": lambda a: _monto(a, 100, 5000),
+    "desde_cuando1": lambda a: str(a.randint(1, 12)),
+    "precio_contado": lambda a: _monto(a, 1000, 50000),
+    "pago_fijo_tienda": lambda a: _monto(a, 100, 5000),
+    "numero_pagos_tienda": _opcion("6", "12", "18", "24", "48"),
+    "pedir_periodos_anuales_tienda": _opcion("12", "24", "26", "52"),
+    "ingreso": lambda a: _monto(a, 5000, 80000),
+    "pagos_fijos": lambda a: _monto(a, 0, 10000),
+    "deuda_revolvente": lambda a: _monto(a, 0, 50000),
+    "riesgo": _opcion("1", "2", "3"),
+    "subopcion_prestamo": _opcion("1", "2"),
+    "tasa_anual_simular": _tasa,
+    "anios_simular": _plazo,
+    "frecuencia_simular": _opcion("1", "2", "3", "4", "5"),
+    "frecuencia_otro_simular": _opcion("6", "24", "365"),
+    "submenu_despues_de_maximo": _opcion("1", "2"),
+    "monto_credito_deseado": lambda a: _monto(a, 10000, 2000000),
+    "tasa_anual_deseada": _tasa,
+    "anios_deseado": _plazo,
+    "frecuencia_deseada": _opcion("1", "2", "3", "4", "5"),
+    "frecuencia_otro_deseada": _opcion("6", "24", "365"),
+    "submenu_buro": _opcion("sí", "no"),
+}
+
+# Cómo entra cada flujo desde el menú principal; lo demás lo deciden las
+# RESPUESTAS según el paso en que vaya la conversación. El comando de
+# crédito, salud y género arman su entrada en _entrada_aleatoria.
+ENTRADAS = {
+    "ahorro": ("hola", "1", "1"),
+    "inversion": ("hola", "3", "1"),
+    "jubilacion": ("hola", "4", "1"),
+    "credito": ("hola", "2", "1"),
+    "credito_abonos": ("hola", "2", "2"),
+    "tienda": ("hola", "2", "3"),
+    "capacidad": ("hola", "2", "4"),
+    "buro": ("hola", "2", "8"),
+}
+
+# Conversaciones fijas, las mismas en cada corrida, para una parte de los usuarios.
+GUIONES = {
+    "ahorro": ("hola", "1", "1", "15000", "2000", "6", "1", "2"),
+    "inversion": ("hola", "3", "1", "5000", "500", "10", "5", "2", "1"),
+    "jubilacion": ("hola", "4", "1", "1500000", "50000", "8", "25", "2", "2"),
+    "credito": ("hola", "2", "1", "100000", "45", "3", "2", "sí", "500", "4"),
+    "credito_abonos": ("hola", "2", "2", "50000", "30", "5", "4", "200", "10"),
+    "credito_comando": ("crédito 150000 45% 3 años quincenal", "no"),
+    "tienda": ("hola", "2", "3", "1800", "250", "12", "24"),
+    "capacidad": ("hola", "2", "4", "15000", "2000", "10000", "2", "1", "45", "3", "1", "2"),
+    "buro": ("hola", "2", "8", "sí"),
+    "salud": ("hola", "6", "1", "5", "5", "5", "5", "5", "menú"),
+    "genero": ("hola", "5", "1", "2", "menú"),
+}
+
+FLUJOS = tuple(GUIONES)
+
+# Mensajes que no son la respuesta esperada: también hay que atenderlos rápido.
+RUIDO = ("abc", "no entendí", "explícamelo más fácil", "15,00,0", "?")
+
+
+def _entrada_aleatoria(flujo, aleatorio):
+    if flujo == "credito_comando":
+        return (
+            f"crédito {_monto(aleatorio, 10000, 2000000)} {aleatorio.choice((12, 24, 45, 60))}% "
+            f"{aleatorio.randint(1, 10)} años {aleatorio.choice(('mensual', 'quincenal', 'catorcenal', 'semanal'))}",
+        )
+    if flujo == "salud":
+        return ("hola", "6", aleatorio.choice(("1", "2", "3", "4", "5")))
+    if flujo == "genero":
+        return ("hola", "5", aleatorio.choice(("1", "2")))
+    return ENTRADAS[flujo]
+
+
+def _paso_actual(numero):
+    if bot.almacen_sesiones.local:
+        contexto = bot.estado_usuario.get(numero)
+    else:
+        contexto = bot.almacen_sesiones.cargar(numero)[0]
+    return (contexto or {}).get("esperando")
+
+
+def usuario_sintetico(numero, aleatorio, proporcion_guiones, proporcion_ruido):
+    """Genera los mensajes de un usuario; decide cada uno viendo en qué paso va."""
+    flujo = aleatorio.choice(FLUJOS)
+    if aleatorio.random() < proporcion_guiones:
+        yield from GUIONES[flujo]
+        return
+    yield from _entrada_aleatoria(flujo, aleatorio)
+    for _ in range(MAX_MENSAJES_POR_USUARIO):
+        paso = _paso_actual(numero)
+        if paso is None:
+            return
+        if aleatorio.random() < proporcion_ruido:
+            yield aleatorio.choice(RUIDO)
+        yield RESPUESTAS[paso](aleatorio)
+
+
+# =========================================
+# Medición
+# =========================================
+def _percentil(ordenados, p):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+def _rss_max_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KiB, macOS en bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def correr(usuarios, semilla, proporcion_guiones=0.2, proporcion_ruido=0.05):
+    aleatorio = random.Random(semilla)
+    activos = []
+    for i in range(usuarios):
+        numero = f"5215500{i:07d}"
+        activos.append((numero, usuario_sintetico(numero, aleatorio, proporcion_guiones, proporcion_ruido)))
+
+    tiempos = {}
+    huella = hashlib.sha256()
+    mensajes = 0
+    total_ns = 0
+    while activos:
+        siguientes = []
+        for numero, conversacion in activos:
+            mensaje = next(conversacion, None)
+            if mensaje is None:
+                continue
+            paso = _paso_actual(numero) or SIN_PASO
+            inicio = time.perf_counter_ns()
+            respuesta = bot.procesar_mensaje(mensaje, numero)
+            duracion = time.perf_counter_ns() - inicio
+            tiempos.setdefault(paso, []).append(duracion)
+            total_ns += duracion
+            mensajes += 1
+            huella.update(f"{paso}\0{mensaje}\0{respuesta}\0".encode())
+            siguientes.append((numero, conversacion))
+        activos = siguientes
+
+    estados = {}
+    for paso, muestras in sorted(tiempos.items()):
+        muestras.sort()
+        estados[paso] = {
+            "n": len(muestras),
+            "p50_us": round(_percentil(muestras, 50) / 1000, 1),
+            "p95_us": round(_percentil(muestras, 95) / 1000, 1),
+            "p99_us": round(_percentil(muestras, 99) / 1000, 1),
+        }
+    return {
+        "usuarios": usuarios,
+        "semilla": semilla,
+        "sesiones": bot.SESIONES_BACKEND,
+        "python": platform.python_version(),
+        "mensajes": mensajes,
+        "mensajes_por_segundo": round(mensajes / (total_ns / 1e9), 1) if total_ns else 0.0,
+        "rss_max_mb": round(_rss_max_mb(), 1),
+        "huella_respuestas": huella.hexdigest(),
+        "estados": estados,
+    }
+
+
+def imprimir(resultado):
+    print(f"{'paso':32s} {'n':>7s} {'p50 µs':>9s} {'p95 µs':>9s} {'p99 µs':>9s}")
+    for paso, datos in resultado["estados"].items():
+        print(f"{paso:32s} {datos['n']:7d} {datos['p50_us']:9.1f} {datos['p95_us']:9.1f} {datos['p99_us']:9.1f}")
+    print(
+        f"\n{resultado['mensajes']} mensajes de {resultado['usuarios']} usuarios   "
+        f"{resultado['mensajes_por_segundo']:.0f} mensajes/s   RSS máx {resultado['rss_max_mb']:.1f} MB"
+    )
+
+
+def comparar(resultado, base, tolerancia, piso_us, min_muestras):
+    """Lista de regresiones y cambios de `resultado` frente a la línea base."""
+    problemas = []
+    misma_corrida = (base["usuarios"], base["semilla"]) == (resultado["usuarios"], resultado["semilla"])
+    if misma_corrida and base["huella_respuestas"] != resultado["huella_respuestas"]:
+        problemas.append("las respuestas cambiaron con la misma semilla (cambió la máquina de estados o los textos)")
+    nuevos = sorted(set(resultado["estados"]) - set(base["estados"]))
+    perdidos = sorted(set(base["estados"]) - set(resultado["estados"]))
+    if nuevos:
+        problemas.append(f"pasos nuevos: {', '.join(nuevos)}")
+    if perdidos:
+        problemas.append(f"pasos que ya no se visitan: {', '.join(perdidos)}")
+    for paso, antes in base["estados"].items():
+        ahora = resultado["estados"].get(paso)
+        if ahora is None:
+            continue
+        if misma_corrida and ahora["n"] != antes["n"]:
+            problemas.append(f"{paso}: {antes['n']} -> {ahora['n']} mensajes")
+        # Con pocas muestras el p95 es casi el máximo: puro ruido
+        if min(antes["n"], ahora["n"]) < min_muestras:
+            continue
+        if ahora["p95_us"] > antes["p95_us"] * tolerancia and ahora["p95_us"] - antes["p95_us"] > piso_us:
+            problemas.append(f"{paso}: p95 {antes['p95_us']:.1f} -> {ahora['p95_us']:.1f} µs")
+    if resultado["mensajes_por_segundo"] * tolerancia < base["mensajes_por_segundo"]:
+        problemas.append(
+            f"mensajes/s {base['mensajes_por_segundo']:.0f} -> {resultado['mensajes_por_segundo']:.0f}"
+        )
+    return problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=2000)
+    parser.add_argument("--semilla", type=int, default=2024)
+    parser.add_argument("--guardar", metavar="ARCHIVO", help="escribe el resultado como línea base (JSON)")
+    parser.add_argument("--comparar", metavar="ARCHIVO", help="compara contra una línea base guardada")
+    parser.add_argument("--tolerancia", type=float, default=1.5,
+                        help="cuántas veces más lento puede ser un p95 antes de marcarlo (1.5 por defecto)")
+    parser.add_argument("--piso-us", type=float, default=50.0,
+                        help="diferencias de p95 menores a esto (µs) se ignoran, son ruido")
+    parser.add_argument("--min-muestras", type=int, default=50,
+                        help="pasos con menos mensajes que esto no se comparan por latencia")
+    args = parser.parse_args()
+
+    base = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            base = json.load(archivo)
+        # Misma corrida que la línea base, para que la comparación tenga sentido
+        args.usuarios, args.semilla = base["usuarios"], base["semilla"]
+
+    resultado = correr(args.usuarios, args.semilla)
+    imprimir(resultado)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as archivo:
+            json.dump(resultado, archivo, ensure_ascii=False, indent=2)
+        print(f"Línea base guardada en {args.guardar}")
+
+    if base is not None:
+        problemas = comparar(resultado, base, args.tolerancia, args.piso_us, args.min_muestras)
+        if problemas:
+            print("\nCambios frente a la línea base:")
+            for problema in problemas:
+                print(f"  - {problema}")
+            sys.exit(1)
+        print("\nSin regresiones frente a la línea base.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Mide cuánta memoria cuesta cada conversación viva: deja a muchos usuarios
+sintéticos (los de benchmark_conversaciones.py) a media conversación, en
+un paso al azar de cualquier flujo, y con tracemalloc reparte los bytes
+por usuario entre:
+
+  - el contexto (la Sesion de estado_usuario, con sus valores), y lo que
+    pesaría ese mismo contexto guardado como dict (sin las claves viejas
+    que los dicts arrastraban de flujos anteriores),
+  - la caducidad de estado_usuario (entrada del OrderedDict y última hora
+    de uso),
+  - _ultimo_mensaje_bot (la máscara del glosario con su caducidad),
+  - el número de teléfono que sirve de llave.
+
+Uso:
+    python benchmark_memoria_sesiones.py                    # 100 000 usuarios
+    python benchmark_memoria_sesiones.py --usuarios 20000 --semilla 7
+"""
+import argparse
+import gc
+import random
+import sys
+import tracemalloc
+
+import benchmark_conversaciones
+
+bot = benchmark_conversaciones.bot
+
+MAX_PASOS = 12
+
+
+def _memoria():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _por_usuario(antes, despues, usuarios):
+    return (antes - despues) / usuarios
+
+
+def medir(usuarios, semilla):
+    aleatorio = random.Random(semilla)
+    bot.enviar_mensaje = lambda *args, **kwargs: None
+    # Primero una pasada corta, para que los cachés y tablas del bot que se
+    # llenan en los primeros mensajes no se cuenten como memoria por usuario
+    for i in range(200):
+        numero = f"5219900{i:07d}"
+        for mensaje in benchmark_conversaciones.usuario_sintetico(numero, aleatorio, 0.2, 0.0):
+            bot.procesar_mensaje(mensaje, numero)
+    bot.estado_usuario.clear()
+    bot._ultimo_mensaje_bot.clear()
+
+    tracemalloc.start()
+    inicio = _memoria()
+    numeros = []
+    for i in range(usuarios):
+        numero = f"5215500{i:07d}"
+        numeros.append(numero)
+        pasos = aleatorio.randint(1, MAX_PASOS)
+        conversacion = benchmark_conversaciones.usuario_sintetico(numero, aleatorio, 0.0, 0.0)
+        for paso, mensaje in enumerate(conversacion, start=1):
+            bot.procesar_mensaje(mensaje, numero)
+            if paso >= pasos:
+                break
+    total = _memoria()
+    con_contexto = len(bot.estado_usuario)
+    contextos = {numero: bot.estado_usuario.get(numero) for numero in list(bot.estado_usuario)}
+    con_datos = sum(1 for contexto in contextos.values() if len(contexto) > 1)
+
+    # Lo que pesa solo la estructura de cada contexto (sin sus valores, que
+    # se comparten), como Sesion y como dict
+    copias = [bot.Sesion.desde_dict(dict(contexto)) for contexto in contextos.values()]
+    estructura_sesion = _memoria() - total
+    copias = [dict(contexto) for contexto in contextos.values()]
+    estructura_dict = _memoria() - total
+    del copias
+
+    # Sin los contextos (pero con la misma entrada de caducidad por número)
+    vacio = bot.Sesion()
+    for numero in contextos:
+        bot.estado_usuario[numero] = vacio
+    contextos.clear()
+    sin_contextos = _memoria()
+    bot.estado_usuario.clear()
+    sin_estado = _memoria()
+    bot._ultimo_mensaje_bot.clear()
+    sin_glosario = _memoria()
+    numeros.clear()
+    sin_numeros = _memoria()
+    tracemalloc.stop()
+
+    return {
+        "usuarios": usuarios,
+        "con_contexto": con_contexto,
+        "con_datos": con_datos,
+        "total": (total - inicio) / usuarios,
+        "contexto": _por_usuario(total, sin_contextos, usuarios),
+        "contexto_como_dict": _por_usuario(total + estructura_dict, sin_contextos + estructura_sesion, usuarios),
+        "caducidad_estado": _por_usuario(sin_contextos, sin_estado, usuarios),
+        "glosario": _por_usuario(sin_estado, sin_glosario, usuarios),
+        "numero": _por_usuario(sin_glosario, sin_numeros, usuarios),
+        "rss_max_mb": benchmark_conversaciones._rss_max_mb(),
+    }
+
+
+def imprimir(r):
+    print(
+        f"{r['usuarios']} usuarios a media conversación: {r['con_contexto']} con contexto, "
+        f"{r['con_datos']} con algún dato además del paso\n"
+    )
+    print(f"{'bytes por usuario':40s} {r['total']:8.0f}")
+    print(f"  {'contexto (Sesion)':38s} {r['contexto']:8.0f}")
+    print(f"  {'   el mismo contexto como dict':38s} {r['contexto_como_dict']:8.0f}")
+    print(f"  {'caducidad de estado_usuario':38s} {r['caducidad_estado']:8.0f}")
+    print(f"  {'_ultimo_mensaje_bot':38s} {r['glosario']:8.0f}")
+    print(f"  {'número (llave)':38s} {r['numero']:8.0f}")
+    if r["contexto"] > 0:
+        print(f"\nEl contexto como dict pesaría {r['contexto_como_dict'] / r['contexto']:.1f} veces más")
+    print(f"RSS máx {r['rss_max_mb']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=100000)
+    parser.add_argument("--semilla", type=int, default=2024)
+    args = parser.parse_args()
+    if bot.SESIONES_BACKEND != "memoria":
+        sys.exit("Este benchmark mide las sesiones en memoria (BOT_SESIONES=memoria)")
+    imprimir(medir(args.usuarios, args.semilla))
+
+
+if __name__ == "__main__":
+    main()
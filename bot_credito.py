@@ -4,15 +4,61 @@
 # Descripción: Bot educativo para temas de crédito
 # =========================================
 
-from flask import Flask, request, render_template
+from flask import Flask, Response, request, render_template
+import abc
+import atexit
+import csv
+import email.utils
+import functools
+import hashlib
+import io
 import json
+import logging
+import logging.handlers
 import os
+import queue
+import random
 import re
+import sqlite3
+import sys
+import threading
+import time
 import unicodedata
-from collections import deque
-from decimal import Decimal, getcontext, ROUND_HALF_UP
-from math import log
-import requests  # <-- AÑADIDO
+import zlib
+from urllib.parse import urlencode
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal, getcontext, localcontext, ROUND_HALF_UP
+from math import ceil, exp, log, log1p
+
+# =========================================
+# Módulos pesados: se cargan al primer uso
+# =========================================
+# requests y NumPy tardan en importarse y la instancia gratuita se duerme:
+# cada décima de segundo de arranque se suma a la respuesta del primer
+# webhook (y WhatsApp reintenta si tardamos). Por eso no se importan arriba:
+# requests se precarga en un hilo aparte apenas arranca la app (ver
+# _iniciar_precarga) y NumPy, que solo usan los cálculos por lotes, se carga
+# la primera vez que se llaman.
+requests = None
+numpy = None
+
+def _cargar_requests():
+    global requests
+    if requests is None:
+        import requests as modulo
+        requests = modulo
+    return requests
+
+def _cargar_numpy():
+    global numpy
+    if numpy is None:
+        import numpy as modulo
+        numpy = modulo
+    return numpy
 
 # Quita signos de puntuación y espacios sueltos al inicio/final de un mensaje
 # (¡Hola!, Hola., ¿menú? etc. deben reconocerse igual que "hola").
@@ -28,6 +74,475 @@ TOKEN = os.environ.get('WHATSAPP_TOKEN')
 PHONE_NUMBER_ID = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
 VERIFY_TOKEN = os.environ.get('WHATSAPP_VERIFY_TOKEN', 'arrocito2024')
 
+# =========================================
+# Bitácora (logs) estructurada
+# =========================================
+# Cada evento se escribe como UNA línea JSON ({"ts", "nivel", "evento", ...}).
+# Quien registra el evento solo lo deja en una cola; un hilo aparte lo
+# convierte a JSON y lo escribe, así la petición nunca espera por stdout. Si
+# la cola se llena, el evento se descarta (y se cuenta) en vez de bloquear.
+#
+# Los eventos informativos más frecuentes se muestrean (BOT_LOG_MUESTREO,
+# por ejemplo "webhook_recibido=0.05,mensaje_enviado=1"); las advertencias y
+# errores siempre se escriben. El número de teléfono nunca se escribe tal
+# cual: se reemplaza por un hash corto, suficiente para seguir una misma
+# conversación en los logs sin exponer el número. El hash lleva una clave
+# secreta (BOT_LOG_SAL): sin ella bastaría probar los ~10^10 números posibles
+# para recuperar el de cada hash. Si no se configura, cada proceso usa una
+# clave al azar, y entonces el mismo número no se puede seguir entre workers
+# ni entre reinicios. El texto de los mensajes (que puede traer cifras
+# personales) solo se incluye con BOT_LOG_INCLUIR_TEXTO=1.
+LOG_NIVEL = os.environ.get('BOT_LOG_NIVEL', 'INFO').upper()
+LOG_TAMANO_COLA = int(os.environ.get('BOT_LOG_TAMANO_COLA', '10000'))
+LOG_INCLUIR_TEXTO = os.environ.get('BOT_LOG_INCLUIR_TEXTO', '0') == '1'
+LOG_SAL = os.environ.get('BOT_LOG_SAL')
+
+_MUESTREO_LOG_DEFAULT = {
+    "webhook_recibido": 0.1,
+    "webhook_atendido": 0.1,
+    "mensaje_enviado": 0.1,
+}
+
+def _leer_muestreo_log(valor):
+    muestreo = dict(_MUESTREO_LOG_DEFAULT)
+    for parte in (valor or "").split(","):
+        evento, _, tasa = parte.partition("=")
+        try:
+            muestreo[evento.strip()] = min(1.0, max(0.0, float(tasa)))
+        except ValueError:
+            continue
+    return muestreo
+
+LOG_MUESTREO = _leer_muestreo_log(os.environ.get('BOT_LOG_MUESTREO'))
+
+# blake2s admite claves de hasta 32 bytes: la sal configurada se reduce a eso
+_CLAVE_LOG = hashlib.blake2s(LOG_SAL.encode()).digest() if LOG_SAL else os.urandom(32)
+
+def _ocultar_numero(numero):
+    return hashlib.blake2s(str(numero).encode(), digest_size=6, key=_CLAVE_LOG).hexdigest()
+
+class _FormateadorJSON(logging.Formatter):
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            evento = record.msg
+        else:
+            evento = {"evento": "log", "mensaje": record.getMessage()}
+        linea = {
+            "ts": round(record.created, 3),
+            "nivel": record.levelname.lower(),
+            "evento": evento.get("evento"),
+        }
+        linea.update(evento)
+        return json.dumps(linea, ensure_ascii=False, default=str)
+
+class _ManejadorColaLog(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # El formato a JSON se hace en el hilo escritor, no en la petición.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            global _eventos_log_descartados
+            _eventos_log_descartados += 1
+
+_eventos_log_descartados = 0
+_logger = logging.getLogger("bot_credito")
+_logger.setLevel(LOG_NIVEL)
+_logger.propagate = False
+_escritor_log = None
+_pid_escritor_log = None
+_candado_log = threading.Lock()
+
+def _iniciar_log():
+    """
+    Arranca el hilo escritor la primera vez que se registra algo en cada
+    proceso (igual que la ingesta, para que funcione con gunicorn --preload).
+    """
+    global _escritor_log, _pid_escritor_log
+    with _candado_log:
+        pid = os.getpid()
+        if _escritor_log is not None and _pid_escritor_log == pid:
+            return
+        cola = queue.Queue(maxsize=LOG_TAMANO_COLA)
+        salida = logging.StreamHandler(sys.stdout)
+        salida.setFormatter(_FormateadorJSON())
+        for manejador in list(_logger.handlers):
+            _logger.removeHandler(manejador)
+        _logger.addHandler(_ManejadorColaLog(cola))
+        _escritor_log = logging.handlers.QueueListener(cola, salida)
+        _escritor_log.start()
+        _pid_escritor_log = pid
+
+def detener_log():
+    """Escribe lo que quede pendiente en la cola de logs y detiene el hilo."""
+    global _escritor_log
+    with _candado_log:
+        if _escritor_log is not None and _pid_escritor_log == os.getpid():
+            _escritor_log.stop()
+        _escritor_log = None
+
+# Se registra antes que cualquier otro apagado, así corre al último y alcanza
+# a escribir los eventos que generen los demás al terminar.
+atexit.register(detener_log)
+
+def registrar_evento(evento, nivel=logging.INFO, **campos):
+    """
+    Registra un evento estructurado. Los campos con número de teléfono se
+    ocultan, y el campo "texto" solo se incluye si BOT_LOG_INCLUIR_TEXTO=1.
+    """
+    if not _logger.isEnabledFor(nivel):
+        return
+    if nivel < logging.WARNING:
+        tasa = LOG_MUESTREO.get(evento, 1.0)
+        if tasa < 1.0 and random.random() >= tasa:
+            return
+    if _pid_escritor_log != os.getpid():
+        _iniciar_log()
+    if campos.get("numero") is not None:
+        campos["numero"] = _ocultar_numero(campos["numero"])
+    if "texto" in campos and not LOG_INCLUIR_TEXTO:
+        campos["texto_longitud"] = len(campos.pop("texto") or "")
+    campos["evento"] = evento
+    _logger.log(nivel, campos)
+
+def eventos_log_descartados():
+    """Cuántos eventos se tiraron porque la cola de logs estaba llena."""
+    return _eventos_log_descartados
+
+# =========================================
+# Métricas para Prometheus (/metrics)
+# =========================================
+# Contadores e histogramas de latencia en el formato de texto de Prometheus.
+# Para no agregar contención en cada mensaje, cada hilo acumula en su propio
+# fragmento (sin candados) y /metrics suma todos los fragmentos al leer; el
+# candado solo se toma al crear el fragmento de un hilo nuevo. Los
+# fragmentos de hilos que ya terminaron se juntan en uno solo, para que los
+# servidores que abren un hilo por petición no los acumulen sin fin.
+# Cada proceso (worker de gunicorn) expone sus propias métricas.
+# BOT_METRICAS=0 las apaga.
+METRICAS = os.environ.get('BOT_METRICAS', '1') == '1'
+
+# Límites superiores (en segundos) de las cubetas de los histogramas
+CUBETAS_METRICAS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_AYUDA_METRICAS = {
+    "bot_webhook_duracion_segundos": ("histogram", "Duración de cada POST a /webhook, por tipo de notificación."),
+    "bot_procesar_mensaje_segundos": ("histogram", "Tiempo de la lógica de la conversación por mensaje, por paso (esperando) que lo atendió."),
+    "bot_calculo_segundos": ("histogram", "Tiempo dentro de cada función calcular_*."),
+    "bot_envio_graph_segundos": ("histogram", "Latencia total de cada envío a la Graph API, con reintentos."),
+    "bot_envios_total": ("counter", "Envíos a la Graph API por código HTTP final."),
+    "bot_envio_reintentos_total": ("counter", "Reintentos de envío a la Graph API."),
+    "bot_dedup_aciertos_total": ("counter", "Webhooks ignorados por ser reenvíos de un mensaje ya procesado."),
+    "bot_dedup_consultas_total": ("counter", "Ids de mensaje revisados contra el deduplicador."),
+    "bot_sesiones_vivas": ("gauge", "Conversaciones en curso: las de este proceso, o las de todos los workers con BOT_SESIONES=sqlite."),
+    "bot_cola_ingesta_mensajes": ("gauge", "Mensajes esperando en las colas de ingesta de este proceso."),
+    "bot_log_eventos_descartados_total": ("counter", "Eventos de log tirados porque la cola de logs estaba llena."),
+    "bot_entrega_avisos_total": ("counter", "Avisos de estado (sent/delivered/read/failed) de mensajes enviados por este proceso."),
+    "bot_entrega_demora_segundos_total": ("counter", "Suma de la demora desde el envío hasta cada aviso de estado."),
+    "bot_entrega_demora_max_segundos": ("gauge", "Demora máxima desde el envío hasta cada aviso de estado."),
+    "bot_entrega_pendientes": ("gauge", "Mensajes enviados que todavía esperan su aviso de leído o fallido."),
+}
+
+class _FragmentoMetricas:
+    __slots__ = ("hilo", "histogramas", "contadores")
+
+    def __init__(self, hilo):
+        self.hilo = hilo
+        # (nombre, etiquetas) -> [conteo por cubeta..., conteo en +Inf, suma]
+        self.histogramas = {}
+        # (nombre, etiquetas) -> valor
+        self.contadores = {}
+
+_metricas_locales = threading.local()
+_fragmentos_metricas = []
+_fragmento_retirado = _FragmentoMetricas(None)
+_candado_metricas = threading.Lock()
+
+def _sumar_fragmento(destino, origen):
+    for clave, cubetas in list(origen.histogramas.items()):
+        acumulado = destino.histogramas.get(clave)
+        if acumulado is None:
+            destino.histogramas[clave] = list(cubetas)
+        else:
+            for i, valor in enumerate(cubetas):
+                acumulado[i] += valor
+    for clave, valor in list(origen.contadores.items()):
+        destino.contadores[clave] = destino.contadores.get(clave, 0) + valor
+
+def _retirar_fragmentos_muertos():
+    """Junta en _fragmento_retirado los fragmentos de hilos que ya terminaron (con el candado tomado)."""
+    vivos = []
+    for fragmento in _fragmentos_metricas:
+        if fragmento.hilo.is_alive():
+            vivos.append(fragmento)
+        else:
+            _sumar_fragmento(_fragmento_retirado, fragmento)
+    _fragmentos_metricas[:] = vivos
+
+def _fragmento_del_hilo():
+    fragmento = getattr(_metricas_locales, "fragmento", None)
+    if fragmento is None:
+        fragmento = _FragmentoMetricas(threading.current_thread())
+        with _candado_metricas:
+            if len(_fragmentos_metricas) >= 64:
+                _retirar_fragmentos_muertos()
+            _fragmentos_metricas.append(fragmento)
+        _metricas_locales.fragmento = fragmento
+    return fragmento
+
+def observar_metrica(nombre, etiquetas, segundos):
+    """Suma una observación (en segundos) al histograma `nombre` con esas etiquetas (tupla)."""
+    histogramas = _fragmento_del_hilo().histogramas
+    cubetas = histogramas.get((nombre, etiquetas))
+    if cubetas is None:
+        cubetas = histogramas[(nombre, etiquetas)] = [0] * (len(CUBETAS_METRICAS) + 2)
+    cubetas[bisect_left(CUBETAS_METRICAS, segundos)] += 1
+    cubetas[-1] += segundos
+
+def contar_metrica(nombre, etiquetas=(), cantidad=1):
+    contadores = _fragmento_del_hilo().contadores
+    clave = (nombre, etiquetas)
+    contadores[clave] = contadores.get(clave, 0) + cantidad
+
+def medir_calculo(funcion):
+    """Decorador: registra cuánto tarda cada llamada a la función en bot_calculo_segundos."""
+    etiquetas = (funcion.__name__,)
+
+    @functools.wraps(funcion)
+    def medida(*args, **kwargs):
+        if not METRICAS:
+            return funcion(*args, **kwargs)
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            observar_metrica("bot_calculo_segundos", etiquetas, time.perf_counter() - inicio)
+    return medida
+
+# Nombre de la etiqueta de cada métrica (todas tienen a lo más una)
+_ETIQUETA_METRICAS = {
+    "bot_webhook_duracion_segundos": "tipo",
+    "bot_procesar_mensaje_segundos": "esperando",
+    "bot_calculo_segundos": "funcion",
+    "bot_envios_total": "status",
+    "bot_entrega_avisos_total": "estado",
+    "bot_entrega_demora_segundos_total": "estado",
+    "bot_entrega_demora_max_segundos": "estado",
+}
+
+def _etiquetas_prometheus(nombre, etiquetas, extra=""):
+    partes = []
+    if etiquetas:
+        valor = str(etiquetas[0]).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{_ETIQUETA_METRICAS[nombre]}="{valor}"')
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+def _agregar_medidas_actuales(contadores):
+    """Lo que no se cuenta al vuelo sino que se lee al momento de /metrics."""
+    contadores[("bot_sesiones_vivas", ())] = (
+        len(estado_usuario) if almacen_sesiones.local else almacen_sesiones.contar()
+    )
+    contadores[("bot_dedup_consultas_total", ())] = estadisticas_dedup()["consultas"]
+    contadores[("bot_cola_ingesta_mensajes", ())] = profundidad_cola_ingesta()
+    contadores[("bot_log_eventos_descartados_total", ())] = eventos_log_descartados()
+    if MEDIR_ENTREGA:
+        entrega = estadisticas_entrega()
+        contadores[("bot_entrega_pendientes", ())] = entrega["pendientes"]
+        for estado, stats in entrega["por_estado"].items():
+            contadores[("bot_entrega_avisos_total", (estado,))] = stats["conteo"]
+            contadores[("bot_entrega_demora_segundos_total", (estado,))] = round(stats["total_s"], 6)
+            contadores[("bot_entrega_demora_max_segundos", (estado,))] = round(stats["max_s"], 6)
+
+def texto_metricas():
+    """Todas las métricas de este proceso en el formato de texto de Prometheus."""
+    total = _FragmentoMetricas(None)
+    with _candado_metricas:
+        _retirar_fragmentos_muertos()
+        _sumar_fragmento(total, _fragmento_retirado)
+        for fragmento in _fragmentos_metricas:
+            _sumar_fragmento(total, fragmento)
+    _agregar_medidas_actuales(total.contadores)
+
+    por_nombre = {}
+    for (nombre, etiquetas), cubetas in total.histogramas.items():
+        por_nombre.setdefault(nombre, []).append((etiquetas, cubetas))
+    for (nombre, etiquetas), valor in total.contadores.items():
+        por_nombre.setdefault(nombre, []).append((etiquetas, valor))
+
+    lineas = []
+    for nombre, (tipo, ayuda) in _AYUDA_METRICAS.items():
+        series = por_nombre.get(nombre)
+        if not series:
+            continue
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for etiquetas, dato in sorted(series, key=lambda serie: serie[0]):
+            if tipo != "histogram":
+                lineas.append(f"{nombre}{_etiquetas_prometheus(nombre, etiquetas)} {dato}")
+                continue
+            acumulado = 0
+            for limite, conteo in zip(CUBETAS_METRICAS, dato):
+                acumulado += conteo
+                cubeta = _etiquetas_prometheus(nombre, etiquetas, 'le="%s"' % limite)
+                lineas.append(f"{nombre}_bucket{cubeta} {acumulado}")
+            acumulado += dato[-2]
+            cubeta = _etiquetas_prometheus(nombre, etiquetas, 'le="+Inf"')
+            lineas.append(f"{nombre}_bucket{cubeta} {acumulado}")
+            lineas.append(f"{nombre}_sum{_etiquetas_prometheus(nombre, etiquetas)} {dato[-1]:.9f}")
+            lineas.append(f"{nombre}_count{_etiquetas_prometheus(nombre, etiquetas)} {acumulado}")
+    return "\n".join(lineas) + "\n"
+
+@app.route('/metrics')
+def metrics():
+    return Response(texto_metricas(), mimetype="text/plain; version=0.0.4")
+
+# =========================================
+# Perfilado por muestreo de /webhook
+# =========================================
+# Para saber en qué se va el tiempo de un webhook lento (cálculos con
+# Decimal, la cadena de estados, los logs o el envío a la Graph API) se
+# puede perfilar una fracción de los POST a /webhook. Mientras dura una
+# petición muestreada, sys.setprofile registra cada llamada (también las de
+# C, como el socket o los métodos de Decimal) en los hilos que la atienden,
+# y al terminar la petición se agregan al archivo de pilas colapsadas de
+# este proceso, BOT_PERFIL_DIR/perfil-<pid>.folded: una línea
+# "paso;funcion;funcion;... nanosegundos" por pila, donde paso es el
+# contexto["esperando"] del mensaje que se estaba atendiendo ("webhook"
+# antes de llegar a la conversación). Ese formato lo leen flamegraph.pl,
+# speedscope e inferno; resumen_perfil.py saca las funciones más costosas
+# de cada paso.
+#
+# Se mide cada llamada y no con muestras de la pila cada tantos ms porque
+# un mensaje se atiende en decenas de microsegundos: un muestreador por
+# tiempo casi nunca caería dentro. Lo que se muestrea son las peticiones.
+#
+# BOT_PERFIL es la fracción de peticiones que se perfilan (0, el valor por
+# defecto, lo apaga). Con BOT_PERFIL_CABECERA=1 también se perfila toda
+# petición que traiga la cabecera "X-Bot-Perfil: 1"; es para el entorno
+# local de carga_webhook.py, no para producción. Apagado no cuesta nada:
+# los ganchos de Flask ni siquiera se registran.
+PERFIL_FRACCION = float(os.environ.get('BOT_PERFIL', '0'))
+PERFIL_CABECERA = os.environ.get('BOT_PERFIL_CABECERA', '0') == '1'
+PERFIL_DIR = os.environ.get('BOT_PERFIL_DIR', 'perfiles')
+PERFIL_ACTIVO = PERFIL_FRACCION > 0 or PERFIL_CABECERA
+
+_perfil_local = threading.local()
+_candado_perfil = threading.Lock()
+_nombres_perfil = {}
+
+def _nombre_llamada(frame, evento, argumento):
+    if evento == "call":
+        codigo = frame.f_code
+        nombre = _nombres_perfil.get(codigo)
+        if nombre is None:
+            modulo = frame.f_globals.get("__name__", "?")
+            nombre = _nombres_perfil[codigo] = f"{modulo}.{getattr(codigo, 'co_qualname', codigo.co_name)}"
+        return nombre
+    # c_call: argumento es la función de C
+    modulo = getattr(argumento, "__module__", None)
+    if modulo is None:
+        modulo = type(getattr(argumento, "__self__", None)).__module__
+    return f"{modulo}.{getattr(argumento, '__qualname__', '?')}"
+
+class _PerfilHilo:
+    """Tiempos por pila de un hilo mientras atiende una petición muestreada."""
+    __slots__ = ("etiqueta", "pila", "tiempos")
+
+    def __init__(self, etiqueta):
+        self.etiqueta = etiqueta
+        # [nombre, inicio en ns, ns en llamadas hijas] por cada llamada abierta
+        self.pila = []
+        # "paso;funcion;funcion;..." -> ns propios (sin contar las hijas)
+        self.tiempos = {}
+
+    def __call__(self, frame, evento, argumento):
+        ahora = time.perf_counter_ns()
+        if evento == "call" or evento == "c_call":
+            self.pila.append([_nombre_llamada(frame, evento, argumento), ahora, 0])
+            return
+        # return, c_return o c_exception. Con la pila vacía es el regreso de
+        # una llamada que empezó antes de activar el perfil: no se cuenta.
+        if not self.pila:
+            return
+        clave = self.etiqueta + ";" + ";".join(llamada[0] for llamada in self.pila)
+        _, inicio, hijas = self.pila.pop()
+        total = ahora - inicio
+        self.tiempos[clave] = self.tiempos.get(clave, 0) + total - hijas
+        if self.pila:
+            self.pila[-1][2] += total
+
+def perfil_en_curso():
+    """True si el hilo actual está atendiendo una petición perfilada."""
+    return getattr(_perfil_local, "perfil", None) is not None
+
+def _iniciar_perfil_hilo(etiqueta="webhook"):
+    perfil = _PerfilHilo(etiqueta)
+    _perfil_local.perfil = perfil
+    sys.setprofile(perfil)
+
+def _terminar_perfil_hilo():
+    sys.setprofile(None)
+    perfil = _perfil_local.perfil
+    _perfil_local.perfil = None
+    lineas = "".join(f"{pila} {ns}\n" for pila, ns in perfil.tiempos.items() if ns > 0)
+    ruta = os.path.join(PERFIL_DIR, f"perfil-{os.getpid()}.folded")
+    try:
+        with _candado_perfil:
+            os.makedirs(PERFIL_DIR, exist_ok=True)
+            with open(ruta, "a", encoding="utf-8") as archivo:
+                archivo.write(lineas)
+    except OSError as e:
+        registrar_evento("perfil_no_guardado", logging.WARNING, ruta=ruta, error=str(e))
+
+def etiquetar_perfil(paso):
+    """
+    Los tiempos que siguen en este hilo se cuentan para `paso`. Devuelve la
+    etiqueta que había (None si el hilo no se está perfilando), para
+    devolvérsela al terminar el paso.
+    """
+    perfil = getattr(_perfil_local, "perfil", None)
+    if perfil is None:
+        return None
+    anterior, perfil.etiqueta = perfil.etiqueta, paso
+    return anterior
+
+def con_perfil(funcion):
+    """
+    Envuelve `funcion` para que se perfile en el hilo donde corra. Sirve
+    para seguir perfilando una petición muestreada cuando parte del trabajo
+    se pasa a otro hilo (lotes en paralelo, trabajadores de ingesta).
+    """
+    @functools.wraps(funcion)
+    def perfilada(*args, **kwargs):
+        _iniciar_perfil_hilo()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            _terminar_perfil_hilo()
+    return perfilada
+
+if PERFIL_ACTIVO:
+    @app.before_request
+    def _perfil_antes_de_peticion():
+        if request.endpoint != "webhook" or request.method != "POST":
+            return
+        if random.random() < PERFIL_FRACCION or (
+            PERFIL_CABECERA and request.headers.get("X-Bot-Perfil") == "1"
+        ):
+            _iniciar_perfil_hilo()
+
+    @app.teardown_request
+    def _perfil_al_terminar_peticion(error=None):
+        if perfil_en_curso():
+            _terminar_perfil_hilo()
+
 # Ruta para validar que el sitio está activo (solución para Meta y og:image)
 @app.route('/')
 def index():
@@ -38,12 +553,521 @@ def index():
 def privacidad():
     return render_template('privacidad.html')
 
-estado_usuario = {}
+# =========================================
+# Sesión de cada conversación
+# =========================================
+# El contexto de cada persona (estado_usuario[numero]) se usa como un dict:
+# contexto["esperando"], contexto["monto"], contexto.get(...), "abono" in
+# contexto. Pero como dict cada contexto pesa 184 bytes aunque solo tenga
+# "esperando", y se quedaba con las claves de los flujos anteriores. Por
+# eso el contexto es una Sesion: un objeto con __slots__ (48 bytes) que
+# guarda "esperando" y, en otro objeto con __slots__ (uno por cada familia
+# de flujos), los datos del flujo en curso. Al guardar un dato de otro
+# flujo, los del flujo anterior se descartan.
+
+class _DatosFlujo:
+    __slots__ = ()
+
+class _DatosCredito(_DatosFlujo):
+    __slots__ = (
+        "monto", "tasa_anual", "anios", "plazo", "tasa", "pago_fijo", "frecuencia_label",
+        "abono", "desde", "frecuencia_comando", "periodos_comando", "periodos_por_anio",
+    )
+
+class _DatosTienda(_DatosFlujo):
+    __slots__ = ("precio_contado", "pago_fijo_tienda", "numero_pagos_tienda", "periodos_anuales")
+
+class _DatosCapacidad(_DatosFlujo):
+    __slots__ = (
+        "ingreso", "pagos_fijos", "deuda_revolvente", "riesgo", "porcentaje_riesgo",
+        "capacidad_mensual", "tasa_anual_simular", "anios_simular", "monto_maximo",
+        "monto_deseado", "tasa_anual_deseada", "anios_deseado",
+    )
+
+class _DatosAhorro(_DatosFlujo):
+    __slots__ = ("ahorro_meta", "ahorro_inicial", "ahorro_tiempo_numero", "ahorro_meses_totales")
+
+class _DatosInversion(_DatosFlujo):
+    __slots__ = (
+        "inversion_monto_inicial", "inversion_aportacion", "inversion_tasa_anual",
+        "inversion_tiempo_numero", "inversion_anios",
+    )
+
+class _DatosJubilacion(_DatosFlujo):
+    __slots__ = (
+        "jubilacion_meta", "jubilacion_ahorro_actual", "jubilacion_tasa_anual",
+        "jubilacion_tiempo_numero", "jubilacion_anios",
+    )
+
+class _DatosSalud(_DatosFlujo):
+    __slots__ = ("salud_dimensiones", "salud_dim_idx", "salud_preg_idx", "salud_puntajes")
+
+# Cada campo pertenece a un solo flujo
+_FLUJO_DE_CAMPO = {
+    campo: flujo
+    for flujo in (
+        _DatosCredito, _DatosTienda, _DatosCapacidad, _DatosAhorro,
+        _DatosInversion, _DatosJubilacion, _DatosSalud,
+    )
+    for campo in flujo.__slots__
+}
+
+class Sesion(MutableMapping):
+    """
+    Contexto de conversación de un número (ver arriba). Solo acepta
+    "esperando" y los campos de los flujos; guardar un campo desconocido es
+    un error de programación (KeyError).
+    """
+    __slots__ = ("esperando", "datos")
+
+    def __init__(self, esperando=None, **campos):
+        self.datos = None
+        if esperando is not None:
+            self.esperando = esperando
+        for campo, valor in campos.items():
+            self[campo] = valor
+
+    @classmethod
+    def desde_dict(cls, valores):
+        """
+        Sesion con los campos de un dict (por ejemplo, leído del almacén).
+        Los contextos que se guardaron como dict podían mezclar datos de
+        varios flujos: se conservan los del flujo con más campos, y las
+        claves que ya no existen se ignoran.
+        """
+        sesion = cls(valores.get("esperando"))
+        por_flujo = {}
+        for campo, valor in valores.items():
+            flujo = _FLUJO_DE_CAMPO.get(campo)
+            if flujo is not None:
+                por_flujo.setdefault(flujo, []).append((campo, valor))
+        if por_flujo:
+            for campo, valor in max(por_flujo.values(), key=len):
+                sesion[campo] = valor
+        return sesion
+
+    def __getitem__(self, campo):
+        try:
+            return self.esperando if campo == "esperando" else getattr(self.datos, campo)
+        except AttributeError:
+            raise KeyError(campo) from None
+
+    def __setitem__(self, campo, valor):
+        if campo == "esperando":
+            self.esperando = valor
+            return
+        flujo = _FLUJO_DE_CAMPO.get(campo)
+        if flujo is None:
+            raise KeyError(f"Campo de sesión desconocido: {campo!r}")
+        if type(self.datos) is not flujo:
+            # Empieza otro flujo: los datos del anterior ya no sirven
+            self.datos = flujo()
+        setattr(self.datos, campo, valor)
+
+    def __delitem__(self, campo):
+        try:
+            delattr(self if campo == "esperando" else self.datos, campo)
+        except AttributeError:
+            raise KeyError(campo) from None
+
+    def __iter__(self):
+        if hasattr(self, "esperando"):
+            yield "esperando"
+        if self.datos is not None:
+            for campo in type(self.datos).__slots__:
+                if hasattr(self.datos, campo):
+                    yield campo
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Sesion({dict(self)!r})"
+
+# =========================================
+# Sesiones con caducidad
+# =========================================
+# Sin límite, estado_usuario y _ultimo_mensaje_bot crecerían para siempre:
+# cada número que alguna vez escribió se quedaría con su contexto y con los
+# términos del glosario de su último mensaje. Este dict "olvida":
+#   - las sesiones que llevan más de SESIONES_TTL_HORAS sin usarse, y
+#   - las menos usadas recientemente si hay más de SESIONES_MAX.
+# Las entradas se guardan en orden de último uso, así que las vencidas siempre
+# están al principio: revisarlas cuesta solo lo que haya que borrar.
+SESIONES_TTL_HORAS = float(os.environ.get('BOT_SESIONES_TTL_HORAS', '24'))
+SESIONES_MAX = int(os.environ.get('BOT_SESIONES_MAX', '100000'))
+SESIONES_BARRIDO_S = float(os.environ.get('BOT_SESIONES_BARRIDO_S', '60'))
+
+class DiccionarioSesiones(MutableMapping):
+    """
+    Dict por número con caducidad por inactividad (ttl_s) y un máximo de
+    entradas (se desaloja la menos usada recientemente). Una entrada vencida
+    se borra en cuanto alguien la consulta, y además cada barrido_s segundos
+    se barren todas las vencidas al escribir.
+    """
+
+    def __init__(self, ttl_s, max_entradas, barrido_s=60.0, reloj=time.monotonic):
+        self.ttl_s = ttl_s
+        self.max_entradas = max_entradas
+        self.barrido_s = barrido_s
+        self._reloj = reloj
+        self._datos = OrderedDict()  # numero -> (valor, último uso)
+        self._candado = threading.RLock()
+        self._proximo_barrido = reloj() + barrido_s
+        self.expiradas = 0
+        self.desalojadas = 0
+
+    def _vigente(self, numero, ahora):
+        entrada = self._datos.get(numero)
+        if entrada is None:
+            return None
+        if ahora - entrada[1] > self.ttl_s:
+            del self._datos[numero]
+            self.expiradas += 1
+            return None
+        return entrada
+
+    def __getitem__(self, numero):
+        with self._candado:
+            ahora = self._reloj()
+            entrada = self._vigente(numero, ahora)
+            if entrada is None:
+                raise KeyError(numero)
+            self._datos[numero] = (entrada[0], ahora)
+            self._datos.move_to_end(numero)
+            return entrada[0]
+
+    def __contains__(self, numero):
+        with self._candado:
+            return self._vigente(numero, self._reloj()) is not None
+
+    def __setitem__(self, numero, valor):
+        with self._candado:
+            ahora = self._reloj()
+            self._datos[numero] = (valor, ahora)
+            self._datos.move_to_end(numero)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.desalojadas += 1
+            if ahora >= self._proximo_barrido:
+                self._barrer(ahora)
+
+    def __delitem__(self, numero):
+        with self._candado:
+            del self._datos[numero]
+
+    def __iter__(self):
+        with self._candado:
+            return iter(list(self._datos))
+
+    def __len__(self):
+        return len(self._datos)
+
+    def clear(self):
+        # El clear() de MutableMapping borra de una en una con popitem(), y
+        # cada popitem() copia todas las llaves en __iter__
+        with self._candado:
+            self._datos.clear()
+
+    def _barrer(self, ahora):
+        while self._datos:
+            numero, (_, ultimo_uso) = next(iter(self._datos.items()))
+            if ahora - ultimo_uso <= self.ttl_s:
+                break
+            del self._datos[numero]
+            self.expiradas += 1
+        self._proximo_barrido = ahora + self.barrido_s
+
+    def barrer(self):
+        """Borra ya todas las entradas vencidas (sin esperar al barrido)."""
+        with self._candado:
+            self._barrer(self._reloj())
+
+    def estadisticas(self):
+        return {
+            "entradas": len(self._datos),
+            "expiradas": self.expiradas,
+            "desalojadas": self.desalojadas,
+        }
+
+def _nuevo_diccionario_sesiones():
+    return DiccionarioSesiones(SESIONES_TTL_HORAS * 3600, SESIONES_MAX, SESIONES_BARRIDO_S)
+
+estado_usuario = _nuevo_diccionario_sesiones()
+
+# Guarda, del último mensaje que el bot le envió a cada número, qué términos
+# del glosario mencionaba (como máscara de bits, ver mascara_terminos_glosario),
+# para poder explicarlos "más fácil" si la persona lo pide (ver
+# es_peticion_explicar_mas_facil y _explicar_mas_facil más abajo). Guardar
+# solo eso en vez del texto completo cuesta unos bytes por persona, no KB.
+_ultimo_mensaje_bot = _nuevo_diccionario_sesiones()
+
+# =========================================
+# Almacén de sesiones
+# =========================================
+# estado_usuario y _ultimo_mensaje_bot viven en la memoria de cada proceso.
+# Con un solo worker de gunicorn eso basta, pero con varios, el siguiente
+# mensaje de una persona puede caer en otro worker que no sabe en qué paso
+# de la conversación va. Por eso cada mensaje se atiende así:
+#   1. se trae la sesión de ese número desde el almacén,
+#   2. la lógica de la conversación trabaja sobre estado_usuario como siempre,
+#   3. al terminar, la sesión (modificada) se guarda de vuelta en el almacén.
+# Con el almacén en memoria (el de siempre, para un solo worker) los pasos 1
+# y 3 no copian nada. Con BOT_SESIONES=sqlite, todos los workers de la misma
+# máquina comparten un archivo SQLite en modo WAL (BOT_SESIONES_SQLITE).
+SESIONES_BACKEND = os.environ.get('BOT_SESIONES', 'memoria').lower()
+SESIONES_SQLITE = os.environ.get('BOT_SESIONES_SQLITE', 'sesiones_bot.sqlite3')
+
+def _a_json_sesion(valor):
+    # Los contextos guardan montos y tasas como Decimal: se guardan como texto
+    # para no perder ni un centavo al ir y volver del almacén.
+    if isinstance(valor, Decimal):
+        return {"$decimal": str(valor)}
+    raise TypeError(f"No se puede guardar {type(valor).__name__} en la sesión")
+
+def _de_json_sesion(objeto):
+    if len(objeto) == 1 and "$decimal" in objeto:
+        return Decimal(objeto["$decimal"])
+    return objeto
+
+def serializar_sesion(contexto):
+    """
+    Una Sesion como objeto JSON con solo los campos que tiene puestos, por
+    ejemplo {"esperando":"anios_credito","monto":{"$decimal":"150000"}}. Es
+    el mismo formato que cuando los contextos eran dicts, así que las
+    sesiones guardadas antes se siguen pudiendo leer.
+    """
+    return json.dumps(dict(contexto), default=_a_json_sesion, ensure_ascii=False, separators=(",", ":"))
+
+def deserializar_sesion(texto):
+    return Sesion.desde_dict(json.loads(texto, object_hook=_de_json_sesion))
+
+def _conexion_sqlite_del_hilo(local, ruta, esquema):
+    """
+    Conexión SQLite del hilo actual (SQLite no permite compartirlas entre
+    hilos), en modo WAL para que las lecturas no bloqueen a las escrituras.
+    La primera vez en cada hilo/proceso ejecuta las sentencias de `esquema`.
+    """
+    conexion = getattr(local, "conexion", None)
+    if conexion is not None and local.pid == os.getpid():
+        return conexion
+    conexion = sqlite3.connect(ruta, timeout=5, isolation_level=None)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    conexion.execute("PRAGMA synchronous=NORMAL")
+    for sentencia in esquema:
+        conexion.execute(sentencia)
+    local.conexion = conexion
+    local.pid = os.getpid()
+    return conexion
+
+class AlmacenSesiones(abc.ABC):
+    """
+    Interfaz de un almacén de sesiones: por cada número guarda su contexto
+    de conversación (la Sesion de estado_usuario) y los términos del glosario
+    del último mensaje que le mandó el bot (máscara de bits, un int). Un
+    valor None significa "no hay nada guardado".
+    """
+    # True si el almacén ES estado_usuario / _ultimo_mensaje_bot (no hace
+    # falta copiar la sesión antes ni después de cada mensaje).
+    local = False
+
+    @abc.abstractmethod
+    def cargar(self, numero):
+        """Devuelve (contexto, ultimo_mensaje) de ese número."""
+
+    @abc.abstractmethod
+    def guardar(self, numero, contexto, ultimo_mensaje):
+        """Reemplaza lo guardado de ese número; un valor None queda vacío."""
+
+    @abc.abstractmethod
+    def borrar(self, numero):
+        """Olvida la sesión de ese número."""
+
+    @abc.abstractmethod
+    def contar(self):
+        """Cuántos números tienen una sesión guardada."""
+
+    def cargar_con_version(self, numero):
+        """
+        Como cargar, más la versión de la sesión, para guardarla después con
+        guardar_si_version. En memoria no hace falta: los turnos por número
+        (ver "Turnos por número") ya bastan dentro del proceso.
+        """
+        return (*self.cargar(numero), None)
+
+    def guardar_si_version(self, numero, contexto, ultimo_mensaje, version):
+        """
+        Guarda solo si nadie más guardó la sesión de ese número desde que se
+        cargó con esa versión. Devuelve False si otro la cambió (y no guarda).
+        """
+        self.guardar(numero, contexto, ultimo_mensaje)
+        return True
+
+class AlmacenSesionesMemoria(AlmacenSesiones):
+    """Las sesiones se quedan en los dicts del proceso (un solo worker)."""
+    local = True
+
+    def __init__(self, estados, ultimos):
+        self.estados = estados
+        self.ultimos = ultimos
+
+    def cargar(self, numero):
+        return self.estados.get(numero), self.ultimos.get(numero)
+
+    def guardar(self, numero, contexto, ultimo_mensaje):
+        for destino, valor in ((self.estados, contexto), (self.ultimos, ultimo_mensaje)):
+            if valor is None:
+                destino.pop(numero, None)
+            else:
+                destino[numero] = valor
+
+    def borrar(self, numero):
+        self.estados.pop(numero, None)
+        self.ultimos.pop(numero, None)
+
+    def contar(self):
+        return len(self.estados)
+
+class AlmacenSesionesSQLite(AlmacenSesiones):
+    """
+    Sesiones en un archivo SQLite compartido por todos los workers de la
+    misma máquina.
+    """
+
+    def __init__(self, ruta, ttl_s=None, barrido_s=None):
+        self.ruta = ruta
+        self.ttl_s = SESIONES_TTL_HORAS * 3600 if ttl_s is None else ttl_s
+        self.barrido_s = SESIONES_BARRIDO_S if barrido_s is None else barrido_s
+        self._proximo_barrido = time.time() + self.barrido_s
+        self.expiradas = 0
+        self._local = threading.local()
+        self._agregar_version(self._conexion())  # crea la tabla desde el arranque
+
+    _ESQUEMA = (
+        "CREATE TABLE IF NOT EXISTS sesiones ("
+        " numero TEXT PRIMARY KEY,"
+        " contexto TEXT,"
+        " ultimo_mensaje TEXT,"
+        " actualizado REAL NOT NULL,"
+        " version INTEGER NOT NULL DEFAULT 0)",
+        "CREATE INDEX IF NOT EXISTS sesiones_actualizado ON sesiones (actualizado)",
+    )
+
+    @staticmethod
+    def _agregar_version(conexion):
+        """Las tablas creadas antes no tenían la columna version."""
+        columnas = {fila[1] for fila in conexion.execute("PRAGMA table_info(sesiones)")}
+        if "version" in columnas:
+            return
+        try:
+            conexion.execute("ALTER TABLE sesiones ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # otro worker la agregó al mismo tiempo
+
+    def _conexion(self):
+        return _conexion_sqlite_del_hilo(self._local, self.ruta, self._ESQUEMA)
+
+    def cargar(self, numero):
+        return self.cargar_con_version(numero)[:2]
+
+    def cargar_con_version(self, numero):
+        # version es None si no hay fila
+        fila = self._conexion().execute(
+            "SELECT contexto, ultimo_mensaje, version FROM sesiones WHERE numero = ?", (numero,)
+        ).fetchone()
+        if fila is None:
+            return None, None, None
+        contexto = deserializar_sesion(fila[0]) if fila[0] is not None else None
+        ultimo = fila[1]
+        if ultimo is not None:
+            # La columna es TEXT: la máscara vuelve como "5". Las filas de
+            # antes guardaban el mensaje completo; se convierten aquí mismo.
+            ultimo = int(ultimo) if ultimo.isdigit() else mascara_terminos_glosario(ultimo)
+        return contexto, ultimo, fila[2]
+
+    def guardar(self, numero, contexto, ultimo_mensaje):
+        if contexto is None and ultimo_mensaje is None:
+            self.borrar(numero)
+            return
+        self._conexion().execute(
+            "INSERT INTO sesiones (numero, contexto, ultimo_mensaje, actualizado, version)"
+            " VALUES (?, ?, ?, ?, 1)"
+            " ON CONFLICT(numero) DO UPDATE SET"
+            " contexto = excluded.contexto,"
+            " ultimo_mensaje = excluded.ultimo_mensaje,"
+            " actualizado = excluded.actualizado,"
+            " version = sesiones.version + 1",
+            self._valores(numero, contexto, ultimo_mensaje),
+        )
+        self._barrer_si_toca()
+
+    def guardar_si_version(self, numero, contexto, ultimo_mensaje, version):
+        # Cada sentencia es atómica por sí sola: si otro worker guardó la
+        # sesión de este número en medio, no coincide la versión (o ya hay
+        # fila) y no se escribe nada. Una sesión que termina se queda como
+        # fila vacía en vez de borrarse, para que su versión siga creciendo
+        # (si se borrara y otro la volviera a crear, la versión 1 podría
+        # coincidir con la de una carga vieja); el barrido la quita después.
+        if version is None:
+            if contexto is None and ultimo_mensaje is None:
+                # Nada que guardar: basta con que nadie la haya creado
+                return self._conexion().execute(
+                    "SELECT 1 FROM sesiones WHERE numero = ?", (numero,)
+                ).fetchone() is None
+            cursor = self._conexion().execute(
+                "INSERT INTO sesiones (numero, contexto, ultimo_mensaje, actualizado, version)"
+                " VALUES (?, ?, ?, ?, 1)"
+                " ON CONFLICT(numero) DO NOTHING",
+                self._valores(numero, contexto, ultimo_mensaje),
+            )
+        else:
+            cursor = self._conexion().execute(
+                "UPDATE sesiones SET contexto = ?, ultimo_mensaje = ?, actualizado = ?,"
+                " version = version + 1"
+                " WHERE numero = ? AND version = ?",
+                (*self._valores(numero, contexto, ultimo_mensaje)[1:], numero, version),
+            )
+        self._barrer_si_toca()
+        return cursor.rowcount == 1
+
+    @staticmethod
+    def _valores(numero, contexto, ultimo_mensaje):
+        return (
+            numero,
+            serializar_sesion(contexto) if contexto is not None else None,
+            ultimo_mensaje,
+            time.time(),
+        )
+
+    def _barrer_si_toca(self):
+        if time.time() >= self._proximo_barrido:
+            self.barrer()
+
+    def barrer(self):
+        """Borra las sesiones que llevan más de ttl_s sin usarse."""
+        self._proximo_barrido = time.time() + self.barrido_s
+        cursor = self._conexion().execute(
+            "DELETE FROM sesiones WHERE actualizado < ?", (time.time() - self.ttl_s,)
+        )
+        self.expiradas += cursor.rowcount
+
+    def borrar(self, numero):
+        self._conexion().execute("DELETE FROM sesiones WHERE numero = ?", (numero,))
 
-# Guarda el último mensaje que el bot le envió a cada número, para poder
-# explicarlo "más fácil" si la persona lo pide (ver es_peticion_explicar_mas_facil
-# y _explicar_mas_facil más abajo).
-_ultimo_mensaje_bot = {}
+    def contar(self):
+        return self._conexion().execute(
+            "SELECT COUNT(*) FROM sesiones WHERE contexto IS NOT NULL"
+        ).fetchone()[0]
+
+def crear_almacen_sesiones(backend=None):
+    backend = (backend or SESIONES_BACKEND).lower()
+    if backend == "memoria":
+        return AlmacenSesionesMemoria(estado_usuario, _ultimo_mensaje_bot)
+    if backend == "sqlite":
+        return AlmacenSesionesSQLite(SESIONES_SQLITE)
+    raise ValueError(f"BOT_SESIONES desconocido: {backend!r} (usa 'memoria' o 'sqlite')")
+
+almacen_sesiones = crear_almacen_sesiones()
 
 # =========================================
 # Protección contra mensajes duplicados
@@ -55,9 +1079,127 @@ _ultimo_mensaje_bot = {}
 # despertar para atender la primera petición. Sin esta protección, ese
 # reenvío hace que el bot procese el mismo mensaje dos veces y responda
 # el menú (o cualquier otra respuesta) por duplicado.
-_IDS_PROCESADOS_MAXLEN = 500
-_ids_mensajes_procesados = set()
-_orden_ids_mensajes_procesados = deque()
+#
+# Antes guardábamos solo los últimos 500 ids en un set de cada proceso: con
+# varios workers, o con una ráfaga de más de 500 mensajes, un reenvío se
+# colaba. Ahora recordamos cada id durante una ventana de tiempo
+# (BOT_DEDUP_VENTANA_S, 10 minutos por defecto, de sobra para los reenvíos de
+# WhatsApp), y con BOT_DEDUP=sqlite la memoria es compartida por todos los
+# workers de la máquina.
+DEDUP_BACKEND = os.environ.get('BOT_DEDUP', SESIONES_BACKEND).lower()
+DEDUP_SQLITE = os.environ.get('BOT_DEDUP_SQLITE', SESIONES_SQLITE)
+DEDUP_VENTANA_S = float(os.environ.get('BOT_DEDUP_VENTANA_S', '600'))
+
+class DeduplicadorMemoria:
+    """
+    Ids vistos en este proceso durante los últimos ventana_s segundos. Como
+    los ids entran en orden de llegada, los vencidos siempre están al
+    principio y se purgan sin recorrer todo.
+    """
+
+    def __init__(self, ventana_s, reloj=time.monotonic):
+        self.ventana_s = ventana_s
+        self._reloj = reloj
+        self._vistos = OrderedDict()  # message_id -> momento en que llegó
+        self._candado = threading.Lock()
+
+    def registrar(self, message_id):
+        """True si el id ya se había visto dentro de la ventana; si no, lo anota."""
+        with self._candado:
+            ahora = self._reloj()
+            limite = ahora - self.ventana_s
+            while self._vistos:
+                id_viejo, momento = next(iter(self._vistos.items()))
+                if momento >= limite:
+                    break
+                del self._vistos[id_viejo]
+            if message_id in self._vistos:
+                return True
+            self._vistos[message_id] = ahora
+            return False
+
+    def olvidar(self, message_id):
+        with self._candado:
+            self._vistos.pop(message_id, None)
+
+    def __len__(self):
+        return len(self._vistos)
+
+class DeduplicadorSQLite:
+    """
+    Ids vistos por cualquier worker durante los últimos ventana_s segundos,
+    en una tabla SQLite. La consulta y el registro son UNA sola sentencia
+    atómica sobre la llave primaria: si dos workers reciben el mismo id al
+    mismo tiempo, solo uno gana.
+    """
+
+    _ESQUEMA = (
+        "CREATE TABLE IF NOT EXISTS mensajes_procesados ("
+        " message_id TEXT PRIMARY KEY,"
+        " recibido REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS mensajes_procesados_recibido"
+        " ON mensajes_procesados (recibido)",
+    )
+
+    def __init__(self, ruta, ventana_s):
+        self.ruta = ruta
+        self.ventana_s = ventana_s
+        self._local = threading.local()
+        self._proxima_purga = time.time() + ventana_s
+        self._conexion()
+
+    def _conexion(self):
+        return _conexion_sqlite_del_hilo(self._local, self.ruta, self._ESQUEMA)
+
+    def registrar(self, message_id):
+        ahora = time.time()
+        limite = ahora - self.ventana_s
+        # Inserta el id; si ya existía pero fuera de la ventana, lo renueva.
+        # rowcount == 0 significa que existía DENTRO de la ventana: duplicado.
+        cursor = self._conexion().execute(
+            "INSERT INTO mensajes_procesados (message_id, recibido) VALUES (?, ?)"
+            " ON CONFLICT(message_id) DO UPDATE SET recibido = excluded.recibido"
+            " WHERE mensajes_procesados.recibido < ?",
+            (message_id, ahora, limite),
+        )
+        if ahora >= self._proxima_purga:
+            self._proxima_purga = ahora + self.ventana_s
+            self._conexion().execute(
+                "DELETE FROM mensajes_procesados WHERE recibido < ?", (limite,)
+            )
+        return cursor.rowcount == 0
+
+    def olvidar(self, message_id):
+        self._conexion().execute(
+            "DELETE FROM mensajes_procesados WHERE message_id = ?", (message_id,)
+        )
+
+    def __len__(self):
+        return self._conexion().execute(
+            "SELECT COUNT(*) FROM mensajes_procesados"
+        ).fetchone()[0]
+
+def crear_deduplicador(backend=None):
+    backend = (backend or DEDUP_BACKEND).lower()
+    if backend == "memoria":
+        return DeduplicadorMemoria(DEDUP_VENTANA_S)
+    if backend == "sqlite":
+        return DeduplicadorSQLite(DEDUP_SQLITE, DEDUP_VENTANA_S)
+    raise ValueError(f"BOT_DEDUP desconocido: {backend!r} (usa 'memoria' o 'sqlite')")
+
+deduplicador = crear_deduplicador()
+
+_estadisticas_dedup = {"consultas": 0, "duplicados": 0}
+_candado_estadisticas_dedup = threading.Lock()
+
+def estadisticas_dedup():
+    """Cuántos ids se revisaron, cuántos eran duplicados y la tasa de aciertos."""
+    with _candado_estadisticas_dedup:
+        stats = dict(_estadisticas_dedup)
+    stats["tasa_duplicados"] = (
+        stats["duplicados"] / stats["consultas"] if stats["consultas"] else 0.0
+    )
+    return stats
 
 def ya_fue_procesado(message_id):
     """
@@ -70,18 +1212,27 @@ def ya_fue_procesado(message_id):
     """
     if not message_id:
         return False
-    if message_id in _ids_mensajes_procesados:
-        return True
-    _ids_mensajes_procesados.add(message_id)
-    _orden_ids_mensajes_procesados.append(message_id)
-    if len(_orden_ids_mensajes_procesados) > _IDS_PROCESADOS_MAXLEN:
-        id_viejo = _orden_ids_mensajes_procesados.popleft()
-        _ids_mensajes_procesados.discard(id_viejo)
-    return False
+    duplicado = deduplicador.registrar(message_id)
+    with _candado_estadisticas_dedup:
+        _estadisticas_dedup["consultas"] += 1
+        if duplicado:
+            _estadisticas_dedup["duplicados"] += 1
+    if duplicado and METRICAS:
+        contar_metrica("bot_dedup_aciertos_total")
+    return duplicado
+
+def olvidar_mensaje(message_id):
+    """
+    Deshace ya_fue_procesado para un mensaje que al final NO se atendió, para
+    que el reenvío de WhatsApp sí se procese.
+    """
+    if message_id:
+        deduplicador.olvidar(message_id)
 
 # =========================================
 # Cálculo de pago fijo (tipo Excel)
 # =========================================
+@medir_calculo
 def calcular_pago_fijo_excel(monto, tasa, plazo):
     P = Decimal(str(monto))
     r = Decimal(str(tasa))
@@ -142,6 +1293,7 @@ MENSAJE_FRECUENCIA_JUBILACION = (
     "5️⃣ Otra frecuencia (tú me dices cuántas veces al año)"
 )
 
+@medir_calculo
 def calcular_plazo_y_tasa_periodo(anios, tasa_anual_pct, periodos_por_anio):
     """
     Convierte años + tasa anual (%) + frecuencia de pago en:
@@ -166,6 +1318,7 @@ def _calcular_y_resumir(contexto, tasa_anual_pct, anios, periodos_por_anio, frec
     contexto["tasa"] = tasa_periodo
     contexto["pago_fijo"] = pago
     contexto["frecuencia_label"] = frecuencia_label
+    contexto["periodos_por_anio"] = periodos_por_anio
     return pago, total_pagado, intereses, plazo
 
 def _resolver_frecuencia_flujo1(contexto, frecuencia_label, periodos_por_anio):
@@ -254,7 +1407,132 @@ def _resolver_frecuencia_deseado(contexto, frecuencia_label, periodos_por_anio):
 # =========================================
 # Cálculo del ahorro con abonos extra
 # =========================================
-def calcular_ahorro_por_abonos(monto, tasa, plazo, abono_extra, desde_periodo):
+@medir_calculo
+def calcular_ahorro_por_abonos(monto, tasa, plazo, abono_extra, desde_periodo, metodo="cerrado"):
+    """
+    Compara el total pagado de un crédito sin y con un abono extra constante
+    a capital a partir del periodo desde_periodo. Devuelve
+    (total_sin_abonos, total_con_abonos, ahorro_total, pagos_ahorrados).
+
+    Por defecto usa la fórmula cerrada de una anualidad (metodo="cerrado"),
+    que cuesta lo mismo sin importar cuántos periodos tenga el crédito. La
+    simulación periodo por periodo sigue disponible con metodo="iterativo",
+    como referencia para comparar que ambos den lo mismo al centavo.
+    """
+    if metodo == "iterativo":
+        return _calcular_ahorro_por_abonos_iterativo(monto, tasa, plazo, abono_extra, desde_periodo)
+    if metodo != "cerrado":
+        raise ValueError(f"Método desconocido: {metodo!r}")
+
+    P = Decimal(str(monto))
+    r = Decimal(str(tasa))
+    n = int(plazo)
+    abono = Decimal(str(abono_extra))
+    desde = int(desde_periodo)
+
+    if r <= 0:
+        return _calcular_ahorro_por_abonos_iterativo(monto, tasa, plazo, abono_extra, desde_periodo)
+
+    pago_fijo = calcular_pago_fijo_excel(P, r, n)
+    total_sin_abonos = pago_fijo * n
+
+    if P <= 0:
+        pagos_realizados = 0
+        total_con_abonos = Decimal('0.00')
+    else:
+        # Fase 1: periodos 1 .. desde-1, solo con el pago fijo.
+        periodos_fase1 = max(desde, 1) - 1
+        j = _pagos_antes_de_liquidar(P, r, pago_fijo) if periodos_fase1 > 0 else None
+        if j is not None and j < periodos_fase1:
+            # Se liquida antes de que empiecen los abonos extra.
+            pagos_realizados = j + 1
+            total_con_abonos = pago_fijo * j + _ultimo_pago(P, r, pago_fijo, j)
+        else:
+            # Fase 2: desde el periodo `desde`, pago fijo + abono extra.
+            saldo = _saldo_tras_pagos(P, r, pago_fijo, periodos_fase1)
+            pago_con_abono = pago_fijo + abono
+            j = _pagos_antes_de_liquidar(saldo, r, pago_con_abono)
+            if j is None:
+                # La simulación nunca terminaría: el saldo crece sin fin.
+                raise ValueError("El pago no alcanza a cubrir los intereses del periodo.")
+            pagos_realizados = periodos_fase1 + j + 1
+            total_con_abonos = (
+                pago_fijo * periodos_fase1
+                + pago_con_abono * j
+                + _ultimo_pago(saldo, r, pago_con_abono, j)
+            )
+
+    # Con tasas por periodo muy altas y plazos muy largos, (1+r)^n se dispara
+    # y los redondeos de la simulación se amplifican hasta mover centavos.
+    # Ahí la simulación es la referencia, así que la usamos tal cual para dar
+    # exactamente el mismo resultado. Una hipoteca típica (12% anual a 30
+    # años, pagos mensuales) da (1+r)^n ≈ 36, muy lejos de ese límite.
+    # Si esos mismos redondeos hacen que la simulación ya no liquide nunca,
+    # se corta y nos quedamos con el resultado de la fórmula.
+    if (Decimal('1') + r) ** n > _FACTOR_MAX_FORMULA_CERRADA:
+        resultado = _calcular_ahorro_por_abonos_iterativo(
+            monto, tasa, plazo, abono_extra, desde_periodo,
+            limite_pagos=pagos_realizados + n
+        )
+        if resultado is not None:
+            return resultado
+
+    ahorro_total = total_sin_abonos - total_con_abonos
+    pagos_ahorrados = n - pagos_realizados
+
+    return (
+        total_sin_abonos.quantize(Decimal("0.01")),
+        total_con_abonos.quantize(Decimal("0.01")),
+        ahorro_total.quantize(Decimal("0.01")),
+        pagos_ahorrados
+    )
+
+_FACTOR_MAX_FORMULA_CERRADA = Decimal('1e4')
+
+def _saldo_tras_pagos(saldo, r, pago, k):
+    """Saldo después de k pagos iguales: B·(1+r)^k − pago·((1+r)^k − 1)/r."""
+    if k <= 0:
+        return saldo
+    # Los dos términos pueden ser enormes y casi iguales (plazos largos), así
+    # que se restan con precisión extra y solo el resultado vuelve a la
+    # precisión normal; si no, la resta se come los centavos.
+    with localcontext() as ctx:
+        ctx.prec = 50
+        factor = (Decimal('1') + r) ** k
+        resultado = saldo * factor - pago * (factor - Decimal('1')) / r
+    return +resultado
+
+def _liquida_con_este_pago(saldo, r, pago):
+    # Misma condición que la simulación: lo que va a capital cubre el saldo.
+    return pago - saldo * r >= saldo
+
+def _pagos_antes_de_liquidar(saldo, r, pago):
+    """
+    Cuántos pagos completos se hacen antes del pago que liquida el crédito.
+    Despejando la fórmula del saldo, el pago j+1 liquida cuando
+    (1+r)^(j+1) >= pago / (pago − saldo·r); el logaritmo da una primera
+    estimación y luego se ajusta con la condición exacta, para no depender
+    del redondeo del punto flotante. Devuelve None si ese pago nunca
+    liquida la deuda.
+    """
+    if _liquida_con_este_pago(saldo, r, pago):
+        return 0
+    if r <= 0 or pago - saldo * r <= 0:
+        # El pago ni siquiera cubre los intereses: la deuda nunca se liquida.
+        return None
+    razon = pago / (pago - saldo * r)
+    j = max(0, ceil(log(float(razon)) / log1p(float(r))) - 1)
+    while j > 0 and _liquida_con_este_pago(_saldo_tras_pagos(saldo, r, pago, j - 1), r, pago):
+        j -= 1
+    while not _liquida_con_este_pago(_saldo_tras_pagos(saldo, r, pago, j), r, pago):
+        j += 1
+    return j
+
+def _ultimo_pago(saldo, r, pago, j):
+    saldo_final = _saldo_tras_pagos(saldo, r, pago, j)
+    return saldo_final + saldo_final * r
+
+def _calcular_ahorro_por_abonos_iterativo(monto, tasa, plazo, abono_extra, desde_periodo, limite_pagos=None):
     P = Decimal(str(monto))
     r = Decimal(str(tasa))
     n = int(plazo)
@@ -292,6 +1570,8 @@ def calcular_ahorro_por_abonos(monto, tasa, plazo, abono_extra, desde_periodo):
         total_con_abonos += total_pago_periodo
         pagos_realizados += 1
         periodo += 1
+        if limite_pagos is not None and pagos_realizados > limite_pagos:
+            return None
 
     total_sin_abonos = pago_fijo * n
     ahorro_total = total_sin_abonos - total_con_abonos
@@ -304,14 +1584,223 @@ def calcular_ahorro_por_abonos(monto, tasa, plazo, abono_extra, desde_periodo):
         pagos_ahorrados
     )
 
+# =========================================
+# Tabla de amortización periodo por periodo
+# Las filas se generan una por una, así que una tabla de 360 pagos nunca
+# está completa en memoria: se va escribiendo en CSV por bloques, ya sea
+# a un archivo o directo a la descarga HTTP.
+# =========================================
+ENCABEZADO_TABLA = ("periodo", "pago", "interes", "capital", "saldo")
+TABLA_FILAS_POR_BLOQUE = int(os.environ.get('BOT_TABLA_FILAS_POR_BLOQUE', '64'))
+TABLA_MAX_PERIODOS = int(os.environ.get('BOT_TABLA_MAX_PERIODOS', '10000'))
+# Dirección pública del bot (ej. https://mi-bot.onrender.com). Si está, al
+# terminar una simulación de crédito en el chat se manda la liga para
+# descargar su tabla; si no, no se ofrece.
+URL_PUBLICA = os.environ.get('BOT_URL_PUBLICA', '').rstrip('/')
+
+def generar_tabla_amortizacion(monto, tasa, plazo, abono_extra=0, desde_periodo=1):
+    """
+    Devuelve un generador de filas (periodo, pago, interes, capital, saldo)
+    con los mismos supuestos que calcular_ahorro_por_abonos: pago fijo
+    redondeado a centavos y abono extra a capital desde desde_periodo. El
+    pago y el capital de cada fila ya incluyen el abono extra. El último
+    periodo del plazo liquida el saldo que quede por redondeos.
+
+    Los datos se validan aquí mismo (ValueError), antes de generar la
+    primera fila, para que una descarga no se corte a la mitad.
+    """
+    P = Decimal(str(monto))
+    r = Decimal(str(tasa))
+    n = int(plazo)
+    abono = Decimal(str(abono_extra))
+    desde = int(desde_periodo)
+    if P <= 0 or n <= 0 or r < 0 or abono < 0:
+        raise ValueError("Monto y plazo deben ser positivos; tasa y abono, no negativos.")
+    if n > TABLA_MAX_PERIODOS:
+        raise ValueError(f"La tabla admite a lo más {TABLA_MAX_PERIODOS} periodos.")
+    if r == 0:
+        pago_fijo = (P / n).quantize(Decimal('0.01'))
+    else:
+        pago_fijo = calcular_pago_fijo_excel(P, r, n)
+    return _filas_amortizacion(P, r, n, pago_fijo, abono, desde)
+
+def _filas_amortizacion(saldo, r, n, pago_fijo, abono, desde):
+    centavo = Decimal('0.01')
+    for periodo in range(1, n + 1):
+        interes = saldo * r
+        pago = pago_fijo + abono if periodo >= desde else pago_fijo
+        capital = pago - interes
+        if capital >= saldo or periodo == n:
+            capital = saldo
+            pago = saldo + interes
+        saldo -= capital
+        yield (
+            periodo, pago.quantize(centavo), interes.quantize(centavo),
+            capital.quantize(centavo), saldo.quantize(centavo)
+        )
+        if saldo <= 0:
+            return
+
+def enlace_tabla_amortizacion(contexto):
+    """
+    Liga a /tabla_amortizacion.csv con el crédito que la persona simuló en
+    el chat (flujos 1 y 2), o None si no hay BOT_URL_PUBLICA (o la sesión
+    es de antes de que se guardaran los periodos por año).
+    """
+    if not URL_PUBLICA or "periodos_por_anio" not in contexto:
+        return None
+    parametros = {
+        "monto": contexto["monto"],
+        "tasa_anual": contexto["tasa_anual"],
+        "anios": contexto["anios"],
+        "periodos_por_anio": contexto["periodos_por_anio"],
+    }
+    if "abono" in contexto:
+        parametros["abono"] = contexto["abono"]
+        parametros["desde"] = contexto["desde"]
+    return f"{URL_PUBLICA}/tabla_amortizacion.csv?{urlencode(parametros)}"
+
+def mensaje_tabla_amortizacion(contexto):
+    """El renglón que ofrece la tabla al final de la simulación ("" si no hay liga)."""
+    enlace = enlace_tabla_amortizacion(contexto)
+    if enlace is None:
+        return ""
+    return f"📄 Descarga tu tabla de pagos, periodo por periodo: {enlace}\n\n"
+
+def csv_en_bloques(filas, filas_por_bloque=None):
+    """Convierte las filas en texto CSV, un bloque de varias filas a la vez."""
+    filas_por_bloque = filas_por_bloque or TABLA_FILAS_POR_BLOQUE
+    bufer = io.StringIO()
+    escritor = csv.writer(bufer, lineterminator="\n")
+    escritor.writerow(ENCABEZADO_TABLA)
+    pendientes = 0
+    for fila in filas:
+        escritor.writerow(fila)
+        pendientes += 1
+        if pendientes >= filas_por_bloque:
+            yield bufer.getvalue()
+            bufer.seek(0)
+            bufer.truncate()
+            pendientes = 0
+    resto = bufer.getvalue()
+    if resto:
+        yield resto
+
+def guardar_tabla_csv(filas, ruta):
+    """Escribe la tabla en un archivo CSV sin armarla completa en memoria."""
+    with open(ruta, "w", encoding="utf-8", newline="") as archivo:
+        for bloque in csv_en_bloques(filas):
+            archivo.write(bloque)
+
+# Descarga de la tabla, por ejemplo:
+# /tabla_amortizacion.csv?monto=150000&tasa_anual=45&anios=3&periodos_por_anio=24&abono=500&desde=4
+@app.route('/tabla_amortizacion.csv')
+def descargar_tabla_amortizacion():
+    try:
+        desde = Decimal(request.args.get("desde", "1"))
+        if not desde.is_finite() or desde != desde.to_integral_value():
+            return "Parámetros inválidos: desde debe ser un número entero de periodo.", 400
+        plazo, tasa_periodo = calcular_plazo_y_tasa_periodo(
+            Decimal(request.args["anios"]),
+            Decimal(request.args["tasa_anual"]),
+            Decimal(request.args.get("periodos_por_anio", "12")),
+        )
+        filas = generar_tabla_amortizacion(
+            Decimal(request.args["monto"]), tasa_periodo, plazo,
+            Decimal(request.args.get("abono", "0")),
+            int(desde),
+        )
+    except KeyError as e:
+        return f"Falta el parámetro {e.args[0]}", 400
+    except ArithmeticError:
+        return "Parámetros inválidos: deben ser números.", 400
+    except ValueError as e:
+        return f"Parámetros inválidos: {e}", 400
+    registrar_evento("tabla_amortizacion", periodos=plazo)
+    return Response(
+        csv_en_bloques(filas),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=tabla_amortizacion.csv"},
+    )
+
 # =========================================
 # Costo real de compras a pagos fijos
 # =========================================
 from decimal import Decimal, getcontext
-import numpy_financial as np
 
 getcontext().prec = 17  # Precisión tipo Excel
 
+def _valor_anualidad(tasa, n):
+    """
+    Valor presente de n pagos de 1 a la tasa por periodo dada y su derivada
+    respecto a la tasa. Cerca de tasa 0 usa la serie de Taylor para no
+    dividir entre casi cero. Si (1+tasa)^-n se desborda devuelve infinito.
+    """
+    if abs(tasa * n) < 1e-6:
+        a = n - n * (n + 1) / 2 * tasa + n * (n + 1) * (n + 2) / 6 * tasa * tasa
+        derivada = -n * (n + 1) / 2 + n * (n + 1) * (n + 2) / 3 * tasa
+        return a, derivada
+    try:
+        descuento_n = exp(-n * log1p(tasa))
+    except OverflowError:
+        return float("inf"), float("-inf")
+    a = (1 - descuento_n) / tasa
+    derivada = (n * descuento_n / (1 + tasa) - a) / tasa
+    return a, derivada
+
+@medir_calculo
+def calcular_tasa_anualidad(valor_presente, pago, n, tolerancia=1e-14, max_iteraciones=200):
+    """
+    Tasa por periodo r con la que n pagos iguales de `pago` valen hoy
+    `valor_presente`, es decir, la TIR de una compra a pagos fijos.
+
+    pago * (1 - (1+r)^-n) / r es estrictamente decreciente en r > -1, así que
+    la raíz existe y es única; es positiva si en total se paga más que el
+    precio de contado. Se busca con Newton dentro de un intervalo que siempre
+    la contiene, y si un paso de Newton se sale del intervalo se bisecta:
+      - si se paga de más: 0 < r < pago / valor_presente
+      - si se paga de menos: pago * n / valor_presente - 1 <= r < 0
+    Cada paso cuesta lo mismo sin importar cuántos pagos haya.
+    """
+    P = float(valor_presente)
+    c = float(pago)
+    n = int(n)
+    if not (P > 0 and c > 0 and n > 0):
+        raise ValueError("Todos los valores deben ser mayores a cero.")
+    if n == 1:
+        return c / P - 1
+    total = c * n
+    if total == P:
+        return 0.0
+    if total > P:
+        bajo, alto = 0.0, c / P
+    else:
+        bajo, alto = total / P - 1, 0.0
+
+    # Aproximación para tasas chicas: a(r) ≈ n / (1 + r (n+1) / 2).
+    tasa = 2 * (total - P) / (P * (n + 1))
+    if not bajo < tasa < alto:
+        tasa = (bajo + alto) / 2
+
+    for _ in range(max_iteraciones):
+        a, derivada = _valor_anualidad(tasa, n)
+        f = c * a - P
+        if f > 0:
+            bajo = tasa
+        else:
+            alto = tasa
+        if derivada != 0 and abs(derivada) != float("inf"):
+            siguiente = tasa - f / (c * derivada)
+        else:
+            siguiente = (bajo + alto) / 2
+        if not bajo < siguiente < alto:
+            siguiente = (bajo + alto) / 2
+        if abs(siguiente - tasa) <= tolerancia * (1 + abs(tasa)) or alto - bajo <= tolerancia * (1 + abs(tasa)):
+            return siguiente
+        tasa = siguiente
+    raise ValueError("No se pudo calcular la tasa de la compra a pagos fijos.")
+
+@medir_calculo
 def calcular_costo_credito_tienda(precio_contado, pago_periodico, num_pagos, periodos_anuales):
     try:
         precio = Decimal(str(precio_contado))
@@ -326,10 +1815,9 @@ def calcular_costo_credito_tienda(precio_contado, pago_periodico, num_pagos, per
         intereses = total_pagado - precio
 
         # Cálculo de TIR (tasa efectiva por periodo)
-        flujos = [-float(precio)] + [float(cuota)] * n
-        tir = np.irr(flujos)
+        tir = calcular_tasa_anualidad(precio, cuota, n)
 
-        if tir is None or tir <= -1:
+        if tir <= -1:
             raise ValueError("No se pudo calcular la TIR correctamente.")
 
         tasa_periodo = Decimal(tir)
@@ -362,6 +1850,7 @@ def calcular_costo_credito_tienda(precio_contado, pago_periodico, num_pagos, per
 # =========================================
 # Ahorro: meta de ahorro
 # =========================================
+@medir_calculo
 def calcular_ahorro_periodico(meta, ahorro_inicial, meses_totales, periodos_por_anio, frecuencia_label):
     """
     Dado cuánto quiere ahorrar una persona en total, cuánto tiene ya ahorrado,
@@ -417,6 +1906,7 @@ def calcular_ahorro_periodico(meta, ahorro_inicial, meses_totales, periodos_por_
 # =========================================
 # Inversión: crecimiento de una inversión
 # =========================================
+@medir_calculo
 def calcular_crecimiento_inversion(monto_inicial, aportacion_periodica, anios, tasa_anual_pct, periodos_por_anio, frecuencia_label):
     """
     Dado un monto inicial (puede ser 0), una aportación periódica (puede ser 0),
@@ -444,17 +1934,9 @@ def calcular_crecimiento_inversion(monto_inicial, aportacion_periodica, anios, t
         if plazo <= 0:
             return "El tiempo debe ser mayor a cero. Escribe *menú* para intentarlo de nuevo."
 
-        fv_inicial = monto_inicial * (Decimal("1") + tasa_periodo) ** plazo
-        if tasa_periodo == 0:
-            fv_aportaciones = aportacion_periodica * Decimal(plazo)
-        else:
-            fv_aportaciones = aportacion_periodica * (
-                ((Decimal("1") + tasa_periodo) ** plazo - Decimal("1")) / tasa_periodo
-            )
-
-        fv_total = (fv_inicial + fv_aportaciones).quantize(Decimal("0.01"))
-        total_aportado = (monto_inicial + aportacion_periodica * Decimal(plazo)).quantize(Decimal("0.01"))
-        intereses_generados = (fv_total - total_aportado).quantize(Decimal("0.01"))
+        fv_total, total_aportado, intereses_generados = _crecimiento_inversion_decimal(
+            monto_inicial, aportacion_periodica, plazo, tasa_periodo
+        )
 
         return (
             "📌 Resultado de tu simulación de inversión:\n"
@@ -473,9 +1955,24 @@ def calcular_crecimiento_inversion(monto_inicial, aportacion_periodica, anios, t
     except Exception as e:
         return f"❌ Error al calcular: {e}"
 
+def _crecimiento_inversion_decimal(monto_inicial, aportacion_periodica, plazo, tasa_periodo):
+    fv_inicial = monto_inicial * (Decimal("1") + tasa_periodo) ** plazo
+    if tasa_periodo == 0:
+        fv_aportaciones = aportacion_periodica * Decimal(plazo)
+    else:
+        fv_aportaciones = aportacion_periodica * (
+            ((Decimal("1") + tasa_periodo) ** plazo - Decimal("1")) / tasa_periodo
+        )
+
+    fv_total = (fv_inicial + fv_aportaciones).quantize(Decimal("0.01"))
+    total_aportado = (monto_inicial + aportacion_periodica * Decimal(plazo)).quantize(Decimal("0.01"))
+    intereses_generados = (fv_total - total_aportado).quantize(Decimal("0.01"))
+    return fv_total, total_aportado, intereses_generados
+
 # =========================================
 # Jubilación: meta de ahorro para el retiro
 # =========================================
+@medir_calculo
 def calcular_ahorro_jubilacion(meta, ahorro_actual, anios, tasa_anual_pct, periodos_por_anio, frecuencia_label):
     """
     Dado cuánto quiere tener una persona ahorrado para su retiro, cuánto tiene
@@ -523,15 +2020,9 @@ def calcular_ahorro_jubilacion(meta, ahorro_actual, anios, tasa_anual_pct, perio
                 "Escribe *menú* para volver al inicio."
             )
 
-        monto_faltante_fv = meta - fv_ahorro_actual
-        if tasa_periodo == 0:
-            aporte_por_periodo = (monto_faltante_fv / Decimal(plazo)).quantize(Decimal("0.01"))
-        else:
-            factor_anualidad = ((Decimal("1") + tasa_periodo) ** plazo - Decimal("1")) / tasa_periodo
-            aporte_por_periodo = (monto_faltante_fv / factor_anualidad).quantize(Decimal("0.01"))
-
-        total_aportado = (ahorro_actual + aporte_por_periodo * Decimal(plazo)).quantize(Decimal("0.01"))
-        rendimiento_generado = (meta - total_aportado).quantize(Decimal("0.01"))
+        aporte_por_periodo, total_aportado, rendimiento_generado = _aporte_jubilacion_decimal(
+            meta, ahorro_actual, fv_ahorro_actual, plazo, tasa_periodo
+        )
 
         return (
             "📌 Resultado de tu plan para el retiro:\n"
@@ -551,6 +2042,140 @@ def calcular_ahorro_jubilacion(meta, ahorro_actual, anios, tasa_anual_pct, perio
     except Exception as e:
         return f"❌ Error al calcular: {e}"
 
+def _aporte_jubilacion_decimal(meta, ahorro_actual, fv_ahorro_actual, plazo, tasa_periodo):
+    monto_faltante_fv = meta - fv_ahorro_actual
+    if tasa_periodo == 0:
+        aporte_por_periodo = (monto_faltante_fv / Decimal(plazo)).quantize(Decimal("0.01"))
+    else:
+        factor_anualidad = ((Decimal("1") + tasa_periodo) ** plazo - Decimal("1")) / tasa_periodo
+        aporte_por_periodo = (monto_faltante_fv / factor_anualidad).quantize(Decimal("0.01"))
+
+    total_aportado = (ahorro_actual + aporte_por_periodo * Decimal(plazo)).quantize(Decimal("0.01"))
+    rendimiento_generado = (meta - total_aportado).quantize(Decimal("0.01"))
+    return aporte_por_periodo, total_aportado, rendimiento_generado
+
+# =========================================
+# Versiones por lotes (NumPy) para tablas de referencia
+# Calculan miles o millones de escenarios en una sola pasada vectorizada,
+# con float64 en lugar de Decimal. El redondeo a centavos da lo mismo que
+# las versiones de arriba: los pocos resultados que caen a un pelo de medio
+# centavo (donde float64 podría redondear distinto) se recalculan con la
+# versión Decimal. Los escenarios con plazo <= 0 dan nan. NumPy se importa
+# la primera vez que se llama alguna de estas funciones.
+# =========================================
+def _a_centavos(crudo, referencia):
+    """
+    Redondea a centavos (mitades al par, como Decimal.quantize) y corrige
+    con referencia(i) -> Decimal los valores que quedan en la frontera.
+    Arriba de unos mil millones los centavos ya se pierden en los redondeos
+    de cualquiera de las dos versiones, así que ahí se queda el de float64.
+    """
+    centavos = crudo * 100
+    resultado = numpy.round(centavos) / 100
+    fraccion = centavos - numpy.floor(centavos)
+    tolerancia = 1e-9 + 1e-12 * numpy.abs(centavos)
+    dudosos = (numpy.abs(fraccion - 0.5) <= tolerancia) & (numpy.abs(centavos) < 1e11)
+    for i in numpy.flatnonzero(dudosos):
+        try:
+            resultado[i] = float(referencia(i))
+        except ArithmeticError:
+            pass
+    return resultado
+
+def _arreglos_float(*valores):
+    _cargar_numpy()
+    return [numpy.array(a, dtype=float) for a in numpy.broadcast_arrays(*valores)]
+
+def _plazos_y_tasas_lote(anios, tasas_anuales_pct, periodos_por_anio):
+    """Versión por lotes de calcular_plazo_y_tasa_periodo (redondeo half-up)."""
+    anios, tasas_anuales_pct, periodos_por_anio = _arreglos_float(
+        anios, tasas_anuales_pct, periodos_por_anio
+    )
+    plazos = numpy.floor(anios * periodos_por_anio + 0.5)
+    return plazos, tasas_anuales_pct / 100 / periodos_por_anio
+
+def _decimal(valor):
+    return Decimal(str(float(valor)))
+
+@medir_calculo
+def calcular_pago_fijo_lote(montos, tasas, plazos):
+    """
+    Versión por lotes de calcular_pago_fijo_excel: arreglos de monto, tasa
+    por periodo y plazo (o escalares, que se repiten). Con tasa 0 el pago es
+    monto / plazo.
+    """
+    montos, tasas, plazos = _arreglos_float(montos, tasas, plazos)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        crudo = numpy.where(
+            tasas == 0,
+            montos / plazos,
+            montos * tasas / -numpy.expm1(-plazos * numpy.log1p(tasas)),
+        )
+    crudo[plazos <= 0] = numpy.nan
+
+    def referencia(i):
+        if tasas[i] == 0:
+            return (_decimal(montos[i]) / int(plazos[i])).quantize(Decimal("0.01"))
+        return calcular_pago_fijo_excel(_decimal(montos[i]), _decimal(tasas[i]), int(plazos[i]))
+
+    return _a_centavos(crudo, referencia)
+
+@medir_calculo
+def calcular_crecimiento_inversion_lote(montos_iniciales, aportaciones, anios, tasas_anuales_pct, periodos_por_anio):
+    """
+    Versión por lotes de calcular_crecimiento_inversion. Devuelve tres
+    arreglos: (total_final, total_aportado, rendimiento_generado).
+    """
+    plazos, tasas = _plazos_y_tasas_lote(anios, tasas_anuales_pct, periodos_por_anio)
+    montos_iniciales, aportaciones, plazos, tasas = _arreglos_float(
+        montos_iniciales, aportaciones, plazos, tasas
+    )
+    with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        exponente = plazos * numpy.log1p(tasas)
+        factor = numpy.where(tasas == 0, plazos, numpy.expm1(exponente) / tasas)
+        crudo_final = montos_iniciales * numpy.exp(exponente) + aportaciones * factor
+    crudo_final[plazos <= 0] = numpy.nan
+
+    def referencia(i):
+        return _crecimiento_inversion_decimal(
+            _decimal(montos_iniciales[i]), _decimal(aportaciones[i]),
+            int(plazos[i]), _decimal(tasas[i])
+        )
+
+    total_final = _a_centavos(crudo_final, lambda i: referencia(i)[0])
+    total_aportado = _a_centavos(montos_iniciales + aportaciones * plazos, lambda i: referencia(i)[1])
+    total_aportado[plazos <= 0] = numpy.nan
+    return total_final, total_aportado, numpy.round(total_final - total_aportado, 2)
+
+@medir_calculo
+def calcular_ahorro_jubilacion_lote(metas, ahorros_actuales, anios, tasas_anuales_pct, periodos_por_anio):
+    """
+    Versión por lotes de calcular_ahorro_jubilacion. Devuelve tres arreglos:
+    (aporte_por_periodo, total_aportado, rendimiento_generado). Si el ahorro
+    actual ya alcanza la meta, el aporte es 0 y todo lo demás es rendimiento.
+    """
+    plazos, tasas = _plazos_y_tasas_lote(anios, tasas_anuales_pct, periodos_por_anio)
+    metas, ahorros_actuales, plazos, tasas = _arreglos_float(metas, ahorros_actuales, plazos, tasas)
+    with numpy.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        exponente = plazos * numpy.log1p(tasas)
+        fv_ahorro_actual = ahorros_actuales * numpy.exp(exponente)
+        factor = numpy.where(tasas == 0, plazos, numpy.expm1(exponente) / tasas)
+        crudo_aporte = numpy.where(fv_ahorro_actual >= metas, 0.0, (metas - fv_ahorro_actual) / factor)
+    crudo_aporte[plazos <= 0] = numpy.nan
+
+    def referencia(i):
+        meta, ahorro, tasa = _decimal(metas[i]), _decimal(ahorros_actuales[i]), _decimal(tasas[i])
+        plazo = int(plazos[i])
+        fv = ahorro * (Decimal("1") + tasa) ** plazo
+        if fv >= meta:
+            return Decimal("0.00"), ahorro.quantize(Decimal("0.01")), (meta - ahorro).quantize(Decimal("0.01"))
+        return _aporte_jubilacion_decimal(meta, ahorro, fv, plazo, tasa)
+
+    aporte = _a_centavos(crudo_aporte, lambda i: referencia(i)[0])
+    total_aportado = _a_centavos(ahorros_actuales + aporte * plazos, lambda i: referencia(i)[1])
+    rendimiento = _a_centavos(metas - total_aportado, lambda i: referencia(i)[2])
+    return aporte, total_aportado, rendimiento
+
 # =========================================
 # Menú principal
 # =========================================
@@ -591,7 +2216,9 @@ mensaje_submenu_credito = (
     "7️⃣ Errores comunes al pedir crédito\n"
     "8️⃣ Entender el Buró de Crédito\n"
     "9️⃣ Tus derechos frente al cobro de deudas\n\n"
-    "Escribe el número, o *menú* para regresar."
+    "Escribe el número, o *menú* para regresar.\n\n"
+    "💡 Si ya tienes los datos, puedes escribirlos en un solo mensaje: "
+    "*crédito 150000 45% 3 años quincenal* o *tienda 1800 250 12 quincenal*."
 )
 
 mensaje_submenu_inversion = (
@@ -1122,20 +2749,118 @@ mensaje_glosario = (
     "Escribe *menú* para volver al inicio."
 )
 
+_MARCAS_DIACRITICAS_RE = re.compile('[\u0300-\u036f]')
+
+def _sin_acentos(texto):
+    if texto.isascii():
+        return texto
+    return _MARCAS_DIACRITICAS_RE.sub('', unicodedata.normalize('NFD', texto))
+
+def _plegar_texto(texto):
+    """Minúsculas y sin acentos: "Buró de Crédito" -> "buro de credito"."""
+    return _sin_acentos(texto.lower())
+
+class AutomataAhoCorasick:
+    """
+    Busca muchos patrones a la vez recorriendo el texto una sola vez
+    (Aho-Corasick). Se construye con pares (patron, valor) y buscar()
+    devuelve el conjunto de valores cuyos patrones aparecen como palabras
+    completas: "cat" no cuenta dentro de "indicaTe" ni "uma" dentro de
+    "sUMA". El texto y los patrones deben venir ya plegados con
+    _plegar_texto.
+    """
+    __slots__ = ("_transiciones", "_salidas")
+
+    def __init__(self, patrones):
+        hijos = [{}]
+        salidas = [[]]
+        for patron, valor in patrones:
+            nodo = 0
+            for c in patron:
+                siguiente = hijos[nodo].get(c)
+                if siguiente is None:
+                    siguiente = len(hijos)
+                    hijos[nodo][c] = siguiente
+                    hijos.append({})
+                    salidas.append([])
+                nodo = siguiente
+            salidas[nodo].append((len(patron), valor))
+
+        # Por anchura se calcula el enlace de fallo de cada nodo (el sufijo
+        # propio más largo que también es prefijo de algún patrón) y con él
+        # se completan sus transiciones, para que buscar() haga una sola
+        # consulta por carácter sin tener que retroceder.
+        transiciones = [dict(hijos[0])] + [None] * (len(hijos) - 1)
+        fallo = [0] * len(hijos)
+        pendientes = list(hijos[0].values())
+        while pendientes:
+            siguientes = []
+            for nodo in pendientes:
+                transiciones[nodo] = {**transiciones[fallo[nodo]], **hijos[nodo]}
+                for c, hijo in hijos[nodo].items():
+                    fallo[hijo] = transiciones[fallo[nodo]].get(c, 0) if nodo else 0
+                    salidas[hijo] = salidas[hijo] + salidas[fallo[hijo]]
+                    siguientes.append(hijo)
+            pendientes = siguientes
+        self._transiciones = transiciones
+        self._salidas = salidas
+
+    def buscar(self, texto):
+        transiciones, salidas = self._transiciones, self._salidas
+        encontrados = set()
+        ultimo = len(texto) - 1
+        nodo = 0
+        for i, c in enumerate(texto):
+            nodo = transiciones[nodo].get(c, 0)
+            if not salidas[nodo]:
+                continue
+            if i < ultimo and texto[i + 1].isalnum():
+                continue
+            for longitud, valor in salidas[nodo]:
+                inicio = i + 1 - longitud
+                if inicio == 0 or not texto[inicio - 1].isalnum():
+                    encontrados.add(valor)
+        return encontrados
+
+# Se arma una sola vez al importar: cada alias apunta a la posición de su
+# término en GLOSARIO_TERMINOS, para devolverlos en el orden del glosario.
+_AUTOMATA_GLOSARIO = AutomataAhoCorasick(
+    (_plegar_texto(patron), indice)
+    for indice, (patrones, _, _) in enumerate(GLOSARIO_TERMINOS)
+    for patron in patrones
+)
+
+# Se calcula para cada respuesta, y casi todas son textos fijos del bot: la
+# máscara de cada texto se busca una vez y se reutiliza. Las respuestas con
+# cifras (resultados de cálculos) solo ocupan un lugar hasta que se desplazan.
+@functools.lru_cache(maxsize=1024)
+def mascara_terminos_glosario(texto):
+    """
+    Los términos del glosario que aparecen en el texto, como un int con el
+    bit i encendido si aparece GLOSARIO_TERMINOS[i] (0 si no hay ninguno).
+    """
+    if not texto:
+        return 0
+    mascara = 0
+    for indice in _AUTOMATA_GLOSARIO.buscar(_plegar_texto(texto)):
+        mascara |= 1 << indice
+    return mascara
+
 def buscar_terminos_glosario(texto):
     """
     Busca, dentro de un texto (normalmente el último mensaje que envió el
     bot), qué términos del glosario aparecen mencionados, para poder
-    explicarlos de forma más sencilla cuando alguien lo pida.
+    explicarlos de forma más sencilla cuando alguien lo pida. Sin importar
+    mayúsculas ni acentos, y solo como palabras completas.
     """
     if not texto:
         return []
-    texto_normalizado = texto.lower()
-    encontrados = []
-    for patrones, nombre, explicacion in GLOSARIO_TERMINOS:
-        if any(patron in texto_normalizado for patron in patrones):
-            encontrados.append((nombre, explicacion))
-    return encontrados
+    indices = _AUTOMATA_GLOSARIO.buscar(_plegar_texto(texto))
+    return [
+        (nombre, explicacion)
+        for indice, (_, nombre, explicacion) in enumerate(GLOSARIO_TERMINOS)
+        if indice in indices
+    ]
 
 mensaje_creditos = (
     "👩‍🏫 ¿Quiénes hicimos este bot?\n\n"
@@ -1173,123 +2898,565 @@ def normalizar_numero(numero):
         return "52" + numero[3:]
     return numero
 
-def enviar_mensaje(numero, texto):
-    numero = normalizar_numero(numero)
-    print(f"[Enviar a {numero}]: {texto}")
-    url = f"https://graph.facebook.com/v21.0/{PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {TOKEN}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "messaging_product": "whatsapp",
-        "to": numero,
-        "type": "text",
+# =========================================
+# Envío de mensajes a la API de WhatsApp (Graph API)
+# =========================================
+# Una sola sesión HTTP por proceso, con su propio grupo de conexiones
+# keep-alive: así cada respuesta reutiliza una conexión TLS ya abierta con
+# graph.facebook.com en vez de hacer el saludo TCP+TLS desde cero. Los
+# timeouts evitan que una llamada lenta deje atorado a un worker de gunicorn
+# para siempre, y los reintentos cubren los 429 y errores 5xx pasajeros.
+# BOT_GRAPH_URL_BASE permite apuntar los envíos a otro servidor, por ejemplo
+# al Graph API falso de graph_falso.py para pruebas de carga locales.
+GRAPH_URL_BASE = os.environ.get('BOT_GRAPH_URL_BASE', 'https://graph.facebook.com/v21.0').rstrip('/')
+GRAPH_POOL_TAMANO = int(os.environ.get('BOT_GRAPH_POOL_TAMANO', '10'))
+GRAPH_TIMEOUT_CONEXION = float(os.environ.get('BOT_GRAPH_TIMEOUT_CONEXION', '3.05'))
+GRAPH_TIMEOUT_LECTURA = float(os.environ.get('BOT_GRAPH_TIMEOUT_LECTURA', '10'))
+GRAPH_REINTENTOS = int(os.environ.get('BOT_GRAPH_REINTENTOS', '3'))
+GRAPH_ESPERA_BASE = float(os.environ.get('BOT_GRAPH_ESPERA_BASE', '0.5'))
+GRAPH_ESPERA_MAX = float(os.environ.get('BOT_GRAPH_ESPERA_MAX', '8'))
+
+_CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+_sesion_graph = None
+_pid_sesion_graph = None
+_candado_sesion_graph = threading.Lock()
+
+# Contadores acumulados de los envíos de este proceso, para dimensionar el
+# grupo de conexiones con carga real (ver estadisticas_envio).
+_estadisticas_envio = {
+    "envios": 0,
+    "exitosos": 0,
+    "fallidos": 0,
+    "reintentos": 0,
+    "latencia_total_ms": 0.0,
+    "latencia_max_ms": 0.0,
+}
+_candado_estadisticas_envio = threading.Lock()
+
+def _obtener_sesion_graph():
+    """
+    Crea la sesión la primera vez que se usa en cada proceso: si gunicorn
+    carga la app antes de hacer fork, cada worker abre sus propias
+    conexiones en vez de compartir sockets con el proceso padre.
+    """
+    global _sesion_graph, _pid_sesion_graph
+    pid = os.getpid()
+    if _sesion_graph is not None and _pid_sesion_graph == pid:
+        return _sesion_graph
+    with _candado_sesion_graph:
+        if _sesion_graph is None or _pid_sesion_graph != pid:
+            _cargar_requests()
+            sesion = requests.Session()
+            adaptador = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=GRAPH_POOL_TAMANO,
+                pool_block=False,
+            )
+            sesion.mount("https://", adaptador)
+            sesion.mount("http://", adaptador)
+            _sesion_graph = sesion
+            _pid_sesion_graph = pid
+    return _sesion_graph
+
+# Precarga: en cuanto se importa la app, un hilo aparte importa requests y
+# arma la sesión de la Graph API mientras el servidor termina de arrancar,
+# para que el primer mensaje no pague ese costo. BOT_PRECARGA=0 la apaga
+# (todo se sigue cargando al primer uso).
+PRECARGA = os.environ.get('BOT_PRECARGA', '1') == '1'
+
+def _precargar():
+    inicio = time.perf_counter()
+    try:
+        _obtener_sesion_graph()
+    except Exception as e:
+        registrar_evento("error_precarga", logging.WARNING, error=str(e))
+        return
+    registrar_evento("precarga_lista", duracion_ms=round((time.perf_counter() - inicio) * 1000, 3))
+
+def _iniciar_precarga():
+    if PRECARGA:
+        threading.Thread(target=_precargar, name="precarga", daemon=True).start()
+
+_iniciar_precarga()
+
+def _segundos_retry_after(valor):
+    """Interpreta el encabezado Retry-After (segundos o fecha HTTP)."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        fecha = email.utils.parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, fecha.timestamp() - time.time())
+
+def _conexion_no_establecida(error):
+    """
+    True si el POST nunca salió: no se pudo abrir la conexión (rechazada,
+    DNS, timeout al conectar). requests también lanza ConnectionError cuando
+    una conexión keep-alive reutilizada se cae DESPUÉS de mandar el cuerpo
+    ("Connection aborted", RemoteDisconnected); ahí WhatsApp pudo haberlo
+    recibido y reintentar lo duplicaría.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    import urllib3.exceptions
+    causa = error.args[0] if error.args else None
+    return isinstance(getattr(causa, "reason", causa), urllib3.exceptions.NewConnectionError)
+
+def _espera_reintento(intento, retry_after=None):
+    """
+    Backoff exponencial con jitter completo; si la API nos dice cuánto
+    esperar (Retry-After), respetamos eso. Nunca más de GRAPH_ESPERA_MAX.
+    """
+    if retry_after is not None:
+        return min(retry_after, GRAPH_ESPERA_MAX)
+    return random.uniform(0, min(GRAPH_ESPERA_MAX, GRAPH_ESPERA_BASE * (2 ** intento)))
+
+def _registrar_envio(exitoso, reintentos, latencia_ms):
+    with _candado_estadisticas_envio:
+        _estadisticas_envio["envios"] += 1
+        _estadisticas_envio["exitosos" if exitoso else "fallidos"] += 1
+        _estadisticas_envio["reintentos"] += reintentos
+        _estadisticas_envio["latencia_total_ms"] += latencia_ms
+        if latencia_ms > _estadisticas_envio["latencia_max_ms"]:
+            _estadisticas_envio["latencia_max_ms"] = latencia_ms
+
+def estadisticas_envio():
+    """Copia de los contadores de envío, con la latencia promedio calculada."""
+    with _candado_estadisticas_envio:
+        stats = dict(_estadisticas_envio)
+    stats["latencia_promedio_ms"] = (
+        stats["latencia_total_ms"] / stats["envios"] if stats["envios"] else 0.0
+    )
+    return stats
+
+def enviar_mensaje(numero, texto):
+    """
+    Envía un mensaje de texto por la API de WhatsApp. Devuelve un dict con
+    el código HTTP final (None si nunca hubo respuesta), la latencia total
+    del envío en milisegundos y cuántos reintentos hizo falta hacer.
+    """
+    numero = normalizar_numero(numero)
+    url = f"{GRAPH_URL_BASE}/{PHONE_NUMBER_ID}/messages"
+    headers = {
+        "Authorization": f"Bearer {TOKEN}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "messaging_product": "whatsapp",
+        "to": numero,
+        "type": "text",
         "text": {
             "body": texto
         }
     }
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code == 200:
-            print(f"✅ Mensaje enviado a {numero}")
+    sesion = _obtener_sesion_graph()
+    inicio = time.perf_counter()
+    reintentos = 0
+    status = None
+    while True:
+        try:
+            response = sesion.post(
+                url, headers=headers, json=data,
+                timeout=(GRAPH_TIMEOUT_CONEXION, GRAPH_TIMEOUT_LECTURA),
+            )
+        except requests.exceptions.ConnectionError as e:
+            # Solo se reintenta si la conexión nunca se estableció: el
+            # mensaje no salió. (Una conexión que se cae a media petición o
+            # un timeout de LECTURA no se reintentan: WhatsApp pudo haberlo
+            # entregado y lo duplicaríamos.)
+            if _conexion_no_establecida(e) and reintentos < GRAPH_REINTENTOS:
+                time.sleep(_espera_reintento(reintentos))
+                reintentos += 1
+                continue
+            registrar_evento("error_envio", logging.ERROR, numero=numero, error=str(e))
+            break
+        except Exception as e:
+            registrar_evento("error_envio", logging.ERROR, numero=numero, error=str(e))
+            break
+
+        status = response.status_code
+        if status in _CODIGOS_REINTENTABLES and reintentos < GRAPH_REINTENTOS:
+            espera = _espera_reintento(
+                reintentos, _segundos_retry_after(response.headers.get("Retry-After"))
+            )
+            registrar_evento(
+                "reintento_envio", logging.WARNING,
+                numero=numero, status=status, intento=reintentos + 1, espera_s=round(espera, 3),
+            )
+            time.sleep(espera)
+            reintentos += 1
+            continue
+
+        if status == 200:
+            if MEDIR_ENTREGA:
+                registrar_mensaje_enviado(_wamid_de_respuesta(response))
         else:
-            print(f"❌ Error al enviar mensaje a {numero}")
-        print(response.status_code)
-        print(response.text)
-    except Exception as e:
-        print("❌ Error al enviar mensaje:", e)
-
-def _procesar_mensaje_interno(mensaje, numero):
-    texto_limpio = _BORDE_PUNTUACION_RE.sub('', mensaje).lower()
-
-    # Evitar menú si estamos en pasos críticos
-    subflujo_critico = False
-    if numero in estado_usuario:
-        esperando = estado_usuario[numero].get("esperando")
-        if esperando in [
-            "desde_cuando1", "desde2",
-            "abono_extra1", "abono_extra2",
-            "riesgo", "subopcion_prestamo",
-            "submenu_despues_de_maximo",
-            # Pasos nuevos de tasa anual / años / frecuencia de pago:
-            # sus respuestas (números del 1 al 8, o años como 1-8) no deben
-            # confundirse con los accesos directos del menú principal.
-            "tasa_anual_credito", "anios_credito", "frecuencia_credito", "frecuencia_otro_credito",
-            "tasa_anual2", "anios2", "frecuencia2", "frecuencia_otro2",
-            "tasa_anual_simular", "anios_simular", "frecuencia_simular", "frecuencia_otro_simular",
-            "tasa_anual_deseada", "anios_deseado", "frecuencia_deseada", "frecuencia_otro_deseada",
-            # Submenús de la nueva estructura (Ahorro / Crédito) y pasos de la
-            # calculadora de meta de ahorro: sus respuestas numéricas tampoco
-            # deben confundirse con los accesos directos del menú principal.
-            "menu_ahorro", "menu_credito", "menu_inversion", "menu_jubilacion",
-            "ahorro_meta", "ahorro_inicial", "ahorro_tiempo_numero", "ahorro_tiempo_unidad",
-            "ahorro_frecuencia", "ahorro_frecuencia_otro",
-            "inversion_monto_inicial", "inversion_aportacion", "inversion_tasa_anual",
-            "inversion_tiempo_numero", "inversion_tiempo_unidad",
-            "inversion_frecuencia", "inversion_frecuencia_otro",
-            "jubilacion_meta", "jubilacion_ahorro_actual", "jubilacion_tasa_anual",
-            "jubilacion_tiempo_numero", "jubilacion_tiempo_unidad",
-            "jubilacion_frecuencia", "jubilacion_frecuencia_otro",
-            "menu_salud", "salud_pregunta", "menu_genero",
-        ]:
-            subflujo_critico = True
+            registrar_evento(
+                "error_envio", logging.ERROR,
+                numero=numero, status=status, error=response.text[:500],
+            )
+        break
+
+    latencia_ms = (time.perf_counter() - inicio) * 1000
+    _registrar_envio(status == 200, reintentos, latencia_ms)
+    if METRICAS:
+        observar_metrica("bot_envio_graph_segundos", (), latencia_ms / 1000)
+        contar_metrica("bot_envios_total", (str(status) if status is not None else "sin_respuesta",))
+        if reintentos:
+            contar_metrica("bot_envio_reintentos_total", (), reintentos)
+    registrar_evento(
+        "mensaje_enviado", numero=numero, texto=texto, status=status,
+        latencia_ms=round(latencia_ms, 2), reintentos=reintentos,
+    )
+    return {"status": status, "latencia_ms": latencia_ms, "reintentos": reintentos}
+
+# =========================================
+# Tiempo de entrega de nuestras respuestas (opcional)
+# =========================================
+# Con BOT_MEDIR_ENTREGA=1 guardamos la hora en que la API aceptó cada
+# respuesta (por su id "wamid") y, cuando WhatsApp nos avisa por el webhook
+# que se entregó o se leyó, medimos cuánto tardó desde nuestro envío. Solo se
+# guardan los últimos ENTREGA_MAX_PENDIENTES envíos, para no crecer sin fin.
+MEDIR_ENTREGA = os.environ.get('BOT_MEDIR_ENTREGA', '0') == '1'
+ENTREGA_MAX_PENDIENTES = int(os.environ.get('BOT_ENTREGA_MAX_PENDIENTES', '10000'))
+
+_envios_pendientes_entrega = OrderedDict()
+_estadisticas_entrega = {}
+_candado_entrega = threading.Lock()
+
+def _wamid_de_respuesta(response):
+    try:
+        return response.json()["messages"][0]["id"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+def registrar_mensaje_enviado(wamid, momento=None):
+    if not wamid:
+        return
+    with _candado_entrega:
+        _envios_pendientes_entrega[wamid] = time.time() if momento is None else momento
+        if len(_envios_pendientes_entrega) > ENTREGA_MAX_PENDIENTES:
+            _envios_pendientes_entrega.popitem(last=False)
+
+def registrar_estado_entrega(estado):
+    """
+    Recibe un elemento de "statuses" del webhook ({"id", "status",
+    "timestamp", ...}) y acumula cuántos segundos pasaron desde que enviamos
+    ese mensaje hasta ese estado (sent / delivered / read / failed).
+    """
+    wamid = estado.get("id")
+    nombre = estado.get("status")
+    if not isinstance(wamid, str) or not isinstance(nombre, str):
+        return
+    try:
+        momento = float(estado.get("timestamp"))
+    except (TypeError, ValueError):
+        return
+    with _candado_entrega:
+        enviado = _envios_pendientes_entrega.get(wamid)
+        if enviado is None:
+            return
+        if nombre in ("read", "failed"):
+            # Ya no esperamos más avisos de este mensaje.
+            del _envios_pendientes_entrega[wamid]
+        segundos = max(0.0, momento - enviado)
+        stats = _estadisticas_entrega.setdefault(
+            nombre, {"conteo": 0, "total_s": 0.0, "max_s": 0.0}
+        )
+        stats["conteo"] += 1
+        stats["total_s"] += segundos
+        if segundos > stats["max_s"]:
+            stats["max_s"] = segundos
+
+def estadisticas_entrega():
+    """Por estado: cuántos avisos llegaron y la demora promedio y máxima (s)."""
+    with _candado_entrega:
+        resultado = {nombre: dict(stats) for nombre, stats in _estadisticas_entrega.items()}
+        pendientes = len(_envios_pendientes_entrega)
+    for stats in resultado.values():
+        stats["promedio_s"] = stats["total_s"] / stats["conteo"]
+    return {"pendientes": pendientes, "por_estado": resultado}
+
+# =========================================
+# Lectura de números escritos por la persona
+# =========================================
+# La gente no escribe "15000": escribe "$15,000", "15 mil", "1.5k", "45 %"
+# o "3 años". Una sola expresión precompilada reconoce todas esas formas
+# (con el texto ya en minúsculas y sin acentos) y devuelve un resultado en
+# vez de lanzar una excepción; si no se puede leer, trae el motivo.
+#
+# Separadores (como se escribe en México): el punto es decimal y la coma
+# separa miles ("15,000.50"). Si vienen los dos, el que va al final es el
+# decimal ("15.000,50" también se lee bien); varias comas o varios puntos
+# son separadores de miles; una sola coma seguida de exactamente tres
+# dígitos es de miles ("15,000") y si no, decimal ("3,5"). Un solo punto
+# seguido de exactamente tres dígitos ("150.000") es decimal en general
+# (una tasa de "45.500"), pero en los montos es de miles, igual que
+# "1.500.000": nadie pide un crédito de 150 pesos con 3 decimales. Por eso
+# la lectura trae también valor_miles, el valor leyéndolo así (None si no
+# aplica), y leer_entrada lo usa en ENTRADA_MONTO.
+LecturaNumero = namedtuple("LecturaNumero", "valor unidad motivo valor_miles", defaults=(None,))
+
+UNIDAD_PORCENTAJE = "%"
+UNIDAD_ANIOS = "anios"
+UNIDAD_MESES = "meses"
+UNIDAD_PESOS = "pesos"
+
+MOTIVO_SIN_NUMERO = "sin_numero"
+MOTIVO_FORMATO = "formato"
+MOTIVO_UNIDAD = "unidad"
+MOTIVO_NO_ENTERO = "no_entero"
+
+_LARGO_MAXIMO_NUMERO = 40
+_NUMERO_RE = re.compile(r"""
+    (?:\$\s*)?(?P<signo>[-+−])?\s*(?:\$\s*)?
+    (?P<cifra>\d[\d.,]*|[.,]\d+)
+    \s*(?P<escala>k|mil|millones|millon|mdp)?
+    \s*(?P<unidad>%|por\s?ciento|anios?|anos?|meses|mes|(?:de\s+)?pesos|mxn)?
+    (?:\s*anual(?:es)?)?
+""", re.VERBOSE)
+_TIENE_DIGITO_RE = re.compile(r'\d')
+_MILES_COMA_RE = re.compile(r"\d{1,3}(?:,\d{3})+")
+_MILES_PUNTO_RE = re.compile(r"\d{1,3}(?:\.\d{3})+")
+_PUNTO_DE_MILES_RE = re.compile(r"[1-9]\d{0,2}\.\d{3}")
+_ESCALAS = {"k": 1000, "mil": 1000, "millon": 1000000, "millones": 1000000, "mdp": 1000000}
+_UNIDADES = {
+    "%": UNIDAD_PORCENTAJE, "por ciento": UNIDAD_PORCENTAJE, "porciento": UNIDAD_PORCENTAJE,
+    "anio": UNIDAD_ANIOS, "anios": UNIDAD_ANIOS, "ano": UNIDAD_ANIOS, "anos": UNIDAD_ANIOS,
+    "mes": UNIDAD_MESES, "meses": UNIDAD_MESES,
+    "pesos": UNIDAD_PESOS, "de pesos": UNIDAD_PESOS, "mxn": UNIDAD_PESOS,
+}
+# Tipos de respuesta que puede esperar un paso de la conversación (ver
+# "Registro de pasos") y qué unidades tienen sentido en cada uno.
+ENTRADA_OPCION = "opcion"
+ENTRADA_SI_NO = "si_no"
+ENTRADA_MONTO = "monto"
+ENTRADA_TASA = "tasa"
+ENTRADA_PLAZO = "plazo"
+ENTRADA_ENTERO = "entero"
+ENTRADA_PERIODOS = "periodos_por_anio"
+_UNIDADES_POR_ENTRADA = {
+    ENTRADA_MONTO: (None, UNIDAD_PESOS),
+    ENTRADA_TASA: (None, UNIDAD_PORCENTAJE),
+    ENTRADA_PLAZO: (None, UNIDAD_ANIOS, UNIDAD_MESES),
+    ENTRADA_ENTERO: (None,),
+    ENTRADA_PERIODOS: (None,),
+}
+
+def _cifra_a_texto_decimal(cifra):
+    """ "15,000.50" -> "15000.50"; None si los separadores no tienen sentido."""
+    if cifra[0] in ".,":
+        cifra = "0" + cifra
+    comas, puntos = cifra.count(","), cifra.count(".")
+    if comas and puntos:
+        decimal = "," if cifra.rfind(",") > cifra.rfind(".") else "."
+        miles = "." if decimal == "," else ","
+        entero, _, fraccion = cifra.rpartition(decimal)
+        miles_re = _MILES_PUNTO_RE if miles == "." else _MILES_COMA_RE
+        if decimal in entero or not fraccion or not miles_re.fullmatch(entero):
+            return None
+        return entero.replace(miles, "") + "." + fraccion
+    if comas + puntos == 0:
+        return cifra
+    separador = "," if comas else "."
+    entero, _, fraccion = cifra.partition(separador)
+    if comas + puntos == 1:
+        if not fraccion:
+            return None
+        if separador == "," and len(fraccion) == 3:
+            return entero + fraccion
+        return entero + "." + fraccion
+    miles_re = _MILES_COMA_RE if separador == "," else _MILES_PUNTO_RE
+    return cifra.replace(separador, "") if miles_re.fullmatch(cifra) else None
+
+def leer_numero(texto):
+    """
+    Lee un número de un texto ya normalizado (minúsculas, sin acentos).
+    Devuelve LecturaNumero(valor, unidad, motivo): valor es un Decimal (con
+    signo y escala ya aplicados) y motivo es None si se pudo leer.
+    """
+    if not _TIENE_DIGITO_RE.search(texto):
+        return LecturaNumero(None, None, MOTIVO_SIN_NUMERO)
+    if len(texto) > _LARGO_MAXIMO_NUMERO:
+        return LecturaNumero(None, None, MOTIVO_FORMATO)
+    partes = _NUMERO_RE.fullmatch(texto)
+    if partes is None:
+        return LecturaNumero(None, None, MOTIVO_FORMATO)
+    cifra = _cifra_a_texto_decimal(partes["cifra"])
+    if cifra is None:
+        return LecturaNumero(None, None, MOTIVO_FORMATO)
+    valor = Decimal(cifra)
+    valor_miles = None
+    if partes["escala"]:
+        valor *= _ESCALAS[partes["escala"]]
+    elif _PUNTO_DE_MILES_RE.fullmatch(partes["cifra"]):
+        valor_miles = Decimal(partes["cifra"].replace(".", ""))
+    if partes["signo"] in ("-", "−"):
+        valor = -valor
+        if valor_miles is not None:
+            valor_miles = -valor_miles
+    unidad = partes["unidad"]
+    if unidad is not None:
+        unidad = _UNIDADES[" ".join(unidad.split())]
+    return LecturaNumero(valor, unidad, None, valor_miles)
+
+def leer_entrada(entrada, tipo):
+    """
+    La lectura del mensaje (ver normalizar_mensaje) validada para un tipo de
+    paso ENTRADA_*: rechaza unidades que no van (un "%" en un monto) y, en
+    ENTRADA_ENTERO, los números con decimales; ahí el valor es un int. En
+    ENTRADA_MONTO, "150.000" se lee como 150000 (ver valor_miles).
+    """
+    lectura = entrada.lectura
+    if lectura.motivo is not None:
+        return lectura
+    if lectura.unidad not in _UNIDADES_POR_ENTRADA[tipo]:
+        return LecturaNumero(None, lectura.unidad, MOTIVO_UNIDAD)
+    if tipo == ENTRADA_ENTERO:
+        if lectura.valor != lectura.valor.to_integral_value():
+            return LecturaNumero(None, None, MOTIVO_NO_ENTERO)
+        return LecturaNumero(int(lectura.valor), None, None)
+    if tipo == ENTRADA_MONTO and lectura.valor_miles is not None:
+        return LecturaNumero(lectura.valor_miles, lectura.unidad, None)
+    return lectura
+
+# =========================================
+# Registro de pasos de la conversación
+# =========================================
+# Cada valor posible de contexto["esperando"] tiene su propia función,
+# registrada con @estado junto con:
+#   - entrada: qué tipo de respuesta espera ese paso (una opción del menú, un
+#     monto, una tasa, un plazo, un entero, sí/no o pagos por año; las
+#     constantes ENTRADA_* de "Lectura de números"). En los pasos
+#     numéricos el mensaje se lee con ese tipo antes de llamar a la función,
+#     que recibe la LecturaNumero ya validada en vez del mensaje;
+#   - critico: si es True, las respuestas de ese paso NO se interpretan como
+#     accesos directos del menú principal. Por ejemplo, en los pasos de tasa
+#     anual / años / frecuencia de pago o en los submenús, las respuestas son
+#     números del 1 al 8 que no deben confundirse con las opciones del menú;
+#   - siguiente: a qué pasos puede llevar, además de quedarse en el mismo
+#     (cuando la respuesta no sirvió) o terminar. Si un paso lleva a otro que
+#     no declaró, se registra un aviso "transicion_no_declarada".
+# Así, atender un mensaje es una sola búsqueda en ESTADOS, en vez de comparar
+# "esperando" contra cada paso uno por uno.
+class Estado:
+    __slots__ = ("nombre", "manejador", "entrada", "critico", "siguiente")
+
+    def __init__(self, nombre, manejador, entrada, critico, siguiente):
+        self.nombre = nombre
+        self.manejador = manejador
+        self.entrada = entrada
+        self.critico = critico
+        self.siguiente = siguiente
+
+    def __repr__(self):
+        return f"Estado({self.nombre!r}, entrada={self.entrada!r}, critico={self.critico})"
+
+ESTADOS = {}
+
+def estado(nombre, entrada, critico, siguiente=()):
+    """
+    Registra la función decorada como la que atiende el paso `nombre`. La
+    función recibe (entrada, texto_limpio, numero, contexto), donde entrada es
+    el MensajeNormalizado o, en los pasos numéricos, su LecturaNumero ya
+    validada con leer_entrada(mensaje, entrada), y devuelve la respuesta del
+    bot.
+    """
+    def registrar(manejador):
+        if nombre in ESTADOS:
+            raise ValueError(f"El paso {nombre!r} ya está registrado")
+        ESTADOS[nombre] = Estado(nombre, manejador, entrada, critico, tuple(siguiente))
+        return manejador
+    return registrar
+
+def _atender_paso(paso, entrada, texto_limpio, numero, contexto):
+    if paso.entrada in _UNIDADES_POR_ENTRADA:
+        entrada = leer_entrada(entrada, paso.entrada)
+    respuesta = paso.manejador(entrada, texto_limpio, numero, contexto)
+    sesion = estado_usuario.get(numero)
+    destino = sesion.get("esperando") if sesion is not None else None
+    if destino is not None and destino != paso.nombre and destino not in paso.siguiente:
+        registrar_evento("transicion_no_declarada", logging.WARNING, paso=paso.nombre, destino=destino)
+    return respuesta
+
+def pasos_criticos():
+    """Los pasos cuyas respuestas no se confunden con el menú principal."""
+    return frozenset(nombre for nombre, paso in ESTADOS.items() if paso.critico)
+
+def _procesar_mensaje_interno(entrada, numero, contexto):
+    """contexto es la sesión de este número antes del mensaje (None si no hay)."""
+    mensaje, texto_limpio = entrada.original, entrada.limpio
+
+    # "crédito 150000 45% 3 años quincenal": se atiende desde cualquier paso
+    respuesta = responder_comando(entrada, numero)
+    if respuesta is not None:
+        return respuesta
+
+    # Evitar menú si estamos en pasos críticos (ver "critico" en @estado)
+    estado_actual = ESTADOS.get(contexto.get("esperando")) if contexto is not None else None
+    subflujo_critico = estado_actual is not None and estado_actual.critico
 
     # ======================
     # MENÚ PRINCIPAL 1..8
     # ======================
     if not subflujo_critico:
         if texto_limpio in ["hola", "menu", "menú"]:
-            estado_usuario[numero] = {}
+            estado_usuario[numero] = Sesion()
             return saludo_inicial
 
         if texto_limpio in ["1", "ahorro"]:
-            estado_usuario[numero] = {"esperando": "menu_ahorro"}
+            estado_usuario[numero] = Sesion("menu_ahorro")
             return mensaje_submenu_ahorro
 
         if texto_limpio in ["2", "credito", "crédito"]:
-            estado_usuario[numero] = {"esperando": "menu_credito"}
+            estado_usuario[numero] = Sesion("menu_credito")
             return mensaje_submenu_credito
 
         if texto_limpio in ["3", "inversion", "inversión"]:
-            estado_usuario[numero] = {"esperando": "menu_inversion"}
+            estado_usuario[numero] = Sesion("menu_inversion")
             return mensaje_submenu_inversion
 
         if texto_limpio in ["4", "jubilacion", "jubilación"]:
-            estado_usuario[numero] = {"esperando": "menu_jubilacion"}
+            estado_usuario[numero] = Sesion("menu_jubilacion")
             return mensaje_submenu_jubilacion
 
         if texto_limpio in ["5", "género y finanzas", "genero y finanzas"]:
-            estado_usuario[numero] = {"esperando": "menu_genero"}
+            estado_usuario[numero] = Sesion("menu_genero")
             return mensaje_submenu_genero
 
         if texto_limpio in [
             "6", "evalúa tu salud financiera", "evalua tu salud financiera",
             "evaluar mi salud financiera", "salud financiera",
         ]:
-            estado_usuario[numero] = {"esperando": "menu_salud"}
+            estado_usuario[numero] = Sesion("menu_salud")
             return mensaje_submenu_salud
 
         if texto_limpio in ["7", "glosario", "glosario de términos financieros", "glosario de terminos financieros"]:
-            estado_usuario[numero] = {}
+            estado_usuario[numero] = Sesion()
             return mensaje_glosario
 
         if texto_limpio in ["8", "quiénes hicimos este bot", "¿quiénes hicimos este bot?", "quienes hicimos este bot"]:
-            estado_usuario[numero] = {}
+            estado_usuario[numero] = Sesion()
             return mensaje_creditos
 
         # Accesos directos por nombre exacto de cada herramienta, para quien ya conoce el bot
         # y prefiere escribirlo directamente sin pasar por los submenús.
         if texto_limpio in ["simular un crédito", "simular crédito"]:
-            estado_usuario[numero] = {"esperando": "monto_credito"}
+            estado_usuario[numero] = Sesion("monto_credito")
             return "Perfecto. Para comenzar, dime el monto del crédito que deseas simular."
 
         if texto_limpio in ["ahorro con pagos extra", "ver cuánto me ahorro si doy pagos extra al crédito"]:
-            estado_usuario[numero] = {"esperando": "monto2"}
+            estado_usuario[numero] = Sesion("monto2")
             return "Para estimar tu ahorro con pagos extra, primero dime el Monto del crédito."
 
         if texto_limpio in ["costo real de compras a meses", "calcular el costo real de compras a pagos fijos en tiendas departamentales"]:
-            estado_usuario[numero] = {"esperando": "precio_contado"}
+            estado_usuario[numero] = Sesion("precio_contado")
             return (
                 "Vamos a calcular el costo real de una compra a pagos fijos.\n"
                 "Por favor dime lo siguiente:\n\n"
@@ -1297,7 +3464,7 @@ def _procesar_mensaje_interno(mensaje, numero):
             )
 
         if texto_limpio in ["cuánto me pueden prestar", "¿cuánto me pueden prestar?"]:
-            estado_usuario[numero] = {"esperando": "ingreso"}
+            estado_usuario[numero] = Sesion("ingreso")
             return (
                 "Vamos a calcular cuánto podrías solicitar como crédito, según tu capacidad de pago.\n\n"
                 "Primero necesito saber:\n"
@@ -1380,7 +3547,7 @@ def _procesar_mensaje_interno(mensaje, numero):
             )
 
         if texto_limpio in ["entender el buró de crédito"]:
-            estado_usuario[numero] = {"esperando": "submenu_buro"}
+            estado_usuario[numero] = Sesion("submenu_buro")
             return (
                 "El Buró de Crédito no es un enemigo, es solo un registro de cómo has manejado tus créditos. Y sí, puede ayudarte o perjudicarte según tu comportamiento.\n"
                 "________________________________________\n"
@@ -1405,1067 +3572,20 @@ def _procesar_mensaje_interno(mensaje, numero):
                 "¿Te gustaría saber cómo mejorar tu historial crediticio o qué pasos tomar para subir tu puntaje?\n"
                 "Responde *sí* o *no*."
             )
-
     # ===========================
     # LÓGICA DE ESTADOS (subflujos)
     # ===========================
-    if numero in estado_usuario and "esperando" in estado_usuario[numero]:
-        contexto = estado_usuario[numero]
-
-        # --- Submenú: Ahorro ---
-        if contexto["esperando"] == "menu_ahorro":
-            if texto_limpio in ["menu", "menú"]:
-                estado_usuario[numero] = {}
-                return saludo_inicial
-            if texto_limpio in [
-                "1", "cuánto debo apartar para lograr mi meta de ahorro",
-                "cuanto debo apartar para lograr mi meta de ahorro",
-            ]:
-                contexto["esperando"] = "ahorro_meta"
-                return (
-                    "🎯 Vamos a calcular cuánto necesitas apartar para lograr tu meta.\n\n"
-                    "1️⃣ ¿Cuánto dinero quieres tener ahorrado en total? (por ejemplo: 15000)"
-                )
-            if texto_limpio in [
-                "2", "consejos para ahorrar sin sufrir en el intento",
-                "consejos para ahorrar",
-            ]:
-                return mensaje_ahorro_consejos
-            if texto_limpio in [
-                "3", "dónde puedo comparar cuentas de ahorro entre bancos",
-                "donde puedo comparar cuentas de ahorro entre bancos",
-                "comparar cuentas de ahorro",
-            ]:
-                return mensaje_ahorro_comparar_cuentas
-            return "Por favor, elige una opción válida del menú de Ahorro, o escribe *menú* para regresar al inicio."
-
-        # --- Submenú: Inversión ---
-        if contexto["esperando"] == "menu_inversion":
-            if texto_limpio in ["menu", "menú"]:
-                estado_usuario[numero] = {}
-                return saludo_inicial
-            if texto_limpio in [
-                "1", "cuánto puede crecer mi dinero si invierto",
-                "cuanto puede crecer mi dinero si invierto",
-            ]:
-                contexto["esperando"] = "inversion_monto_inicial"
-                return (
-                    "📈 Vamos a calcular cuánto puede crecer tu dinero.\n\n"
-                    "1️⃣ ¿Con cuánto dinero vas a empezar a invertir? Si vas a empezar desde cero, "
-                    "escribe 0. (por ejemplo: 5000)"
-                )
-            if texto_limpio in [
-                "2", "conceptos básicos antes de invertir",
-                "conceptos basicos antes de invertir",
-            ]:
-                return mensaje_inversion_conceptos_basicos
-            if texto_limpio in [
-                "3", "cetes y cetesdirecto: invertir con bajo riesgo",
-                "cetes y cetesdirecto", "cetes", "cetesdirecto",
-            ]:
-                return mensaje_inversion_cetes
-            if texto_limpio in [
-                "4", "cómo identificar fraudes de inversión",
-                "como identificar fraudes de inversión",
-                "como identificar fraudes de inversion",
-            ]:
-                return mensaje_inversion_fraudes
-            return "Por favor, elige una opción válida del menú de Inversión, o escribe *menú* para regresar al inicio."
-
-        # --- Submenú: Jubilación ---
-        if contexto["esperando"] == "menu_jubilacion":
-            if texto_limpio in ["menu", "menú"]:
-                estado_usuario[numero] = {}
-                return saludo_inicial
-            if texto_limpio in [
-                "1", "cuánto debo ahorrar para mi retiro",
-                "cuanto debo ahorrar para mi retiro",
-            ]:
-                contexto["esperando"] = "jubilacion_meta"
-                return (
-                    "🌅 Vamos a calcular cuánto necesitas ahorrar para tu retiro.\n\n"
-                    "1️⃣ ¿Cuánto dinero te gustaría tener ahorrado para cuando te retires? (por ejemplo: 1500000)"
-                )
-            if texto_limpio in [
-                "2", "qué es una afore y cómo saber en cuál estoy",
-                "que es una afore y como saber en cual estoy",
-            ]:
-                return mensaje_jubilacion_afore
-            if texto_limpio in [
-                "3", "cómo se calcula mi pensión? ley 73 vs. ley 97",
-                "como se calcula mi pension ley 73 vs ley 97",
-                "ley 73", "ley 97", "ley 73 vs ley 97",
-            ]:
-                return mensaje_jubilacion_ley73_vs_ley97
-            if texto_limpio in [
-                "4", "aportaciones voluntarias: cómo aumentar tu ahorro para el retiro",
-                "aportaciones voluntarias",
-            ]:
-                return mensaje_jubilacion_aportaciones_voluntarias
-            if texto_limpio in [
-                "5", "qué pasa si cambio de trabajo o dejo de cotizar",
-                "que pasa si cambio de trabajo o dejo de cotizar",
-            ]:
-                return mensaje_jubilacion_cambio_trabajo
-            if texto_limpio in [
-                "6", "no he trabajado de forma formal ¿aún así puedo ahorrar para mi retiro",
-                "no he trabajado de forma formal, ¿aún así puedo ahorrar para mi retiro?",
-                "no he trabajado de forma formal aun asi puedo ahorrar para mi retiro",
-                "trabajador independiente",
-            ]:
-                return mensaje_jubilacion_independiente
-            return "Por favor, elige una opción válida del menú de Jubilación, o escribe *menú* para regresar al inicio."
-
-        # --- Submenú: Evalúa tu salud financiera ---
-        if contexto["esperando"] == "menu_salud":
-            if texto_limpio in ["menu", "menú"]:
-                estado_usuario[numero] = {}
-                return saludo_inicial
-            mapa_opciones = {
-                "1": ["resiliencia"],
-                "2": ["libertad"],
-                "3": ["seguridad"],
-                "4": ["control"],
-                "5": ORDEN_DIMENSIONES_SALUD,
-            }
-            dimensiones_elegidas = mapa_opciones.get(texto_limpio)
-            if dimensiones_elegidas is None:
-                return "Por favor, elige una opción del 1 al 5, o escribe *menú* para regresar al inicio."
-            estado_usuario[numero] = {
-                "esperando": "salud_pregunta",
-                "salud_dimensiones": dimensiones_elegidas,
-                "salud_dim_idx": 0,
-                "salud_preg_idx": 0,
-                "salud_puntajes": {},
-            }
-            primera_dim = DIMENSIONES_SALUD[dimensiones_elegidas[0]]
-            return (
-                "Vamos a empezar. Responde con la mayor honestidad posible; no hay respuestas correctas o "
-                "incorrectas, solo te ayudan a entender mejor tu situación 🙂\n\n"
-                + _formatear_pregunta_salud(primera_dim, 0, primera=True)
-            )
-
-        # --- Evalúa tu salud financiera: flujo de preguntas ---
-        if contexto["esperando"] == "salud_pregunta":
-            if texto_limpio in ["menu", "menú"]:
-                estado_usuario[numero] = {}
-                return saludo_inicial
-            if texto_limpio not in ["1", "2", "3", "4", "5"]:
-                return "Por favor responde con un número del 1 (completamente en desacuerdo) al 5 (completamente de acuerdo)."
-
-            valor = int(texto_limpio)
-            dim_key = contexto["salud_dimensiones"][contexto["salud_dim_idx"]]
-            contexto["salud_puntajes"][dim_key] = contexto["salud_puntajes"].get(dim_key, 0) + valor
-            contexto["salud_preg_idx"] += 1
-
-            resultado_texto = ""
-            dim_actual = DIMENSIONES_SALUD[dim_key]
-            if contexto["salud_preg_idx"] >= len(dim_actual["preguntas"]):
-                # Se completó esta dimensión: calculamos y mostramos su resultado.
-                resultado_texto = _resultado_dimension_salud(dim_key, contexto["salud_puntajes"][dim_key]) + "\n\n"
-                contexto["salud_dim_idx"] += 1
-                contexto["salud_preg_idx"] = 0
-
-                if contexto["salud_dim_idx"] >= len(contexto["salud_dimensiones"]):
-                    # No quedan más dimensiones por evaluar: terminamos aquí.
-                    estado_usuario[numero] = {"esperando": "menu_salud"}
-                    return resultado_texto + mensaje_salud_cierre
-
-            siguiente_dim_key = contexto["salud_dimensiones"][contexto["salud_dim_idx"]]
-            siguiente_dim = DIMENSIONES_SALUD[siguiente_dim_key]
-            idx = contexto["salud_preg_idx"]
-            pregunta_texto = _formatear_pregunta_salud(siguiente_dim, idx, primera=(idx == 0))
-            return resultado_texto + pregunta_texto
-
-        # --- Submenú: Género y finanzas ---
-        if contexto["esperando"] == "menu_genero":
-            if texto_limpio in ["menu", "menú"]:
-                estado_usuario[numero] = {}
-                return saludo_inicial
-            if texto_limpio in [
-                "1", "la brecha de género en el ahorro para el retiro",
-                "la brecha de genero en el ahorro para el retiro",
-            ]:
-                return mensaje_genero_brecha_retiro
-            if texto_limpio in [
-                "2", "qué es la violencia económica y patrimonial",
-                "que es la violencia economica y patrimonial",
-            ]:
-                return mensaje_genero_violencia_economica
-            return "Por favor, elige una opción válida de esta sección, o escribe *menú* para regresar al inicio."
-
-        # --- Submenú: Crédito ---
-        if contexto["esperando"] == "menu_credito":
-            if texto_limpio in ["menu", "menú"]:
-                estado_usuario[numero] = {}
-                return saludo_inicial
-            if texto_limpio == "1":
-                estado_usuario[numero] = {"esperando": "monto_credito"}
-                return "Perfecto. Para comenzar, dime el monto del crédito que deseas simular."
-            if texto_limpio == "2":
-                estado_usuario[numero] = {"esperando": "monto2"}
-                return "Para estimar tu ahorro con pagos extra, primero dime el Monto del crédito."
-            if texto_limpio == "3":
-                estado_usuario[numero] = {"esperando": "precio_contado"}
-                return (
-                    "Vamos a calcular el costo real de una compra a pagos fijos.\n"
-                    "Por favor dime lo siguiente:\n\n"
-                    "1️⃣ ¿Cuál es el precio de contado del producto? (ejemplo: 1800)"
-                )
-            if texto_limpio == "4":
-                estado_usuario[numero] = {"esperando": "ingreso"}
-                return (
-                    "Vamos a calcular cuánto podrías solicitar como crédito, según tu capacidad de pago.\n\n"
-                    "Primero necesito saber:\n"
-                    "1️⃣ ¿Cuál es tu ingreso mensual neto? Es decir, lo que realmente recibes después de "
-                    "impuestos: lo que te depositan o te dan en efectivo. (ejemplo: 15000)"
-                )
-            if texto_limpio == "8":
-                contexto["esperando"] = "submenu_buro"
-                return (
-                    "El Buró de Crédito no es un enemigo, es solo un registro de cómo has manejado tus créditos. Y sí, puede ayudarte o perjudicarte según tu comportamiento.\n"
-                    "________________________________________\n"
-                    "📊 ¿Qué es el Buró de Crédito?\n"
-                    "Es una empresa que guarda tu historial de pagos.\n"
-                    "📌 Si pagas bien, tu historial será positivo.\n"
-                    "📌 Si te atrasas, se reflejará ahí.\n"
-                    "________________________________________\n"
-                    "💡 Tener historial no es malo.\n"
-                    "De hecho, si nunca has pedido un crédito, no aparecerás en Buró y eso puede dificultar que te aprueben uno.\n"
-                    "________________________________________\n"
-                    "📈 Tu comportamiento crea un “score” o puntaje.\n"
-                    "• Pagar a tiempo te ayuda\n"
-                    "• Deber mucho o atrasarte te baja el score\n"
-                    "• Tener muchas tarjetas al tope también afecta\n"
-                    "________________________________________\n"
-                    "❗ Cuidado con estas ideas falsas:\n"
-                    "• “Estoy en Buró” no siempre es malo\n"
-                    "• No es una lista negra\n"
-                    "• No te borran tan fácil (los registros duran años)\n"
-                    "________________________________________\n"
-                    "¿Te gustaría saber cómo mejorar tu historial crediticio o qué pasos tomar para subir tu puntaje?\n"
-                    "Responde *sí* o *no*."
-                )
-            if texto_limpio == "5":
-                return (
-                    "🟡 Consejos para pagar un crédito sin ahogarte\n"
-                    "Pagar un crédito no tiene que sentirse como una carga eterna. Aquí van algunos consejos sencillos para ayudarte a pagar con más tranquilidad y menos estrés:\n"
-                    "________________________________________\n"
-                    "✅ 1. Haz pagos anticipados cuando puedas\n"
-                    "📌 Aunque no sea obligatorio, abonar un poco más al capital te ahorra intereses y reduce el plazo.\n"
-                    "💡 Incluso $200 o $500 adicionales hacen una gran diferencia con el tiempo.\n"
-                    "________________________________________\n"
-                    "✅ 2. Programa tus pagos en automático\n"
-                    "📌 Evitas atrasos, recargos y estrés.\n"
-                    "💡 Si no tienes domiciliación, pon recordatorios para no fallar.\n"
-                    "________________________________________\n"
-                    "✅ 3. Revisa si puedes cambiar tu crédito por uno mejor\n"
-                    "📌 A esto se le llama “reestructura” o “portabilidad”.\n"
-                    "💡 Si tu historial ha mejorado, podrías conseguir mejores condiciones.\n"
-                    "________________________________________\n"
-                    "✅ 4. Haz un presupuesto mensual\n"
-                    "📌 Saber cuánto entra y cuánto sale te ayuda a organizar tus pagos sin descuidar otras necesidades.\n"
-                    "💡 Apóyate en apps, papel o Excel, lo que te funcione.\n"
-                    "________________________________________\n"
-                    "✅ 5. Prioriza las deudas más caras\n"
-                    "📌 Si tienes varias, enfócate primero en las que tienen interés más alto, como tarjetas de crédito.\n"
-                    "________________________________________\n"
-                ) + "\n" + mensaje_submenu_credito
-            if texto_limpio == "6":
-                return (
-                    "Muchas veces un crédito parece accesible… hasta que ves lo que terminas pagando. Aquí te doy algunas claves para detectar si un crédito es caro:\n\n"
-                    "🔍 1. CAT (Costo Anual Total)\n"
-                    "Es una medida que incluye la tasa de interés, comisiones y otros cargos.\n"
-                    "📌 Entre más alto el CAT, más caro te saldrá el crédito.\n"
-                    "💡 Compara el CAT entre diferentes instituciones, no solo la tasa.\n\n"
-                    "🔍 2. Comisiones escondidas\n"
-                    "Algunos créditos cobran por apertura, por manejo, por pagos tardíos o por pagos anticipados 😵\n"
-                    "📌 Lee siempre el contrato antes de firmar.\n\n"
-                    "🔍 3. Tasa de interés variable\n"
-                    "📌 Algunos créditos no tienen tasa fija, sino que pueden subir.\n"
-                    "💡 Revisa si tu tasa es fija o variable. Las variables pueden volverse muy caras si sube la inflación.\n\n"
-                    "🔍 4. Pago mensual bajo con plazo largo\n"
-                    "Parece atractivo, pero terminas pagando muchísimo más en intereses.\n\n"
-                    "❗ Si el crédito parece demasiado fácil o rápido, pero no entiendes bien cuánto vas a pagar en total... ¡es una señal de alerta!\n\n"
-                ) + "\n" + mensaje_submenu_credito
-            if texto_limpio == "7":
-                return (
-                    "Solicitar un crédito es una gran responsabilidad. Aquí te comparto algunos errores comunes que muchas personas cometen… ¡y cómo evitarlos!\n"
-                    "________________________________________\n"
-                    "❌ 1. No saber cuánto terminarás pagando en total\n"
-                    "Muchas personas solo se fijan en el pago mensual y no en el costo total del crédito.\n"
-                    "✅ Usa simuladores (como el que tengo 😎) para saber cuánto pagarás realmente.\n"
-                    "________________________________________\n"
-                    "❌ 2. Pedir más dinero del que realmente necesitas\n"
-                    "📌 Entre más pidas, más intereses pagas.\n"
-                    "✅ Pide solo lo necesario y asegúrate de poder pagarlo.\n"
-                    "________________________________________\n"
-                    "❌ 3. Aceptar el primer crédito que te ofrecen\n"
-                    "📌 Hay diferencias enormes entre una institución y otra.\n"
-                    "✅ Compara tasas, comisiones y condiciones antes de decidir.\n"
-                    "________________________________________\n"
-                    "❌ 4. No leer el contrato completo\n"
-                    "Sí, puede ser largo, pero ahí están los detalles importantes:\n"
-                    "📌 ¿Hay comisiones por pagar antes de tiempo?\n"
-                    "📌 ¿Qué pasa si te atrasas?\n"
-                    "✅ Lee con calma o pide que te lo expliquen.\n"
-                    "________________________________________\n"
-                    "❌ 5. Usar un crédito sin un plan de pago\n"
-                    "📌 Si no sabes cómo lo vas a pagar, puedes meterte en problemas.\n"
-                    "✅ Haz un presupuesto antes de aceptar cualquier crédito.\n\n"
-                ) + "\n" + mensaje_submenu_credito
-            if texto_limpio == "9":
-                return mensaje_credito_derechos_cobranza
-            return "Por favor, elige un número del 1 al 9 del menú de Crédito, o escribe *menú* para regresar al inicio."
-
-        # --- Ahorro: flujo de meta de ahorro ---
-        if contexto["esperando"] == "ahorro_meta":
-            try:
-                contexto["ahorro_meta"] = Decimal(mensaje.replace(",", ""))
-                if contexto["ahorro_meta"] <= 0:
-                    return "La meta debe ser mayor a cero. ¿Cuánto dinero quieres tener ahorrado en total? (ejemplo: 15000)"
-                contexto["esperando"] = "ahorro_inicial"
-                return "2️⃣ ¿Ya tienes algo ahorrado hoy para esta meta? Si no tienes nada todavía, escribe 0. (por ejemplo: 2000)"
-            except:
-                return "Por favor, indica tu meta de ahorro como un número (ejemplo: 15000)."
-
-        if contexto["esperando"] == "ahorro_inicial":
-            try:
-                contexto["ahorro_inicial"] = Decimal(mensaje.replace(",", ""))
-                if contexto["ahorro_inicial"] < 0:
-                    return "Ese número no puede ser negativo 🙂 Si no tienes nada ahorrado todavía, escribe 0."
-                contexto["esperando"] = "ahorro_tiempo_numero"
-                return "3️⃣ ¿En cuánto tiempo quieres lograrlo? Escribe solo el número (por ejemplo: 6)"
-            except:
-                return "Por favor, escribe solo un número (ejemplo: 2000, o 0 si no tienes nada ahorrado todavía)."
-
-        if contexto["esperando"] == "ahorro_tiempo_numero":
-            try:
-                tiempo_numero = Decimal(mensaje.replace(",", ""))
-                if tiempo_numero <= 0:
-                    return "El tiempo debe ser mayor a cero. ¿En cuánto tiempo quieres lograrlo? (ejemplo: 6)"
-                contexto["ahorro_tiempo_numero"] = tiempo_numero
-                contexto["esperando"] = "ahorro_tiempo_unidad"
-                return (
-                    "¿Ese número que diste fue en meses o en años?\n"
-                    "1️⃣ Meses\n"
-                    "2️⃣ Años"
-                )
-            except:
-                return "Por favor, indica el tiempo como un número (ejemplo: 6)."
-
-        if contexto["esperando"] == "ahorro_tiempo_unidad":
-            if texto_limpio not in ["1", "2", "meses", "años", "anos", "año", "ano"]:
-                return "Por favor, elige 1 (Meses) o 2 (Años)."
-            if texto_limpio in ["1", "meses"]:
-                meses_totales = contexto["ahorro_tiempo_numero"]
-            else:
-                meses_totales = contexto["ahorro_tiempo_numero"] * Decimal("12")
-            contexto["ahorro_meses_totales"] = meses_totales
-            contexto["esperando"] = "ahorro_frecuencia"
-            return MENSAJE_FRECUENCIA_AHORRO
-
-        if contexto["esperando"] == "ahorro_frecuencia":
-            if texto_limpio == "5":
-                contexto["esperando"] = "ahorro_frecuencia_otro"
-                return "¿Cuántas veces al año en total apartarías dinero? (ejemplo: 24)"
-            if texto_limpio not in FRECUENCIAS_PAGO:
-                return "Por favor, elige una opción del 1 al 5."
-            try:
-                frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
-                resultado = calcular_ahorro_periodico(
-                    contexto["ahorro_meta"],
-                    contexto["ahorro_inicial"],
-                    contexto["ahorro_meses_totales"],
-                    periodos_por_anio,
-                    frecuencia_label,
-                )
-                estado_usuario.pop(numero, None)
-                return resultado
-            except Exception:
-                return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
-
-        if contexto["esperando"] == "ahorro_frecuencia_otro":
-            try:
-                periodos_por_anio = Decimal(mensaje.strip())
-                if periodos_por_anio <= 0:
-                    return "El número de veces al año debe ser mayor a cero (ejemplo: 24)."
-                resultado = calcular_ahorro_periodico(
-                    contexto["ahorro_meta"],
-                    contexto["ahorro_inicial"],
-                    contexto["ahorro_meses_totales"],
-                    periodos_por_anio,
-                    "personalizada",
-                )
-                estado_usuario.pop(numero, None)
-                return resultado
-            except Exception:
-                return "Por favor, indica un número de veces al año (ejemplo: 24)."
-
-        # --- Inversión: flujo de crecimiento de una inversión ---
-        if contexto["esperando"] == "inversion_monto_inicial":
-            try:
-                monto_inicial = Decimal(mensaje.replace(",", ""))
-                if monto_inicial < 0:
-                    return "Ese número no puede ser negativo 🙂 Si vas a empezar desde cero, escribe 0."
-                contexto["inversion_monto_inicial"] = monto_inicial
-                contexto["esperando"] = "inversion_aportacion"
-                return (
-                    "2️⃣ ¿Cuánto planeas aportar en cada periodo? Si solo vas a invertir el monto "
-                    "inicial y nada más, escribe 0. (por ejemplo: 500)"
-                )
-            except:
-                return "Por favor, indica el monto inicial como un número (ejemplo: 5000, o 0 si vas a empezar desde cero)."
-
-        if contexto["esperando"] == "inversion_aportacion":
-            try:
-                aportacion = Decimal(mensaje.replace(",", ""))
-                if aportacion < 0:
-                    return "Ese número no puede ser negativo 🙂 Si no vas a aportar más, escribe 0."
-                if contexto["inversion_monto_inicial"] == 0 and aportacion == 0:
-                    contexto["esperando"] = "inversion_monto_inicial"
-                    return (
-                        "Para calcular el crecimiento necesito que aportes algo, ya sea al inicio o en "
-                        "cada periodo 🙂 Empecemos de nuevo:\n\n"
-                        "1️⃣ ¿Con cuánto dinero vas a empezar a invertir? Si vas a empezar desde cero, "
-                        "escribe 0. (por ejemplo: 5000)"
-                    )
-                contexto["inversion_aportacion"] = aportacion
-                contexto["esperando"] = "inversion_tasa_anual"
-                return "3️⃣ ¿Qué tasa de rendimiento ANUAL esperas obtener? (por ejemplo, si esperas un 10% anual, escribe 10)"
-            except:
-                return "Por favor, indica la aportación por periodo como un número (ejemplo: 500, o 0 si no vas a aportar más)."
-
-        if contexto["esperando"] == "inversion_tasa_anual":
-            try:
-                tasa_anual = Decimal(mensaje.replace(",", "").replace("%", ""))
-                if tasa_anual < 0:
-                    return "La tasa esperada no puede ser negativa para este cálculo 🙂 Indica un número positivo (ejemplo: 10)."
-                contexto["inversion_tasa_anual"] = tasa_anual
-                contexto["esperando"] = "inversion_tiempo_numero"
-                return "4️⃣ ¿En cuánto tiempo? Escribe solo el número (por ejemplo: 5)"
-            except:
-                return "Por favor, indica la tasa de rendimiento anual como un número (ejemplo: 10)."
-
-        if contexto["esperando"] == "inversion_tiempo_numero":
-            try:
-                tiempo_numero = Decimal(mensaje.replace(",", ""))
-                if tiempo_numero <= 0:
-                    return "El tiempo debe ser mayor a cero. ¿En cuánto tiempo? (ejemplo: 5)"
-                contexto["inversion_tiempo_numero"] = tiempo_numero
-                contexto["esperando"] = "inversion_tiempo_unidad"
-                return (
-                    "¿Ese número que diste fue en meses o en años?\n"
-                    "1️⃣ Meses\n"
-                    "2️⃣ Años"
-                )
-            except:
-                return "Por favor, indica el tiempo como un número (ejemplo: 5)."
-
-        if contexto["esperando"] == "inversion_tiempo_unidad":
-            if texto_limpio not in ["1", "2", "meses", "años", "anos", "año", "ano"]:
-                return "Por favor, elige 1 (Meses) o 2 (Años)."
-            if texto_limpio in ["1", "meses"]:
-                anios = contexto["inversion_tiempo_numero"] / Decimal("12")
-            else:
-                anios = contexto["inversion_tiempo_numero"]
-            contexto["inversion_anios"] = anios
-            contexto["esperando"] = "inversion_frecuencia"
-            return MENSAJE_FRECUENCIA_INVERSION
-
-        if contexto["esperando"] == "inversion_frecuencia":
-            if texto_limpio == "5":
-                contexto["esperando"] = "inversion_frecuencia_otro"
-                return "¿Cuántas veces al año en total aportarías? (ejemplo: 24)"
-            if texto_limpio not in FRECUENCIAS_PAGO:
-                return "Por favor, elige una opción del 1 al 5."
-            try:
-                frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
-                resultado = calcular_crecimiento_inversion(
-                    contexto["inversion_monto_inicial"],
-                    contexto["inversion_aportacion"],
-                    contexto["inversion_anios"],
-                    contexto["inversion_tasa_anual"],
-                    periodos_por_anio,
-                    frecuencia_label,
-                )
-                estado_usuario.pop(numero, None)
-                return resultado
-            except Exception:
-                return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
-
-        if contexto["esperando"] == "inversion_frecuencia_otro":
-            try:
-                periodos_por_anio = Decimal(mensaje.strip())
-                if periodos_por_anio <= 0:
-                    return "El número de veces al año debe ser mayor a cero (ejemplo: 24)."
-                resultado = calcular_crecimiento_inversion(
-                    contexto["inversion_monto_inicial"],
-                    contexto["inversion_aportacion"],
-                    contexto["inversion_anios"],
-                    contexto["inversion_tasa_anual"],
-                    periodos_por_anio,
-                    "personalizada",
-                )
-                estado_usuario.pop(numero, None)
-                return resultado
-            except Exception:
-                return "Por favor, indica un número de veces al año (ejemplo: 24)."
-
-        # --- Jubilación: flujo de meta de ahorro para el retiro ---
-        if contexto["esperando"] == "jubilacion_meta":
-            try:
-                contexto["jubilacion_meta"] = Decimal(mensaje.replace(",", ""))
-                if contexto["jubilacion_meta"] <= 0:
-                    return "La meta debe ser mayor a cero. ¿Cuánto dinero te gustaría tener ahorrado para tu retiro? (ejemplo: 1500000)"
-                contexto["esperando"] = "jubilacion_ahorro_actual"
-                return "2️⃣ ¿Ya tienes algo ahorrado hoy pensando en tu retiro? Si no tienes nada todavía, escribe 0. (por ejemplo: 50000)"
-            except:
-                return "Por favor, indica tu meta como un número (ejemplo: 1500000)."
-
-        if contexto["esperando"] == "jubilacion_ahorro_actual":
-            try:
-                contexto["jubilacion_ahorro_actual"] = Decimal(mensaje.replace(",", ""))
-                if contexto["jubilacion_ahorro_actual"] < 0:
-                    return "Ese número no puede ser negativo 🙂 Si no tienes nada ahorrado todavía, escribe 0."
-                contexto["esperando"] = "jubilacion_tasa_anual"
-                return "3️⃣ ¿Qué tasa de rendimiento ANUAL esperas obtener sobre ese ahorro? (por ejemplo, si esperas un 8% anual, escribe 8)"
-            except:
-                return "Por favor, escribe solo un número (ejemplo: 50000, o 0 si no tienes nada ahorrado todavía)."
-
-        if contexto["esperando"] == "jubilacion_tasa_anual":
-            try:
-                tasa_anual = Decimal(mensaje.replace(",", "").replace("%", ""))
-                if tasa_anual < 0:
-                    return "La tasa esperada no puede ser negativa para este cálculo 🙂 Indica un número positivo (ejemplo: 8)."
-                contexto["jubilacion_tasa_anual"] = tasa_anual
-                contexto["esperando"] = "jubilacion_tiempo_numero"
-                return "4️⃣ ¿En cuánto tiempo te quieres retirar? Escribe solo el número (por ejemplo: 25)"
-            except:
-                return "Por favor, indica la tasa de rendimiento anual como un número (ejemplo: 8)."
-
-        if contexto["esperando"] == "jubilacion_tiempo_numero":
-            try:
-                tiempo_numero = Decimal(mensaje.replace(",", ""))
-                if tiempo_numero <= 0:
-                    return "El tiempo debe ser mayor a cero. ¿En cuánto tiempo te quieres retirar? (ejemplo: 25)"
-                contexto["jubilacion_tiempo_numero"] = tiempo_numero
-                contexto["esperando"] = "jubilacion_tiempo_unidad"
-                return (
-                    "¿Ese número que diste fue en meses o en años?\n"
-                    "1️⃣ Meses\n"
-                    "2️⃣ Años"
-                )
-            except:
-                return "Por favor, indica el tiempo como un número (ejemplo: 25)."
-
-        if contexto["esperando"] == "jubilacion_tiempo_unidad":
-            if texto_limpio not in ["1", "2", "meses", "años", "anos", "año", "ano"]:
-                return "Por favor, elige 1 (Meses) o 2 (Años)."
-            if texto_limpio in ["1", "meses"]:
-                anios = contexto["jubilacion_tiempo_numero"] / Decimal("12")
-            else:
-                anios = contexto["jubilacion_tiempo_numero"]
-            contexto["jubilacion_anios"] = anios
-            contexto["esperando"] = "jubilacion_frecuencia"
-            return MENSAJE_FRECUENCIA_JUBILACION
-
-        if contexto["esperando"] == "jubilacion_frecuencia":
-            if texto_limpio == "5":
-                contexto["esperando"] = "jubilacion_frecuencia_otro"
-                return "¿Cuántas veces al año en total ahorrarías para tu retiro? (ejemplo: 24)"
-            if texto_limpio not in FRECUENCIAS_PAGO:
-                return "Por favor, elige una opción del 1 al 5."
-            try:
-                frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
-                resultado = calcular_ahorro_jubilacion(
-                    contexto["jubilacion_meta"],
-                    contexto["jubilacion_ahorro_actual"],
-                    contexto["jubilacion_anios"],
-                    contexto["jubilacion_tasa_anual"],
-                    periodos_por_anio,
-                    frecuencia_label,
-                )
-                estado_usuario.pop(numero, None)
-                return resultado
-            except Exception:
-                return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
-
-        if contexto["esperando"] == "jubilacion_frecuencia_otro":
-            try:
-                periodos_por_anio = Decimal(mensaje.strip())
-                if periodos_por_anio <= 0:
-                    return "El número de veces al año debe ser mayor a cero (ejemplo: 24)."
-                resultado = calcular_ahorro_jubilacion(
-                    contexto["jubilacion_meta"],
-                    contexto["jubilacion_ahorro_actual"],
-                    contexto["jubilacion_anios"],
-                    contexto["jubilacion_tasa_anual"],
-                    periodos_por_anio,
-                    "personalizada",
-                )
-                estado_usuario.pop(numero, None)
-                return resultado
-            except Exception:
-                return "Por favor, indica un número de veces al año (ejemplo: 24)."
-
-        # FLUJO 2: abonos extra directos
-        if contexto["esperando"] == "monto2":
-            try:
-                contexto["monto"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "tasa_anual2"
-                return (
-                    "¿Cuál es la tasa de interés ANUAL que te ofrecieron?\n"
-                    "Es la que normalmente te dicen en el banco o la tienda (ejemplo: si te "
-                    "dijeron 45% anual, solo escribe 45)."
-                )
-            except:
-                return "Por favor, indica el monto del crédito como un número."
-
-        if contexto["esperando"] == "tasa_anual2":
-            try:
-                contexto["tasa_anual"] = Decimal(mensaje.replace(",", "").replace("%", ""))
-                contexto["esperando"] = "anios2"
-                return "¿A cuántos años es el crédito? (puedes usar decimales, ejemplo: 2.5)"
-            except:
-                return "Por favor, indica la tasa anual como un número (ejemplo: 45)."
-
-        if contexto["esperando"] == "anios2":
-            try:
-                contexto["anios"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "frecuencia2"
-                return MENSAJE_FRECUENCIA
-            except:
-                return "Por favor, indica los años como un número (ejemplo: 2.5)."
-
-        if contexto["esperando"] == "frecuencia2":
-            if texto_limpio == "5":
-                contexto["esperando"] = "frecuencia_otro2"
-                return "¿Cuántos pagos haces al año en total? (ejemplo: 24)"
-            if texto_limpio not in FRECUENCIAS_PAGO:
-                return "Por favor, elige una opción del 1 al 5."
-            try:
-                frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
-                return _resolver_frecuencia_flujo2(contexto, frecuencia_label, periodos_por_anio)
-            except Exception:
-                return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
-
-        if contexto["esperando"] == "frecuencia_otro2":
-            try:
-                periodos_por_anio = Decimal(mensaje.strip())
-                return _resolver_frecuencia_flujo2(contexto, "personalizada", periodos_por_anio)
-            except Exception:
-                return "Por favor, indica un número de pagos al año (ejemplo: 24)."
-
-        if contexto["esperando"] == "abono_extra2":
-            try:
-                contexto["abono"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "desde2"
-                return "¿A partir de qué periodo comenzarás a abonar esa cantidad extra? (Ejemplo: 4)"
-            except:
-                return "Por favor, escribe solo la cantidad del abono extra (ejemplo: 500)"
-
-        if contexto["esperando"] == "desde2":
-            try:
-                desde = int(mensaje.strip())
-                total_sin, total_con, ahorro, pagos_menos = calcular_ahorro_por_abonos(
-                    contexto["monto"], contexto["tasa"],
-                    contexto["plazo"], contexto["abono"], desde
-                )
-                estado_usuario.pop(numero)
-                return (
-                    f"💸 Si pagaras este crédito sin hacer abonos extra, terminarías pagando ${float(total_sin):,.2f} en total.\n"
-                    f"Pero si decides abonar ${float(contexto['abono']):,.2f} adicionales por periodo desde el periodo {desde}...\n"
-                    f"✅ Terminarías de pagar en menos tiempo (¡te ahorras {pagos_menos} pagos!)\n"
-                    f"💰 Pagarías ${float(total_con):,.2f} en total\n"
-                    f"🧮 Y te ahorrarías ${float(ahorro):,.2f} solo en intereses.\n\n"
-                    "Escribe *menú* para volver al inicio."
-                )
-            except:
-                return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
-
-        # FLUJO 1: Simular crédito
-        if contexto["esperando"] == "monto_credito":
-            try:
-                contexto["monto"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "tasa_anual_credito"
-                return (
-                    "¿Cuál es la tasa de interés ANUAL que te ofrecieron?\n"
-                    "Es la que normalmente te dicen en el banco o la tienda (ejemplo: si te "
-                    "dijeron 45% anual, solo escribe 45)."
-                )
-            except:
-                return "Por favor, indica el monto como un número (ejemplo: 100000)"
-
-        if contexto["esperando"] == "tasa_anual_credito":
-            try:
-                contexto["tasa_anual"] = Decimal(mensaje.replace(",", "").replace("%", ""))
-                contexto["esperando"] = "anios_credito"
-                return "¿A cuántos años es el crédito? (puedes usar decimales, ejemplo: 2.5)"
-            except:
-                return "Por favor, indica la tasa anual como un número (ejemplo: 45)."
-
-        if contexto["esperando"] == "anios_credito":
-            try:
-                contexto["anios"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "frecuencia_credito"
-                return MENSAJE_FRECUENCIA
-            except:
-                return "Por favor, indica los años como un número (ejemplo: 2.5)."
-
-        if contexto["esperando"] == "frecuencia_credito":
-            if texto_limpio == "5":
-                contexto["esperando"] = "frecuencia_otro_credito"
-                return "¿Cuántos pagos haces al año en total? (ejemplo: 24)"
-            if texto_limpio not in FRECUENCIAS_PAGO:
-                return "Por favor, elige una opción del 1 al 5."
-            try:
-                frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
-                return _resolver_frecuencia_flujo1(contexto, frecuencia_label, periodos_por_anio)
-            except Exception:
-                return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
-
-        if contexto["esperando"] == "frecuencia_otro_credito":
-            try:
-                periodos_por_anio = Decimal(mensaje.strip())
-                return _resolver_frecuencia_flujo1(contexto, "personalizada", periodos_por_anio)
-            except Exception:
-                return "Por favor, indica un número de pagos al año (ejemplo: 24)."
-
-        if contexto["esperando"] == "ver_si_abonos1":
-            if texto_limpio in ["si", "sí"]:
-                contexto["esperando"] = "abono_extra1"
-                return "¿Cuánto deseas abonar extra por periodo? (Ejemplo: 500)"
-            elif texto_limpio == "no":
-                estado_usuario.pop(numero)
-                return "Ok, regresamos al inicio. Escribe *menú* si deseas ver otras opciones."
-            else:
-                return "Por favor, responde *sí* o *no*."
-
-        if contexto["esperando"] == "abono_extra1":
-            try:
-                contexto["abono"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "desde_cuando1"
-                return "¿A partir de qué periodo comenzarás a abonar esa cantidad extra? (Ejemplo: 4)"
-            except:
-                return "Por favor, un número válido (ej: 500)"
-
-        if contexto["esperando"] == "desde_cuando1":
-            try:
-                desde = int(mensaje.strip())
-                total_sin, total_con, ahorro, pagos_menos = calcular_ahorro_por_abonos(
-                    contexto["monto"], contexto["tasa"],
-                    contexto["plazo"], contexto["abono"], desde
-                )
-                estado_usuario.pop(numero)
-                return (
-                    f"💸 Si pagaras este crédito sin hacer abonos extra, terminarías pagando ${float(total_sin):,.2f} en total.\n\n"
-                    f"Pero si decides abonar ${float(contexto['abono']):,.2f} adicionales por periodo desde el periodo {desde}...\n"
-                    f"✅ Terminarías de pagar en menos tiempo (¡te ahorras {pagos_menos} pagos!)\n"
-                    f"💰 Pagarías ${float(total_con):,.2f} en total\n"
-                    f"🧮 Y te ahorrarías ${float(ahorro):,.2f} solo en intereses.\n\n"
-                    "Escribe *menú* para volver al inicio."
-                )
-            except:
-                return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
-
-                # Opción 3 (compras a pagos fijos)
-        if contexto["esperando"] == "precio_contado":
-            try:
-                contexto["precio_contado"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "pago_fijo_tienda"
-                return "2️⃣ ¿De cuánto será cada pago (por ejemplo: 250)?"
-            except:
-                return "Por favor, indica el precio de contado con números (ejemplo: 1800)"
-
-        if contexto["esperando"] == "pago_fijo_tienda":
-            try:
-                contexto["pago_fijo_tienda"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "numero_pagos_tienda"
-                return "3️⃣ ¿Cuántos pagos harás en total? (ejemplo: 24)"
-            except:
-                return "Por favor, escribe solo el número del pago (ejemplo: 250)."
-
-       # PRIMER PASO: guardamos num_pagos y pedimos periodos anuales
-        if contexto["esperando"] == "numero_pagos_tienda":
-            try:
-                # Convertimos la entrada a entero
-                numero_pagos = int(mensaje.strip())
-                contexto["numero_pagos_tienda"] = numero_pagos
-
-                # Cambiamos a un nuevo estado donde preguntamos cuántos periodos hay en 1 año
-                contexto["esperando"] = "pedir_periodos_anuales_tienda"
-                return (
-                    "Para calcular la tasa anual real, necesito saber cuántos periodos hay en 1 año.\n"
-                    "Por ejemplo:\n"
-                    "• 12 si es mensual\n"
-                    "• 24 si es quincenal (cada 15 días)\n"
-                    "• 26 si es catorcenal (cada 14 días)\n"
-                    "• 52 si es semanal\n\n"
-                    "Escribe solo el número:"
-                )
-            except:
-                return "Ocurrió un error. Indica cuántos pagos totales harás (ejemplo: 24)."
-
-        # SEGUNDO PASO: usuario indica periodos anuales
-        if contexto["esperando"] == "pedir_periodos_anuales_tienda":
-            try:
-                periodos_anuales = int(mensaje.strip())
-                contexto["periodos_anuales"] = periodos_anuales  # ✅ Se guarda en el contexto
-
-                mensaje_resultado = calcular_costo_credito_tienda(
-                    contexto["precio_contado"],
-                    contexto["pago_fijo_tienda"],
-                    contexto["numero_pagos_tienda"],
-                    periodos_anuales
-                )
-
-                estado_usuario.pop(numero)
-                return mensaje_resultado
-
-            except Exception as e:
-                print(f"Error al calcular tasa anual: {e}")
-                return "Ocurrió un error. Asegúrate de indicar cuántos periodos hay en un año con un número (ej: 24)."
-
-
-        # Opción 4 (capacidad de pago)
-        if contexto["esperando"] == "ingreso":
-            try:
-                contexto["ingreso"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "pagos_fijos"
-                return (
-                    "2️⃣ ¿Cuánto pagas mensualmente en créditos formales o instituciones financieras?\n"
-                    "(Es decir, en pagos de préstamos personales, hipotecas, crédito de auto, crédito de "
-                    "nómina, etc.) Si no tienes ninguno, escribe 0. (ejemplo: 1800)"
-                )
-            except:
-                return "Por favor, escribe un número válido (ej: 12500)"
-
-        if contexto["esperando"] == "pagos_fijos":
-            try:
-                contexto["pagos_fijos"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "deuda_revolvente"
-                return (
-                    "3️⃣ ¿Cuánto debes actualmente en tarjetas de crédito u otras deudas revolventes?\n"
-                    "(Las deudas revolventes son las que no tienen una fecha fija para terminarse de "
-                    "pagar, como las tarjetas de crédito: vas pagando lo que usas cada mes.)\n"
-                    "Si no tienes ninguna, escribe 0. (ejemplo: 5000)"
-                )
-            except:
-                return "Por favor, indica la cantidad mensual que pagas en créditos (ej: 1800)"
-
-        if contexto["esperando"] == "deuda_revolvente":
-            try:
-                contexto["deuda_revolvente"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "riesgo"
-                return (
-                    "4️⃣ Por último, sé honesto/a contigo mismo/a: ¿cómo describirías tu forma de pagar "
-                    "tus deudas hasta ahora?\n"
-                    "1. Puntual (casi siempre pago a tiempo)\n"
-                    "2. A veces me atraso (pero no es lo común)\n"
-                    "3. Se me complica seguido (me atraso con frecuencia o ya tengo varias deudas)\n\n"
-                    "No hay respuesta incorrecta, esto solo nos ayuda a calcular un número realista contigo."
-                )
-            except:
-                return (
-                    "Por favor, escribe solo el número de esa deuda (ejemplo: 5000). "
-                    "Si no tienes deudas de este tipo, escribe 0."
-                )
-
-        if contexto["esperando"] == "riesgo":
-            if texto_limpio not in ["1", "2", "3"]:
-                return "Por favor, elige la opción 1, 2 o 3 según cómo describirías tu forma de pagar."
-
-            contexto["riesgo"] = texto_limpio
-            porcentajes = {"1": Decimal("0.60"), "2": Decimal("0.45"), "3": Decimal("0.30")}
-            porcentaje_riesgo = porcentajes[texto_limpio]
-            ingreso = contexto["ingreso"]
-            pagos_fijos = contexto["pagos_fijos"]
-            deuda_revolvente = contexto["deuda_revolvente"]
-            pago_est_deuda_revolvente = deuda_revolvente * Decimal("0.06")
-
-            capacidad_total = ingreso * porcentaje_riesgo
-            capacidad_mensual = capacidad_total - pagos_fijos - pago_est_deuda_revolvente
-            capacidad_mensual = capacidad_mensual.quantize(Decimal("0.01"))
-
-            if capacidad_mensual <= 0:
-                faltante = -capacidad_mensual
-                estado_usuario[numero] = {}
-                return (
-                    f"📊 Con tus datos actuales, tus pagos fijos y el pago mínimo estimado de tus deudas "
-                    f"revolventes ya superan por ${faltante:,.2f} al mes lo que se considera manejable de "
-                    "tu ingreso. Esto no solo significa que por ahora no te recomendaría tomar un crédito "
-                    "nuevo, sino que es muy probable que tampoco te lo aprueben, porque tu capacidad de pago "
-                    "disponible ya está en números negativos.\n\n"
-                    "💡 Antes de solicitar un crédito nuevo, podría convenirte enfocarte primero en bajar "
-                    "tus deudas actuales. Dentro de *Crédito* tengo consejos para pagar sin ahogarte que "
-                    "te pueden servir.\n\n"
-                    "Escribe *menú* para volver al inicio."
-                )
-
-            contexto["capacidad_mensual"] = capacidad_mensual
-            contexto["porcentaje_riesgo"] = porcentaje_riesgo
-            contexto["esperando"] = "subopcion_prestamo"
-
-            return (
-                f"✅ Según tus datos, podrías pagar hasta ${capacidad_mensual:,.2f} al mes en un nuevo crédito.\n\n"
-                "¿Qué te gustaría hacer ahora?\n"
-                "1. Calcular el monto máximo de crédito que podrías solicitar\n"
-                "2. Validar si un crédito que te interesa podría ser aprobado\n"
-                "Escribe 1 o 2 para continuar."
-            )
-
-        if contexto["esperando"] == "subopcion_prestamo":
-            if texto_limpio == "1":
-                contexto["esperando"] = "tasa_anual_simular"
-                return (
-                    "📈 ¿Qué tasa de interés ANUAL manejan los créditos que te interesan?\n"
-                    "(ejemplo: si es 45% anual, escribe 45)"
-                )
-            elif texto_limpio == "2":
-                contexto["esperando"] = "monto_credito_deseado"
-                return "💰 ¿De cuánto sería el crédito que te interesa solicitar? (ejemplo: 150000)"
-            else:
-                return "Por favor, escribe 1 o 2."
-
-        if contexto["esperando"] == "tasa_anual_simular":
-            try:
-                contexto["tasa_anual_simular"] = Decimal(mensaje.replace(",", "").replace("%", ""))
-                contexto["esperando"] = "anios_simular"
-                return "📆 ¿A cuántos años quieres simular el crédito? (ejemplo: 3)"
-            except:
-                return "Por favor, indica la tasa anual como un número (ejemplo: 45)."
-
-        if contexto["esperando"] == "anios_simular":
-            try:
-                contexto["anios_simular"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "frecuencia_simular"
-                return MENSAJE_FRECUENCIA
-            except:
-                return "Por favor, indica los años como un número (ejemplo: 3)."
-
-        # submenú para el monto máximo
-        if contexto["esperando"] == "frecuencia_simular":
-            if texto_limpio == "5":
-                contexto["esperando"] = "frecuencia_otro_simular"
-                return "¿Cuántos pagos haces al año en total? (ejemplo: 24)"
-            if texto_limpio not in FRECUENCIAS_PAGO:
-                return "Por favor, elige una opción del 1 al 5."
-            try:
-                frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
-                return _resolver_frecuencia_monto_maximo(contexto, frecuencia_label, periodos_por_anio)
-            except Exception:
-                return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
-
-        if contexto["esperando"] == "frecuencia_otro_simular":
-            try:
-                periodos_por_anio = Decimal(mensaje.strip())
-                return _resolver_frecuencia_monto_maximo(contexto, "personalizada", periodos_por_anio)
-            except Exception:
-                return "Por favor, indica un número de pagos al año (ejemplo: 24)."
-
-        if contexto["esperando"] == "submenu_despues_de_maximo":
-            if texto_limpio == "1":
-                contexto["esperando"] = "monto_credito_deseado"
-                return "💰 ¿De cuánto sería el crédito que te interesa solicitar? (ejemplo: 150000)"
-            elif texto_limpio == "2":
-                estado_usuario.pop(numero)
-                return "Listo, escribe *menú* para ver más opciones."
-            else:
-                return "Por favor, escribe 1 o 2."
-
-        if contexto["esperando"] == "monto_credito_deseado":
-            try:
-                contexto["monto_deseado"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "tasa_anual_deseada"
-                return (
-                    "📈 ¿Cuál es la tasa de interés ANUAL de ese crédito?\n"
-                    "(ejemplo: si te dijeron 45% anual, escribe 45)"
-                )
-            except:
-                return "Por favor, indica el monto como un número (ejemplo: 150000)."
-
-        if contexto["esperando"] == "tasa_anual_deseada":
-            try:
-                contexto["tasa_anual_deseada"] = Decimal(mensaje.replace(",", "").replace("%", ""))
-                contexto["esperando"] = "anios_deseado"
-                return "📆 ¿En cuántos años planeas pagarlo?"
-            except:
-                return "Por favor, indica la tasa anual como un número (ejemplo: 45)."
-
-        if contexto["esperando"] == "anios_deseado":
-            try:
-                contexto["anios_deseado"] = Decimal(mensaje.replace(",", ""))
-                contexto["esperando"] = "frecuencia_deseada"
-                return MENSAJE_FRECUENCIA
-            except:
-                return "Por favor, indica los años como un número (ejemplo: 3)."
-
-        if contexto["esperando"] == "frecuencia_deseada":
-            if texto_limpio == "5":
-                contexto["esperando"] = "frecuencia_otro_deseada"
-                return "¿Cuántos pagos haces al año en total? (ejemplo: 24)"
-            if texto_limpio not in FRECUENCIAS_PAGO:
-                return "Por favor, elige una opción del 1 al 5."
-            try:
-                frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
-                resultado = _resolver_frecuencia_deseado(contexto, frecuencia_label, periodos_por_anio)
-                estado_usuario.pop(numero)
-                return resultado
-            except Exception:
-                return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
-
-        if contexto["esperando"] == "frecuencia_otro_deseada":
-            try:
-                periodos_por_anio = Decimal(mensaje.strip())
-            except Exception:
-                return "Por favor, indica un número de pagos al año (ejemplo: 24)."
-            try:
-                resultado = _resolver_frecuencia_deseado(contexto, "personalizada", periodos_por_anio)
-                estado_usuario.pop(numero)
-                return resultado
-            except Exception:
-                return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
-
-        # Submenú Buró
-        if contexto["esperando"] == "submenu_buro":
-            if texto_limpio in ["si", "sí"]:
-                estado_usuario.pop(numero)
-                return (
-                    "¿Cómo mejorar mi historial crediticio?\n"
-                    "Aquí tienes algunos consejos prácticos para mejorar tu score en Buró de Crédito y tener un historial más saludable 📈\n"
-                    "________________________________________\n"
-                    "🔹 1. Paga a tiempo, siempre\n"
-                    "📌 Aunque sea el pago mínimo, evita atrasarte.\n"
-                    "✅ La puntualidad pesa mucho en tu historial.\n"
-                    "________________________________________\n"
-                    "🔹 2. Usa tus tarjetas con moderación\n"
-                    "📌 Trata de no usar más del 30%-40% del límite de tu tarjeta.\n"
-                    "✅ Usarlas hasta el tope te resta puntos, aunque pagues.\n"
-                    "________________________________________\n"
-                    "🔹 3. No abras muchos créditos al mismo tiempo\n"
-                    "📌 Si pides varios préstamos en poco tiempo, parecerá que estás desesperado/a por dinero.\n"
-                    "✅ Ve uno a la vez y maneja bien el que tienes.\n"
-                    "________________________________________\n"
-                    "🔹 4. Usa algún crédito, aunque sea pequeño\n"
-                    "📌 Si no tienes historial, nunca tendrás score.\n"
-                    "✅ Una tarjeta departamental o un plan telefónico pueden ser un buen inicio si los manejas bien.\n"
-                    "________________________________________\n"
-                    "🔹 5. Revisa tu historial al menos una vez al año\n"
-                    "📌 Puedes pedir un reporte gratuito en www.burodecredito.com.mx\n"
-                    "✅ Asegúrate de que no haya errores y de que tus datos estén correctos.\n"
-                    "Escribe *menú*."
-                )
-            else:
-                estado_usuario.pop(numero)
-                return "Entiendo. Escribe *menú*."
+    # Cada opción del menú de arriba regresa de inmediato, así que si llegamos
+    # aquí el contexto y el paso actual siguen siendo los mismos.
+    if estado_actual is not None:
+        return _atender_paso(estado_actual, entrada, texto_limpio, numero, contexto)
 
     # Si nada coincide y no hay ninguna conversación activa con este número
     # (es la primera vez que escribe, o ya terminó una consulta anterior),
     # le damos la bienvenida sin importar qué haya escrito exactamente,
     # así no depende de que adivine la palabra "hola" para empezar.
     if numero not in estado_usuario:
-        estado_usuario[numero] = {}
+        estado_usuario[numero] = Sesion()
         return saludo_inicial
 
     # Si sí hay una conversación activa pero no reconocimos la respuesta:
@@ -2474,14 +3594,1493 @@ def _procesar_mensaje_interno(mensaje, numero):
         "respuesta sea del tipo que te pedí (por ejemplo, solo números si te pedí una cantidad)."
     )
 
+# =========================================
+# Pasos de cada subflujo (uno por valor de "esperando")
+# =========================================
+# --- Submenú: Ahorro ---
+@estado("menu_ahorro", entrada=ENTRADA_OPCION, critico=True, siguiente=("ahorro_meta",))
+def _estado_menu_ahorro(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["menu", "menú"]:
+        estado_usuario[numero] = Sesion()
+        return saludo_inicial
+    if texto_limpio in [
+        "1", "cuánto debo apartar para lograr mi meta de ahorro",
+        "cuanto debo apartar para lograr mi meta de ahorro",
+    ]:
+        contexto["esperando"] = "ahorro_meta"
+        return (
+            "🎯 Vamos a calcular cuánto necesitas apartar para lograr tu meta.\n\n"
+            "1️⃣ ¿Cuánto dinero quieres tener ahorrado en total? (por ejemplo: 15000)"
+        )
+    if texto_limpio in [
+        "2", "consejos para ahorrar sin sufrir en el intento",
+        "consejos para ahorrar",
+    ]:
+        return mensaje_ahorro_consejos
+    if texto_limpio in [
+        "3", "dónde puedo comparar cuentas de ahorro entre bancos",
+        "donde puedo comparar cuentas de ahorro entre bancos",
+        "comparar cuentas de ahorro",
+    ]:
+        return mensaje_ahorro_comparar_cuentas
+    return "Por favor, elige una opción válida del menú de Ahorro, o escribe *menú* para regresar al inicio."
+
+# --- Submenú: Inversión ---
+@estado(
+    "menu_inversion",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("inversion_monto_inicial",),
+)
+def _estado_menu_inversion(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["menu", "menú"]:
+        estado_usuario[numero] = Sesion()
+        return saludo_inicial
+    if texto_limpio in [
+        "1", "cuánto puede crecer mi dinero si invierto",
+        "cuanto puede crecer mi dinero si invierto",
+    ]:
+        contexto["esperando"] = "inversion_monto_inicial"
+        return (
+            "📈 Vamos a calcular cuánto puede crecer tu dinero.\n\n"
+            "1️⃣ ¿Con cuánto dinero vas a empezar a invertir? Si vas a empezar desde cero, "
+            "escribe 0. (por ejemplo: 5000)"
+        )
+    if texto_limpio in [
+        "2", "conceptos básicos antes de invertir",
+        "conceptos basicos antes de invertir",
+    ]:
+        return mensaje_inversion_conceptos_basicos
+    if texto_limpio in [
+        "3", "cetes y cetesdirecto: invertir con bajo riesgo",
+        "cetes y cetesdirecto", "cetes", "cetesdirecto",
+    ]:
+        return mensaje_inversion_cetes
+    if texto_limpio in [
+        "4", "cómo identificar fraudes de inversión",
+        "como identificar fraudes de inversión",
+        "como identificar fraudes de inversion",
+    ]:
+        return mensaje_inversion_fraudes
+    return "Por favor, elige una opción válida del menú de Inversión, o escribe *menú* para regresar al inicio."
+
+# --- Submenú: Jubilación ---
+@estado("menu_jubilacion", entrada=ENTRADA_OPCION, critico=True, siguiente=("jubilacion_meta",))
+def _estado_menu_jubilacion(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["menu", "menú"]:
+        estado_usuario[numero] = Sesion()
+        return saludo_inicial
+    if texto_limpio in [
+        "1", "cuánto debo ahorrar para mi retiro",
+        "cuanto debo ahorrar para mi retiro",
+    ]:
+        contexto["esperando"] = "jubilacion_meta"
+        return (
+            "🌅 Vamos a calcular cuánto necesitas ahorrar para tu retiro.\n\n"
+            "1️⃣ ¿Cuánto dinero te gustaría tener ahorrado para cuando te retires? (por ejemplo: 1500000)"
+        )
+    if texto_limpio in [
+        "2", "qué es una afore y cómo saber en cuál estoy",
+        "que es una afore y como saber en cual estoy",
+    ]:
+        return mensaje_jubilacion_afore
+    if texto_limpio in [
+        "3", "cómo se calcula mi pensión? ley 73 vs. ley 97",
+        "como se calcula mi pension ley 73 vs ley 97",
+        "ley 73", "ley 97", "ley 73 vs ley 97",
+    ]:
+        return mensaje_jubilacion_ley73_vs_ley97
+    if texto_limpio in [
+        "4", "aportaciones voluntarias: cómo aumentar tu ahorro para el retiro",
+        "aportaciones voluntarias",
+    ]:
+        return mensaje_jubilacion_aportaciones_voluntarias
+    if texto_limpio in [
+        "5", "qué pasa si cambio de trabajo o dejo de cotizar",
+        "que pasa si cambio de trabajo o dejo de cotizar",
+    ]:
+        return mensaje_jubilacion_cambio_trabajo
+    if texto_limpio in [
+        "6", "no he trabajado de forma formal ¿aún así puedo ahorrar para mi retiro",
+        "no he trabajado de forma formal, ¿aún así puedo ahorrar para mi retiro?",
+        "no he trabajado de forma formal aun asi puedo ahorrar para mi retiro",
+        "trabajador independiente",
+    ]:
+        return mensaje_jubilacion_independiente
+    return "Por favor, elige una opción válida del menú de Jubilación, o escribe *menú* para regresar al inicio."
+
+# --- Submenú: Evalúa tu salud financiera ---
+@estado("menu_salud", entrada=ENTRADA_OPCION, critico=True, siguiente=("salud_pregunta",))
+def _estado_menu_salud(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["menu", "menú"]:
+        estado_usuario[numero] = Sesion()
+        return saludo_inicial
+    mapa_opciones = {
+        "1": ["resiliencia"],
+        "2": ["libertad"],
+        "3": ["seguridad"],
+        "4": ["control"],
+        "5": ORDEN_DIMENSIONES_SALUD,
+    }
+    dimensiones_elegidas = mapa_opciones.get(texto_limpio)
+    if dimensiones_elegidas is None:
+        return "Por favor, elige una opción del 1 al 5, o escribe *menú* para regresar al inicio."
+    estado_usuario[numero] = Sesion(
+        "salud_pregunta",
+        salud_dimensiones=dimensiones_elegidas,
+        salud_dim_idx=0,
+        salud_preg_idx=0,
+        salud_puntajes={},
+    )
+    primera_dim = DIMENSIONES_SALUD[dimensiones_elegidas[0]]
+    return (
+        "Vamos a empezar. Responde con la mayor honestidad posible; no hay respuestas correctas o "
+        "incorrectas, solo te ayudan a entender mejor tu situación 🙂\n\n"
+        + _formatear_pregunta_salud(primera_dim, 0, primera=True)
+    )
+
+# --- Evalúa tu salud financiera: flujo de preguntas ---
+@estado("salud_pregunta", entrada=ENTRADA_OPCION, critico=True, siguiente=("menu_salud",))
+def _estado_salud_pregunta(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["menu", "menú"]:
+        estado_usuario[numero] = Sesion()
+        return saludo_inicial
+    if texto_limpio not in ["1", "2", "3", "4", "5"]:
+        return "Por favor responde con un número del 1 (completamente en desacuerdo) al 5 (completamente de acuerdo)."
+
+    valor = int(texto_limpio)
+    dim_key = contexto["salud_dimensiones"][contexto["salud_dim_idx"]]
+    contexto["salud_puntajes"][dim_key] = contexto["salud_puntajes"].get(dim_key, 0) + valor
+    contexto["salud_preg_idx"] += 1
+
+    resultado_texto = ""
+    dim_actual = DIMENSIONES_SALUD[dim_key]
+    if contexto["salud_preg_idx"] >= len(dim_actual["preguntas"]):
+        # Se completó esta dimensión: calculamos y mostramos su resultado.
+        resultado_texto = _resultado_dimension_salud(dim_key, contexto["salud_puntajes"][dim_key]) + "\n\n"
+        contexto["salud_dim_idx"] += 1
+        contexto["salud_preg_idx"] = 0
+
+        if contexto["salud_dim_idx"] >= len(contexto["salud_dimensiones"]):
+            # No quedan más dimensiones por evaluar: terminamos aquí.
+            estado_usuario[numero] = Sesion("menu_salud")
+            return resultado_texto + mensaje_salud_cierre
+
+    siguiente_dim_key = contexto["salud_dimensiones"][contexto["salud_dim_idx"]]
+    siguiente_dim = DIMENSIONES_SALUD[siguiente_dim_key]
+    idx = contexto["salud_preg_idx"]
+    pregunta_texto = _formatear_pregunta_salud(siguiente_dim, idx, primera=(idx == 0))
+    return resultado_texto + pregunta_texto
+
+# --- Submenú: Género y finanzas ---
+@estado("menu_genero", entrada=ENTRADA_OPCION, critico=True)
+def _estado_menu_genero(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["menu", "menú"]:
+        estado_usuario[numero] = Sesion()
+        return saludo_inicial
+    if texto_limpio in [
+        "1", "la brecha de género en el ahorro para el retiro",
+        "la brecha de genero en el ahorro para el retiro",
+    ]:
+        return mensaje_genero_brecha_retiro
+    if texto_limpio in [
+        "2", "qué es la violencia económica y patrimonial",
+        "que es la violencia economica y patrimonial",
+    ]:
+        return mensaje_genero_violencia_economica
+    return "Por favor, elige una opción válida de esta sección, o escribe *menú* para regresar al inicio."
+
+# --- Submenú: Crédito ---
+@estado(
+    "menu_credito",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("monto_credito", "monto2", "precio_contado", "ingreso", "submenu_buro"),
+)
+def _estado_menu_credito(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["menu", "menú"]:
+        estado_usuario[numero] = Sesion()
+        return saludo_inicial
+    if texto_limpio == "1":
+        estado_usuario[numero] = Sesion("monto_credito")
+        return "Perfecto. Para comenzar, dime el monto del crédito que deseas simular."
+    if texto_limpio == "2":
+        estado_usuario[numero] = Sesion("monto2")
+        return "Para estimar tu ahorro con pagos extra, primero dime el Monto del crédito."
+    if texto_limpio == "3":
+        estado_usuario[numero] = Sesion("precio_contado")
+        return (
+            "Vamos a calcular el costo real de una compra a pagos fijos.\n"
+            "Por favor dime lo siguiente:\n\n"
+            "1️⃣ ¿Cuál es el precio de contado del producto? (ejemplo: 1800)"
+        )
+    if texto_limpio == "4":
+        estado_usuario[numero] = Sesion("ingreso")
+        return (
+            "Vamos a calcular cuánto podrías solicitar como crédito, según tu capacidad de pago.\n\n"
+            "Primero necesito saber:\n"
+            "1️⃣ ¿Cuál es tu ingreso mensual neto? Es decir, lo que realmente recibes después de "
+            "impuestos: lo que te depositan o te dan en efectivo. (ejemplo: 15000)"
+        )
+    if texto_limpio == "8":
+        contexto["esperando"] = "submenu_buro"
+        return (
+            "El Buró de Crédito no es un enemigo, es solo un registro de cómo has manejado tus créditos. Y sí, puede ayudarte o perjudicarte según tu comportamiento.\n"
+            "________________________________________\n"
+            "📊 ¿Qué es el Buró de Crédito?\n"
+            "Es una empresa que guarda tu historial de pagos.\n"
+            "📌 Si pagas bien, tu historial será positivo.\n"
+            "📌 Si te atrasas, se reflejará ahí.\n"
+            "________________________________________\n"
+            "💡 Tener historial no es malo.\n"
+            "De hecho, si nunca has pedido un crédito, no aparecerás en Buró y eso puede dificultar que te aprueben uno.\n"
+            "________________________________________\n"
+            "📈 Tu comportamiento crea un “score” o puntaje.\n"
+            "• Pagar a tiempo te ayuda\n"
+            "• Deber mucho o atrasarte te baja el score\n"
+            "• Tener muchas tarjetas al tope también afecta\n"
+            "________________________________________\n"
+            "❗ Cuidado con estas ideas falsas:\n"
+            "• “Estoy en Buró” no siempre es malo\n"
+            "• No es una lista negra\n"
+            "• No te borran tan fácil (los registros duran años)\n"
+            "________________________________________\n"
+            "¿Te gustaría saber cómo mejorar tu historial crediticio o qué pasos tomar para subir tu puntaje?\n"
+            "Responde *sí* o *no*."
+        )
+    if texto_limpio == "5":
+        return (
+            "🟡 Consejos para pagar un crédito sin ahogarte\n"
+            "Pagar un crédito no tiene que sentirse como una carga eterna. Aquí van algunos consejos sencillos para ayudarte a pagar con más tranquilidad y menos estrés:\n"
+            "________________________________________\n"
+            "✅ 1. Haz pagos anticipados cuando puedas\n"
+            "📌 Aunque no sea obligatorio, abonar un poco más al capital te ahorra intereses y reduce el plazo.\n"
+            "💡 Incluso $200 o $500 adicionales hacen una gran diferencia con el tiempo.\n"
+            "________________________________________\n"
+            "✅ 2. Programa tus pagos en automático\n"
+            "📌 Evitas atrasos, recargos y estrés.\n"
+            "💡 Si no tienes domiciliación, pon recordatorios para no fallar.\n"
+            "________________________________________\n"
+            "✅ 3. Revisa si puedes cambiar tu crédito por uno mejor\n"
+            "📌 A esto se le llama “reestructura” o “portabilidad”.\n"
+            "💡 Si tu historial ha mejorado, podrías conseguir mejores condiciones.\n"
+            "________________________________________\n"
+            "✅ 4. Haz un presupuesto mensual\n"
+            "📌 Saber cuánto entra y cuánto sale te ayuda a organizar tus pagos sin descuidar otras necesidades.\n"
+            "💡 Apóyate en apps, papel o Excel, lo que te funcione.\n"
+            "________________________________________\n"
+            "✅ 5. Prioriza las deudas más caras\n"
+            "📌 Si tienes varias, enfócate primero en las que tienen interés más alto, como tarjetas de crédito.\n"
+            "________________________________________\n"
+        ) + "\n" + mensaje_submenu_credito
+    if texto_limpio == "6":
+        return (
+            "Muchas veces un crédito parece accesible… hasta que ves lo que terminas pagando. Aquí te doy algunas claves para detectar si un crédito es caro:\n\n"
+            "🔍 1. CAT (Costo Anual Total)\n"
+            "Es una medida que incluye la tasa de interés, comisiones y otros cargos.\n"
+            "📌 Entre más alto el CAT, más caro te saldrá el crédito.\n"
+            "💡 Compara el CAT entre diferentes instituciones, no solo la tasa.\n\n"
+            "🔍 2. Comisiones escondidas\n"
+            "Algunos créditos cobran por apertura, por manejo, por pagos tardíos o por pagos anticipados 😵\n"
+            "📌 Lee siempre el contrato antes de firmar.\n\n"
+            "🔍 3. Tasa de interés variable\n"
+            "📌 Algunos créditos no tienen tasa fija, sino que pueden subir.\n"
+            "💡 Revisa si tu tasa es fija o variable. Las variables pueden volverse muy caras si sube la inflación.\n\n"
+            "🔍 4. Pago mensual bajo con plazo largo\n"
+            "Parece atractivo, pero terminas pagando muchísimo más en intereses.\n\n"
+            "❗ Si el crédito parece demasiado fácil o rápido, pero no entiendes bien cuánto vas a pagar en total... ¡es una señal de alerta!\n\n"
+        ) + "\n" + mensaje_submenu_credito
+    if texto_limpio == "7":
+        return (
+            "Solicitar un crédito es una gran responsabilidad. Aquí te comparto algunos errores comunes que muchas personas cometen… ¡y cómo evitarlos!\n"
+            "________________________________________\n"
+            "❌ 1. No saber cuánto terminarás pagando en total\n"
+            "Muchas personas solo se fijan en el pago mensual y no en el costo total del crédito.\n"
+            "✅ Usa simuladores (como el que tengo 😎) para saber cuánto pagarás realmente.\n"
+            "________________________________________\n"
+            "❌ 2. Pedir más dinero del que realmente necesitas\n"
+            "📌 Entre más pidas, más intereses pagas.\n"
+            "✅ Pide solo lo necesario y asegúrate de poder pagarlo.\n"
+            "________________________________________\n"
+            "❌ 3. Aceptar el primer crédito que te ofrecen\n"
+            "📌 Hay diferencias enormes entre una institución y otra.\n"
+            "✅ Compara tasas, comisiones y condiciones antes de decidir.\n"
+            "________________________________________\n"
+            "❌ 4. No leer el contrato completo\n"
+            "Sí, puede ser largo, pero ahí están los detalles importantes:\n"
+            "📌 ¿Hay comisiones por pagar antes de tiempo?\n"
+            "📌 ¿Qué pasa si te atrasas?\n"
+            "✅ Lee con calma o pide que te lo expliquen.\n"
+            "________________________________________\n"
+            "❌ 5. Usar un crédito sin un plan de pago\n"
+            "📌 Si no sabes cómo lo vas a pagar, puedes meterte en problemas.\n"
+            "✅ Haz un presupuesto antes de aceptar cualquier crédito.\n\n"
+        ) + "\n" + mensaje_submenu_credito
+    if texto_limpio == "9":
+        return mensaje_credito_derechos_cobranza
+    return "Por favor, elige un número del 1 al 9 del menú de Crédito, o escribe *menú* para regresar al inicio."
+
+# --- Ahorro: flujo de meta de ahorro ---
+@estado("ahorro_meta", entrada=ENTRADA_MONTO, critico=True, siguiente=("ahorro_inicial",))
+def _estado_ahorro_meta(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica tu meta de ahorro como un número (ejemplo: 15000)."
+    contexto["ahorro_meta"] = lectura.valor
+    if contexto["ahorro_meta"] <= 0:
+        return "La meta debe ser mayor a cero. ¿Cuánto dinero quieres tener ahorrado en total? (ejemplo: 15000)"
+    contexto["esperando"] = "ahorro_inicial"
+    return "2️⃣ ¿Ya tienes algo ahorrado hoy para esta meta? Si no tienes nada todavía, escribe 0. (por ejemplo: 2000)"
+
+@estado("ahorro_inicial", entrada=ENTRADA_MONTO, critico=True, siguiente=("ahorro_tiempo_numero",))
+def _estado_ahorro_inicial(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, escribe solo un número (ejemplo: 2000, o 0 si no tienes nada ahorrado todavía)."
+    contexto["ahorro_inicial"] = lectura.valor
+    if contexto["ahorro_inicial"] < 0:
+        return "Ese número no puede ser negativo 🙂 Si no tienes nada ahorrado todavía, escribe 0."
+    contexto["esperando"] = "ahorro_tiempo_numero"
+    return "3️⃣ ¿En cuánto tiempo quieres lograrlo? Escribe solo el número (por ejemplo: 6)"
+
+@estado(
+    "ahorro_tiempo_numero",
+    entrada=ENTRADA_PLAZO,
+    critico=True,
+    siguiente=("ahorro_tiempo_unidad", "ahorro_frecuencia"),
+)
+def _estado_ahorro_tiempo_numero(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica el tiempo como un número (ejemplo: 6)."
+    tiempo_numero = lectura.valor
+    if tiempo_numero <= 0:
+        return "El tiempo debe ser mayor a cero. ¿En cuánto tiempo quieres lograrlo? (ejemplo: 6)"
+    contexto["ahorro_tiempo_numero"] = tiempo_numero
+    if lectura.unidad is not None:
+        # Con "6 meses" o "2 años" ya sabemos la unidad: no hace falta preguntarla
+        opcion = "1" if lectura.unidad == UNIDAD_MESES else "2"
+        return _estado_ahorro_tiempo_unidad(None, opcion, numero, contexto)
+    contexto["esperando"] = "ahorro_tiempo_unidad"
+    return (
+        "¿Ese número que diste fue en meses o en años?\n"
+        "1️⃣ Meses\n"
+        "2️⃣ Años"
+    )
+
+@estado(
+    "ahorro_tiempo_unidad",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("ahorro_frecuencia",),
+)
+def _estado_ahorro_tiempo_unidad(entrada, texto_limpio, numero, contexto):
+    if texto_limpio not in ["1", "2", "meses", "años", "anos", "año", "ano"]:
+        return "Por favor, elige 1 (Meses) o 2 (Años)."
+    if texto_limpio in ["1", "meses"]:
+        meses_totales = contexto["ahorro_tiempo_numero"]
+    else:
+        meses_totales = contexto["ahorro_tiempo_numero"] * Decimal("12")
+    contexto["ahorro_meses_totales"] = meses_totales
+    contexto["esperando"] = "ahorro_frecuencia"
+    return MENSAJE_FRECUENCIA_AHORRO
+
+@estado(
+    "ahorro_frecuencia",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("ahorro_frecuencia_otro",),
+)
+def _estado_ahorro_frecuencia(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "5":
+        contexto["esperando"] = "ahorro_frecuencia_otro"
+        return "¿Cuántas veces al año en total apartarías dinero? (ejemplo: 24)"
+    if texto_limpio not in FRECUENCIAS_PAGO:
+        return "Por favor, elige una opción del 1 al 5."
+    try:
+        frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
+        resultado = calcular_ahorro_periodico(
+            contexto["ahorro_meta"],
+            contexto["ahorro_inicial"],
+            contexto["ahorro_meses_totales"],
+            periodos_por_anio,
+            frecuencia_label,
+        )
+        estado_usuario.pop(numero, None)
+        return resultado
+    except Exception:
+        return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
+
+@estado("ahorro_frecuencia_otro", entrada=ENTRADA_PERIODOS, critico=True)
+def _estado_ahorro_frecuencia_otro(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica un número de veces al año (ejemplo: 24)."
+    try:
+        periodos_por_anio = lectura.valor
+        if periodos_por_anio <= 0:
+            return "El número de veces al año debe ser mayor a cero (ejemplo: 24)."
+        resultado = calcular_ahorro_periodico(
+            contexto["ahorro_meta"],
+            contexto["ahorro_inicial"],
+            contexto["ahorro_meses_totales"],
+            periodos_por_anio,
+            "personalizada",
+        )
+        estado_usuario.pop(numero, None)
+        return resultado
+    except Exception:
+        return "Por favor, indica un número de veces al año (ejemplo: 24)."
+
+# --- Inversión: flujo de crecimiento de una inversión ---
+@estado(
+    "inversion_monto_inicial",
+    entrada=ENTRADA_MONTO,
+    critico=True,
+    siguiente=("inversion_aportacion",),
+)
+def _estado_inversion_monto_inicial(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica el monto inicial como un número (ejemplo: 5000, o 0 si vas a empezar desde cero)."
+    monto_inicial = lectura.valor
+    if monto_inicial < 0:
+        return "Ese número no puede ser negativo 🙂 Si vas a empezar desde cero, escribe 0."
+    contexto["inversion_monto_inicial"] = monto_inicial
+    contexto["esperando"] = "inversion_aportacion"
+    return (
+        "2️⃣ ¿Cuánto planeas aportar en cada periodo? Si solo vas a invertir el monto "
+        "inicial y nada más, escribe 0. (por ejemplo: 500)"
+    )
+
+@estado(
+    "inversion_aportacion",
+    entrada=ENTRADA_MONTO,
+    critico=True,
+    siguiente=("inversion_monto_inicial", "inversion_tasa_anual"),
+)
+def _estado_inversion_aportacion(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica la aportación por periodo como un número (ejemplo: 500, o 0 si no vas a aportar más)."
+    aportacion = lectura.valor
+    if aportacion < 0:
+        return "Ese número no puede ser negativo 🙂 Si no vas a aportar más, escribe 0."
+    if contexto["inversion_monto_inicial"] == 0 and aportacion == 0:
+        contexto["esperando"] = "inversion_monto_inicial"
+        return (
+            "Para calcular el crecimiento necesito que aportes algo, ya sea al inicio o en "
+            "cada periodo 🙂 Empecemos de nuevo:\n\n"
+            "1️⃣ ¿Con cuánto dinero vas a empezar a invertir? Si vas a empezar desde cero, "
+            "escribe 0. (por ejemplo: 5000)"
+        )
+    contexto["inversion_aportacion"] = aportacion
+    contexto["esperando"] = "inversion_tasa_anual"
+    return "3️⃣ ¿Qué tasa de rendimiento ANUAL esperas obtener? (por ejemplo, si esperas un 10% anual, escribe 10)"
+
+@estado(
+    "inversion_tasa_anual",
+    entrada=ENTRADA_TASA,
+    critico=True,
+    siguiente=("inversion_tiempo_numero",),
+)
+def _estado_inversion_tasa_anual(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica la tasa de rendimiento anual como un número (ejemplo: 10)."
+    tasa_anual = lectura.valor
+    if tasa_anual < 0:
+        return "La tasa esperada no puede ser negativa para este cálculo 🙂 Indica un número positivo (ejemplo: 10)."
+    contexto["inversion_tasa_anual"] = tasa_anual
+    contexto["esperando"] = "inversion_tiempo_numero"
+    return "4️⃣ ¿En cuánto tiempo? Escribe solo el número (por ejemplo: 5)"
+
+@estado(
+    "inversion_tiempo_numero",
+    entrada=ENTRADA_PLAZO,
+    critico=True,
+    siguiente=("inversion_tiempo_unidad", "inversion_frecuencia"),
+)
+def _estado_inversion_tiempo_numero(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica el tiempo como un número (ejemplo: 5)."
+    tiempo_numero = lectura.valor
+    if tiempo_numero <= 0:
+        return "El tiempo debe ser mayor a cero. ¿En cuánto tiempo? (ejemplo: 5)"
+    contexto["inversion_tiempo_numero"] = tiempo_numero
+    if lectura.unidad is not None:
+        # Con "6 meses" o "2 años" ya sabemos la unidad: no hace falta preguntarla
+        opcion = "1" if lectura.unidad == UNIDAD_MESES else "2"
+        return _estado_inversion_tiempo_unidad(None, opcion, numero, contexto)
+    contexto["esperando"] = "inversion_tiempo_unidad"
+    return (
+        "¿Ese número que diste fue en meses o en años?\n"
+        "1️⃣ Meses\n"
+        "2️⃣ Años"
+    )
+
+@estado(
+    "inversion_tiempo_unidad",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("inversion_frecuencia",),
+)
+def _estado_inversion_tiempo_unidad(entrada, texto_limpio, numero, contexto):
+    if texto_limpio not in ["1", "2", "meses", "años", "anos", "año", "ano"]:
+        return "Por favor, elige 1 (Meses) o 2 (Años)."
+    if texto_limpio in ["1", "meses"]:
+        anios = contexto["inversion_tiempo_numero"] / Decimal("12")
+    else:
+        anios = contexto["inversion_tiempo_numero"]
+    contexto["inversion_anios"] = anios
+    contexto["esperando"] = "inversion_frecuencia"
+    return MENSAJE_FRECUENCIA_INVERSION
+
+@estado(
+    "inversion_frecuencia",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("inversion_frecuencia_otro",),
+)
+def _estado_inversion_frecuencia(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "5":
+        contexto["esperando"] = "inversion_frecuencia_otro"
+        return "¿Cuántas veces al año en total aportarías? (ejemplo: 24)"
+    if texto_limpio not in FRECUENCIAS_PAGO:
+        return "Por favor, elige una opción del 1 al 5."
+    try:
+        frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
+        resultado = calcular_crecimiento_inversion(
+            contexto["inversion_monto_inicial"],
+            contexto["inversion_aportacion"],
+            contexto["inversion_anios"],
+            contexto["inversion_tasa_anual"],
+            periodos_por_anio,
+            frecuencia_label,
+        )
+        estado_usuario.pop(numero, None)
+        return resultado
+    except Exception:
+        return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
+
+@estado("inversion_frecuencia_otro", entrada=ENTRADA_PERIODOS, critico=True)
+def _estado_inversion_frecuencia_otro(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica un número de veces al año (ejemplo: 24)."
+    try:
+        periodos_por_anio = lectura.valor
+        if periodos_por_anio <= 0:
+            return "El número de veces al año debe ser mayor a cero (ejemplo: 24)."
+        resultado = calcular_crecimiento_inversion(
+            contexto["inversion_monto_inicial"],
+            contexto["inversion_aportacion"],
+            contexto["inversion_anios"],
+            contexto["inversion_tasa_anual"],
+            periodos_por_anio,
+            "personalizada",
+        )
+        estado_usuario.pop(numero, None)
+        return resultado
+    except Exception:
+        return "Por favor, indica un número de veces al año (ejemplo: 24)."
+
+# --- Jubilación: flujo de meta de ahorro para el retiro ---
+@estado(
+    "jubilacion_meta",
+    entrada=ENTRADA_MONTO,
+    critico=True,
+    siguiente=("jubilacion_ahorro_actual",),
+)
+def _estado_jubilacion_meta(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica tu meta como un número (ejemplo: 1500000)."
+    contexto["jubilacion_meta"] = lectura.valor
+    if contexto["jubilacion_meta"] <= 0:
+        return "La meta debe ser mayor a cero. ¿Cuánto dinero te gustaría tener ahorrado para tu retiro? (ejemplo: 1500000)"
+    contexto["esperando"] = "jubilacion_ahorro_actual"
+    return "2️⃣ ¿Ya tienes algo ahorrado hoy pensando en tu retiro? Si no tienes nada todavía, escribe 0. (por ejemplo: 50000)"
+
+@estado(
+    "jubilacion_ahorro_actual",
+    entrada=ENTRADA_MONTO,
+    critico=True,
+    siguiente=("jubilacion_tasa_anual",),
+)
+def _estado_jubilacion_ahorro_actual(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, escribe solo un número (ejemplo: 50000, o 0 si no tienes nada ahorrado todavía)."
+    contexto["jubilacion_ahorro_actual"] = lectura.valor
+    if contexto["jubilacion_ahorro_actual"] < 0:
+        return "Ese número no puede ser negativo 🙂 Si no tienes nada ahorrado todavía, escribe 0."
+    contexto["esperando"] = "jubilacion_tasa_anual"
+    return "3️⃣ ¿Qué tasa de rendimiento ANUAL esperas obtener sobre ese ahorro? (por ejemplo, si esperas un 8% anual, escribe 8)"
+
+@estado(
+    "jubilacion_tasa_anual",
+    entrada=ENTRADA_TASA,
+    critico=True,
+    siguiente=("jubilacion_tiempo_numero",),
+)
+def _estado_jubilacion_tasa_anual(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica la tasa de rendimiento anual como un número (ejemplo: 8)."
+    tasa_anual = lectura.valor
+    if tasa_anual < 0:
+        return "La tasa esperada no puede ser negativa para este cálculo 🙂 Indica un número positivo (ejemplo: 8)."
+    contexto["jubilacion_tasa_anual"] = tasa_anual
+    contexto["esperando"] = "jubilacion_tiempo_numero"
+    return "4️⃣ ¿En cuánto tiempo te quieres retirar? Escribe solo el número (por ejemplo: 25)"
+
+@estado(
+    "jubilacion_tiempo_numero",
+    entrada=ENTRADA_PLAZO,
+    critico=True,
+    siguiente=("jubilacion_tiempo_unidad", "jubilacion_frecuencia"),
+)
+def _estado_jubilacion_tiempo_numero(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica el tiempo como un número (ejemplo: 25)."
+    tiempo_numero = lectura.valor
+    if tiempo_numero <= 0:
+        return "El tiempo debe ser mayor a cero. ¿En cuánto tiempo te quieres retirar? (ejemplo: 25)"
+    contexto["jubilacion_tiempo_numero"] = tiempo_numero
+    if lectura.unidad is not None:
+        # Con "6 meses" o "2 años" ya sabemos la unidad: no hace falta preguntarla
+        opcion = "1" if lectura.unidad == UNIDAD_MESES else "2"
+        return _estado_jubilacion_tiempo_unidad(None, opcion, numero, contexto)
+    contexto["esperando"] = "jubilacion_tiempo_unidad"
+    return (
+        "¿Ese número que diste fue en meses o en años?\n"
+        "1️⃣ Meses\n"
+        "2️⃣ Años"
+    )
+
+@estado(
+    "jubilacion_tiempo_unidad",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("jubilacion_frecuencia",),
+)
+def _estado_jubilacion_tiempo_unidad(entrada, texto_limpio, numero, contexto):
+    if texto_limpio not in ["1", "2", "meses", "años", "anos", "año", "ano"]:
+        return "Por favor, elige 1 (Meses) o 2 (Años)."
+    if texto_limpio in ["1", "meses"]:
+        anios = contexto["jubilacion_tiempo_numero"] / Decimal("12")
+    else:
+        anios = contexto["jubilacion_tiempo_numero"]
+    contexto["jubilacion_anios"] = anios
+    contexto["esperando"] = "jubilacion_frecuencia"
+    return MENSAJE_FRECUENCIA_JUBILACION
+
+@estado(
+    "jubilacion_frecuencia",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("jubilacion_frecuencia_otro",),
+)
+def _estado_jubilacion_frecuencia(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "5":
+        contexto["esperando"] = "jubilacion_frecuencia_otro"
+        return "¿Cuántas veces al año en total ahorrarías para tu retiro? (ejemplo: 24)"
+    if texto_limpio not in FRECUENCIAS_PAGO:
+        return "Por favor, elige una opción del 1 al 5."
+    try:
+        frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
+        resultado = calcular_ahorro_jubilacion(
+            contexto["jubilacion_meta"],
+            contexto["jubilacion_ahorro_actual"],
+            contexto["jubilacion_anios"],
+            contexto["jubilacion_tasa_anual"],
+            periodos_por_anio,
+            frecuencia_label,
+        )
+        estado_usuario.pop(numero, None)
+        return resultado
+    except Exception:
+        return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
+
+@estado("jubilacion_frecuencia_otro", entrada=ENTRADA_PERIODOS, critico=True)
+def _estado_jubilacion_frecuencia_otro(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica un número de veces al año (ejemplo: 24)."
+    try:
+        periodos_por_anio = lectura.valor
+        if periodos_por_anio <= 0:
+            return "El número de veces al año debe ser mayor a cero (ejemplo: 24)."
+        resultado = calcular_ahorro_jubilacion(
+            contexto["jubilacion_meta"],
+            contexto["jubilacion_ahorro_actual"],
+            contexto["jubilacion_anios"],
+            contexto["jubilacion_tasa_anual"],
+            periodos_por_anio,
+            "personalizada",
+        )
+        estado_usuario.pop(numero, None)
+        return resultado
+    except Exception:
+        return "Por favor, indica un número de veces al año (ejemplo: 24)."
+
+# FLUJO 2: abonos extra directos
+@estado("monto2", entrada=ENTRADA_MONTO, critico=False, siguiente=("tasa_anual2",))
+def _estado_monto2(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica el monto del crédito como un número."
+    contexto["monto"] = lectura.valor
+    contexto["esperando"] = "tasa_anual2"
+    return (
+        "¿Cuál es la tasa de interés ANUAL que te ofrecieron?\n"
+        "Es la que normalmente te dicen en el banco o la tienda (ejemplo: si te "
+        "dijeron 45% anual, solo escribe 45)."
+    )
+
+@estado("tasa_anual2", entrada=ENTRADA_TASA, critico=True, siguiente=("anios2",))
+def _estado_tasa_anual2(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica la tasa anual como un número (ejemplo: 45)."
+    contexto["tasa_anual"] = lectura.valor
+    contexto["esperando"] = "anios2"
+    return "¿A cuántos años es el crédito? (puedes usar decimales, ejemplo: 2.5)"
+
+@estado("anios2", entrada=ENTRADA_PLAZO, critico=True, siguiente=("frecuencia2",))
+def _estado_anios2(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica los años como un número (ejemplo: 2.5)."
+    contexto["anios"] = lectura.valor
+    if lectura.unidad == UNIDAD_MESES:
+        contexto["anios"] = lectura.valor / 12
+    contexto["esperando"] = "frecuencia2"
+    return MENSAJE_FRECUENCIA
+
+@estado(
+    "frecuencia2",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("frecuencia_otro2", "abono_extra2"),
+)
+def _estado_frecuencia2(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "5":
+        contexto["esperando"] = "frecuencia_otro2"
+        return "¿Cuántos pagos haces al año en total? (ejemplo: 24)"
+    if texto_limpio not in FRECUENCIAS_PAGO:
+        return "Por favor, elige una opción del 1 al 5."
+    try:
+        frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
+        return _resolver_frecuencia_flujo2(contexto, frecuencia_label, periodos_por_anio)
+    except Exception:
+        return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
+
+@estado("frecuencia_otro2", entrada=ENTRADA_PERIODOS, critico=True, siguiente=("abono_extra2",))
+def _estado_frecuencia_otro2(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica un número de pagos al año (ejemplo: 24)."
+    try:
+        periodos_por_anio = lectura.valor
+        return _resolver_frecuencia_flujo2(contexto, "personalizada", periodos_por_anio)
+    except Exception:
+        return "Por favor, indica un número de pagos al año (ejemplo: 24)."
+
+@estado("abono_extra2", entrada=ENTRADA_MONTO, critico=True, siguiente=("desde2",))
+def _estado_abono_extra2(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, escribe solo la cantidad del abono extra (ejemplo: 500)"
+    contexto["abono"] = lectura.valor
+    contexto["esperando"] = "desde2"
+    return "¿A partir de qué periodo comenzarás a abonar esa cantidad extra? (Ejemplo: 4)"
+
+@estado("desde2", entrada=ENTRADA_ENTERO, critico=True)
+def _estado_desde2(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
+    try:
+        desde = lectura.valor
+        contexto["desde"] = desde
+        total_sin, total_con, ahorro, pagos_menos = calcular_ahorro_por_abonos(
+            contexto["monto"], contexto["tasa"],
+            contexto["plazo"], contexto["abono"], desde
+        )
+        estado_usuario.pop(numero)
+        return (
+            f"💸 Si pagaras este crédito sin hacer abonos extra, terminarías pagando ${float(total_sin):,.2f} en total.\n"
+            f"Pero si decides abonar ${float(contexto['abono']):,.2f} adicionales por periodo desde el periodo {desde}...\n"
+            f"✅ Terminarías de pagar en menos tiempo (¡te ahorras {pagos_menos} pagos!)\n"
+            f"💰 Pagarías ${float(total_con):,.2f} en total\n"
+            f"🧮 Y te ahorrarías ${float(ahorro):,.2f} solo en intereses.\n\n"
+            f"{mensaje_tabla_amortizacion(contexto)}"
+            "Escribe *menú* para volver al inicio."
+        )
+    except:
+        return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
+
+# FLUJO 1: Simular crédito
+@estado(
+    "monto_credito",
+    entrada=ENTRADA_MONTO,
+    critico=False,
+    siguiente=("tasa_anual_credito", "anios_credito", "frecuencia_credito", "ver_si_abonos1"),
+)
+def _estado_monto_credito(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica el monto como un número (ejemplo: 100000)"
+    contexto["monto"] = lectura.valor
+    return _continuar_credito(contexto)
+
+@estado(
+    "tasa_anual_credito",
+    entrada=ENTRADA_TASA,
+    critico=True,
+    siguiente=("anios_credito", "frecuencia_credito", "ver_si_abonos1"),
+)
+def _estado_tasa_anual_credito(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica la tasa anual como un número (ejemplo: 45)."
+    contexto["tasa_anual"] = lectura.valor
+    return _continuar_credito(contexto)
+
+@estado("anios_credito", entrada=ENTRADA_PLAZO, critico=True, siguiente=("frecuencia_credito", "ver_si_abonos1"))
+def _estado_anios_credito(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica los años como un número (ejemplo: 2.5)."
+    contexto["anios"] = lectura.valor
+    if lectura.unidad == UNIDAD_MESES:
+        contexto["anios"] = lectura.valor / 12
+    return _continuar_credito(contexto)
+
+@estado(
+    "frecuencia_credito",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("frecuencia_otro_credito", "ver_si_abonos1"),
+)
+def _estado_frecuencia_credito(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "5":
+        contexto["esperando"] = "frecuencia_otro_credito"
+        return "¿Cuántos pagos haces al año en total? (ejemplo: 24)"
+    if texto_limpio not in FRECUENCIAS_PAGO:
+        return "Por favor, elige una opción del 1 al 5."
+    try:
+        frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
+        return _resolver_frecuencia_flujo1(contexto, frecuencia_label, periodos_por_anio)
+    except Exception:
+        return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
+
+@estado(
+    "frecuencia_otro_credito",
+    entrada=ENTRADA_PERIODOS,
+    critico=True,
+    siguiente=("ver_si_abonos1",),
+)
+def _estado_frecuencia_otro_credito(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica un número de pagos al año (ejemplo: 24)."
+    try:
+        periodos_por_anio = lectura.valor
+        return _resolver_frecuencia_flujo1(contexto, "personalizada", periodos_por_anio)
+    except Exception:
+        return "Por favor, indica un número de pagos al año (ejemplo: 24)."
+
+@estado("ver_si_abonos1", entrada=ENTRADA_SI_NO, critico=False, siguiente=("abono_extra1",))
+def _estado_ver_si_abonos1(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["si", "sí"]:
+        contexto["esperando"] = "abono_extra1"
+        return "¿Cuánto deseas abonar extra por periodo? (Ejemplo: 500)"
+    elif texto_limpio == "no":
+        estado_usuario.pop(numero)
+        return (
+            mensaje_tabla_amortizacion(contexto)
+            + "Ok, regresamos al inicio. Escribe *menú* si deseas ver otras opciones."
+        )
+    else:
+        return "Por favor, responde *sí* o *no*."
+
+@estado("abono_extra1", entrada=ENTRADA_MONTO, critico=True, siguiente=("desde_cuando1",))
+def _estado_abono_extra1(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, un número válido (ej: 500)"
+    contexto["abono"] = lectura.valor
+    contexto["esperando"] = "desde_cuando1"
+    return "¿A partir de qué periodo comenzarás a abonar esa cantidad extra? (Ejemplo: 4)"
+
+@estado("desde_cuando1", entrada=ENTRADA_ENTERO, critico=True)
+def _estado_desde_cuando1(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
+    try:
+        desde = lectura.valor
+        contexto["desde"] = desde
+        total_sin, total_con, ahorro, pagos_menos = calcular_ahorro_por_abonos(
+            contexto["monto"], contexto["tasa"],
+            contexto["plazo"], contexto["abono"], desde
+        )
+        estado_usuario.pop(numero)
+        return (
+            f"💸 Si pagaras este crédito sin hacer abonos extra, terminarías pagando ${float(total_sin):,.2f} en total.\n\n"
+            f"Pero si decides abonar ${float(contexto['abono']):,.2f} adicionales por periodo desde el periodo {desde}...\n"
+            f"✅ Terminarías de pagar en menos tiempo (¡te ahorras {pagos_menos} pagos!)\n"
+            f"💰 Pagarías ${float(total_con):,.2f} en total\n"
+            f"🧮 Y te ahorrarías ${float(ahorro):,.2f} solo en intereses.\n\n"
+            f"{mensaje_tabla_amortizacion(contexto)}"
+            "Escribe *menú* para volver al inicio."
+        )
+    except:
+        return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
+
+# Opción 3 (compras a pagos fijos)
+@estado(
+    "precio_contado",
+    entrada=ENTRADA_MONTO,
+    critico=False,
+    siguiente=("pago_fijo_tienda", "numero_pagos_tienda", "pedir_periodos_anuales_tienda"),
+)
+def _estado_precio_contado(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica el precio de contado con números (ejemplo: 1800)"
+    contexto["precio_contado"] = lectura.valor
+    return _continuar_tienda(contexto, numero)
+
+@estado(
+    "pago_fijo_tienda",
+    entrada=ENTRADA_MONTO,
+    critico=False,
+    siguiente=("numero_pagos_tienda", "pedir_periodos_anuales_tienda"),
+)
+def _estado_pago_fijo_tienda(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, escribe solo el número del pago (ejemplo: 250)."
+    contexto["pago_fijo_tienda"] = lectura.valor
+    return _continuar_tienda(contexto, numero)
+
+# PRIMER PASO: guardamos num_pagos y pedimos periodos anuales
+@estado(
+    "numero_pagos_tienda",
+    entrada=ENTRADA_ENTERO,
+    critico=False,
+    siguiente=("pedir_periodos_anuales_tienda",),
+)
+def _estado_numero_pagos_tienda(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Ocurrió un error. Indica cuántos pagos totales harás (ejemplo: 24)."
+    contexto["numero_pagos_tienda"] = lectura.valor
+
+    # Sigue el paso donde preguntamos cuántos periodos hay en 1 año
+    return _continuar_tienda(contexto, numero)
+
+# SEGUNDO PASO: usuario indica periodos anuales (enteros: son pagos de la
+# tienda, no una frecuencia libre como ENTRADA_PERIODOS)
+@estado("pedir_periodos_anuales_tienda", entrada=ENTRADA_ENTERO, critico=False)
+def _estado_pedir_periodos_anuales_tienda(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Ocurrió un error. Asegúrate de indicar cuántos periodos hay en un año con un número (ej: 24)."
+    contexto["periodos_anuales"] = lectura.valor  # ✅ Se guarda en el contexto
+    return _continuar_tienda(contexto, numero)
+
+# Opción 4 (capacidad de pago)
+@estado("ingreso", entrada=ENTRADA_MONTO, critico=False, siguiente=("pagos_fijos",))
+def _estado_ingreso(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, escribe un número válido (ej: 12500)"
+    contexto["ingreso"] = lectura.valor
+    contexto["esperando"] = "pagos_fijos"
+    return (
+        "2️⃣ ¿Cuánto pagas mensualmente en créditos formales o instituciones financieras?\n"
+        "(Es decir, en pagos de préstamos personales, hipotecas, crédito de auto, crédito de "
+        "nómina, etc.) Si no tienes ninguno, escribe 0. (ejemplo: 1800)"
+    )
+
+@estado("pagos_fijos", entrada=ENTRADA_MONTO, critico=False, siguiente=("deuda_revolvente",))
+def _estado_pagos_fijos(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica la cantidad mensual que pagas en créditos (ej: 1800)"
+    contexto["pagos_fijos"] = lectura.valor
+    contexto["esperando"] = "deuda_revolvente"
+    return (
+        "3️⃣ ¿Cuánto debes actualmente en tarjetas de crédito u otras deudas revolventes?\n"
+        "(Las deudas revolventes son las que no tienen una fecha fija para terminarse de "
+        "pagar, como las tarjetas de crédito: vas pagando lo que usas cada mes.)\n"
+        "Si no tienes ninguna, escribe 0. (ejemplo: 5000)"
+    )
+
+@estado("deuda_revolvente", entrada=ENTRADA_MONTO, critico=False, siguiente=("riesgo",))
+def _estado_deuda_revolvente(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return (
+            "Por favor, escribe solo el número de esa deuda (ejemplo: 5000). "
+            "Si no tienes deudas de este tipo, escribe 0."
+        )
+    try:
+        contexto["deuda_revolvente"] = lectura.valor
+        contexto["esperando"] = "riesgo"
+        return (
+            "4️⃣ Por último, sé honesto/a contigo mismo/a: ¿cómo describirías tu forma de pagar "
+            "tus deudas hasta ahora?\n"
+            "1. Puntual (casi siempre pago a tiempo)\n"
+            "2. A veces me atraso (pero no es lo común)\n"
+            "3. Se me complica seguido (me atraso con frecuencia o ya tengo varias deudas)\n\n"
+            "No hay respuesta incorrecta, esto solo nos ayuda a calcular un número realista contigo."
+        )
+    except:
+        return (
+            "Por favor, escribe solo el número de esa deuda (ejemplo: 5000). "
+            "Si no tienes deudas de este tipo, escribe 0."
+        )
+
+@estado("riesgo", entrada=ENTRADA_OPCION, critico=True, siguiente=("subopcion_prestamo",))
+def _estado_riesgo(entrada, texto_limpio, numero, contexto):
+    if texto_limpio not in ["1", "2", "3"]:
+        return "Por favor, elige la opción 1, 2 o 3 según cómo describirías tu forma de pagar."
+
+    contexto["riesgo"] = texto_limpio
+    porcentajes = {"1": Decimal("0.60"), "2": Decimal("0.45"), "3": Decimal("0.30")}
+    porcentaje_riesgo = porcentajes[texto_limpio]
+    ingreso = contexto["ingreso"]
+    pagos_fijos = contexto["pagos_fijos"]
+    deuda_revolvente = contexto["deuda_revolvente"]
+    pago_est_deuda_revolvente = deuda_revolvente * Decimal("0.06")
+
+    capacidad_total = ingreso * porcentaje_riesgo
+    capacidad_mensual = capacidad_total - pagos_fijos - pago_est_deuda_revolvente
+    capacidad_mensual = capacidad_mensual.quantize(Decimal("0.01"))
+
+    if capacidad_mensual <= 0:
+        faltante = -capacidad_mensual
+        estado_usuario[numero] = Sesion()
+        return (
+            f"📊 Con tus datos actuales, tus pagos fijos y el pago mínimo estimado de tus deudas "
+            f"revolventes ya superan por ${faltante:,.2f} al mes lo que se considera manejable de "
+            "tu ingreso. Esto no solo significa que por ahora no te recomendaría tomar un crédito "
+            "nuevo, sino que es muy probable que tampoco te lo aprueben, porque tu capacidad de pago "
+            "disponible ya está en números negativos.\n\n"
+            "💡 Antes de solicitar un crédito nuevo, podría convenirte enfocarte primero en bajar "
+            "tus deudas actuales. Dentro de *Crédito* tengo consejos para pagar sin ahogarte que "
+            "te pueden servir.\n\n"
+            "Escribe *menú* para volver al inicio."
+        )
+
+    contexto["capacidad_mensual"] = capacidad_mensual
+    contexto["porcentaje_riesgo"] = porcentaje_riesgo
+    contexto["esperando"] = "subopcion_prestamo"
+
+    return (
+        f"✅ Según tus datos, podrías pagar hasta ${capacidad_mensual:,.2f} al mes en un nuevo crédito.\n\n"
+        "¿Qué te gustaría hacer ahora?\n"
+        "1. Calcular el monto máximo de crédito que podrías solicitar\n"
+        "2. Validar si un crédito que te interesa podría ser aprobado\n"
+        "Escribe 1 o 2 para continuar."
+    )
+
+@estado(
+    "subopcion_prestamo",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("tasa_anual_simular", "monto_credito_deseado"),
+)
+def _estado_subopcion_prestamo(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "1":
+        contexto["esperando"] = "tasa_anual_simular"
+        return (
+            "📈 ¿Qué tasa de interés ANUAL manejan los créditos que te interesan?\n"
+            "(ejemplo: si es 45% anual, escribe 45)"
+        )
+    elif texto_limpio == "2":
+        contexto["esperando"] = "monto_credito_deseado"
+        return "💰 ¿De cuánto sería el crédito que te interesa solicitar? (ejemplo: 150000)"
+    else:
+        return "Por favor, escribe 1 o 2."
+
+@estado("tasa_anual_simular", entrada=ENTRADA_TASA, critico=True, siguiente=("anios_simular",))
+def _estado_tasa_anual_simular(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica la tasa anual como un número (ejemplo: 45)."
+    contexto["tasa_anual_simular"] = lectura.valor
+    contexto["esperando"] = "anios_simular"
+    return "📆 ¿A cuántos años quieres simular el crédito? (ejemplo: 3)"
+
+@estado("anios_simular", entrada=ENTRADA_PLAZO, critico=True, siguiente=("frecuencia_simular",))
+def _estado_anios_simular(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica los años como un número (ejemplo: 3)."
+    contexto["anios_simular"] = lectura.valor
+    if lectura.unidad == UNIDAD_MESES:
+        contexto["anios_simular"] = lectura.valor / 12
+    contexto["esperando"] = "frecuencia_simular"
+    return MENSAJE_FRECUENCIA
+
+# submenú para el monto máximo
+@estado(
+    "frecuencia_simular",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("frecuencia_otro_simular", "submenu_despues_de_maximo"),
+)
+def _estado_frecuencia_simular(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "5":
+        contexto["esperando"] = "frecuencia_otro_simular"
+        return "¿Cuántos pagos haces al año en total? (ejemplo: 24)"
+    if texto_limpio not in FRECUENCIAS_PAGO:
+        return "Por favor, elige una opción del 1 al 5."
+    try:
+        frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
+        return _resolver_frecuencia_monto_maximo(contexto, frecuencia_label, periodos_por_anio)
+    except Exception:
+        return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
+
+@estado(
+    "frecuencia_otro_simular",
+    entrada=ENTRADA_PERIODOS,
+    critico=True,
+    siguiente=("submenu_despues_de_maximo",),
+)
+def _estado_frecuencia_otro_simular(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica un número de pagos al año (ejemplo: 24)."
+    try:
+        periodos_por_anio = lectura.valor
+        return _resolver_frecuencia_monto_maximo(contexto, "personalizada", periodos_por_anio)
+    except Exception:
+        return "Por favor, indica un número de pagos al año (ejemplo: 24)."
+
+@estado(
+    "submenu_despues_de_maximo",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("monto_credito_deseado",),
+)
+def _estado_submenu_despues_de_maximo(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "1":
+        contexto["esperando"] = "monto_credito_deseado"
+        return "💰 ¿De cuánto sería el crédito que te interesa solicitar? (ejemplo: 150000)"
+    elif texto_limpio == "2":
+        estado_usuario.pop(numero)
+        return "Listo, escribe *menú* para ver más opciones."
+    else:
+        return "Por favor, escribe 1 o 2."
+
+@estado(
+    "monto_credito_deseado",
+    entrada=ENTRADA_MONTO,
+    critico=False,
+    siguiente=("tasa_anual_deseada",),
+)
+def _estado_monto_credito_deseado(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica el monto como un número (ejemplo: 150000)."
+    contexto["monto_deseado"] = lectura.valor
+    contexto["esperando"] = "tasa_anual_deseada"
+    return (
+        "📈 ¿Cuál es la tasa de interés ANUAL de ese crédito?\n"
+        "(ejemplo: si te dijeron 45% anual, escribe 45)"
+    )
+
+@estado("tasa_anual_deseada", entrada=ENTRADA_TASA, critico=True, siguiente=("anios_deseado",))
+def _estado_tasa_anual_deseada(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica la tasa anual como un número (ejemplo: 45)."
+    contexto["tasa_anual_deseada"] = lectura.valor
+    contexto["esperando"] = "anios_deseado"
+    return "📆 ¿En cuántos años planeas pagarlo?"
+
+@estado("anios_deseado", entrada=ENTRADA_PLAZO, critico=True, siguiente=("frecuencia_deseada",))
+def _estado_anios_deseado(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica los años como un número (ejemplo: 3)."
+    contexto["anios_deseado"] = lectura.valor
+    if lectura.unidad == UNIDAD_MESES:
+        contexto["anios_deseado"] = lectura.valor / 12
+    contexto["esperando"] = "frecuencia_deseada"
+    return MENSAJE_FRECUENCIA
+
+@estado(
+    "frecuencia_deseada",
+    entrada=ENTRADA_OPCION,
+    critico=True,
+    siguiente=("frecuencia_otro_deseada",),
+)
+def _estado_frecuencia_deseada(entrada, texto_limpio, numero, contexto):
+    if texto_limpio == "5":
+        contexto["esperando"] = "frecuencia_otro_deseada"
+        return "¿Cuántos pagos haces al año en total? (ejemplo: 24)"
+    if texto_limpio not in FRECUENCIAS_PAGO:
+        return "Por favor, elige una opción del 1 al 5."
+    try:
+        frecuencia_label, periodos_por_anio = FRECUENCIAS_PAGO[texto_limpio]
+        resultado = _resolver_frecuencia_deseado(contexto, frecuencia_label, periodos_por_anio)
+        estado_usuario.pop(numero)
+        return resultado
+    except Exception:
+        return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
+
+@estado("frecuencia_otro_deseada", entrada=ENTRADA_PERIODOS, critico=True)
+def _estado_frecuencia_otro_deseada(lectura, texto_limpio, numero, contexto):
+    if lectura.motivo:
+        return "Por favor, indica un número de pagos al año (ejemplo: 24)."
+    try:
+        periodos_por_anio = lectura.valor
+    except Exception:
+        return "Por favor, indica un número de pagos al año (ejemplo: 24)."
+    try:
+        resultado = _resolver_frecuencia_deseado(contexto, "personalizada", periodos_por_anio)
+        estado_usuario.pop(numero)
+        return resultado
+    except Exception:
+        return "Uy, algo no cuadró con esos datos 🤔 Revisa que hayas escrito solo números y vuelve a intentarlo, o escribe *menú* para empezar de nuevo."
+
+# Submenú Buró
+@estado("submenu_buro", entrada=ENTRADA_SI_NO, critico=False)
+def _estado_submenu_buro(entrada, texto_limpio, numero, contexto):
+    if texto_limpio in ["si", "sí"]:
+        estado_usuario.pop(numero)
+        return (
+            "¿Cómo mejorar mi historial crediticio?\n"
+            "Aquí tienes algunos consejos prácticos para mejorar tu score en Buró de Crédito y tener un historial más saludable 📈\n"
+            "________________________________________\n"
+            "🔹 1. Paga a tiempo, siempre\n"
+            "📌 Aunque sea el pago mínimo, evita atrasarte.\n"
+            "✅ La puntualidad pesa mucho en tu historial.\n"
+            "________________________________________\n"
+            "🔹 2. Usa tus tarjetas con moderación\n"
+            "📌 Trata de no usar más del 30%-40% del límite de tu tarjeta.\n"
+            "✅ Usarlas hasta el tope te resta puntos, aunque pagues.\n"
+            "________________________________________\n"
+            "🔹 3. No abras muchos créditos al mismo tiempo\n"
+            "📌 Si pides varios préstamos en poco tiempo, parecerá que estás desesperado/a por dinero.\n"
+            "✅ Ve uno a la vez y maneja bien el que tienes.\n"
+            "________________________________________\n"
+            "🔹 4. Usa algún crédito, aunque sea pequeño\n"
+            "📌 Si no tienes historial, nunca tendrás score.\n"
+            "✅ Una tarjeta departamental o un plan telefónico pueden ser un buen inicio si los manejas bien.\n"
+            "________________________________________\n"
+            "🔹 5. Revisa tu historial al menos una vez al año\n"
+            "📌 Puedes pedir un reporte gratuito en www.burodecredito.com.mx\n"
+            "✅ Asegúrate de que no haya errores y de que tus datos estén correctos.\n"
+            "Escribe *menú*."
+        )
+    else:
+        estado_usuario.pop(numero)
+        return "Entiendo. Escribe *menú*."
+
+def _revisar_siguientes():
+    """Cada paso de `siguiente` tiene que existir: un error de dedo se nota al arrancar."""
+    for paso in ESTADOS.values():
+        for destino in paso.siguiente:
+            if destino not in ESTADOS:
+                raise ValueError(f"El paso {paso.nombre!r} lleva a {destino!r}, que no está registrado")
+
+_revisar_siguientes()
+
+# =========================================
+# Modo comando: una simulación completa en un solo mensaje
+# =========================================
+# Quien ya conoce el bot puede escribir todo de una vez, por ejemplo
+# "crédito 150000 45% 3 años quincenal" o "tienda 1800 250 12 quincenal",
+# y recibir el resultado sin pasar por cada pregunta. Los números con unidad
+# ("45%", "3 años", "18 meses") van a su campo; los que no traen unidad
+# llenan los campos que falten en el orden de la pregunta guiada. Si falta
+# algún dato, la conversación sigue en el paso guiado de ese dato y salta
+# los que ya se dieron.
+_COMANDO_RE = re.compile(r"(credito|simular (?:un )?credito|tienda)\s+(.+)")
+# "45 %" -> "45%", "3 anos" -> "3anos", "15 mil pesos" -> "15milpesos",
+# para que cada número con su unidad quede en una sola palabra.
+_POR_CIENTO_RE = re.compile(r"\s*por\s?ciento")
+_UNIDAD_SEPARADA_RE = re.compile(
+    r"(?<=[\w%])\s+(?=%|(?:k|mil|millones|millon|mdp|anios?|anos?|meses|mes|(?:de\s+)?pesos|mxn|anual(?:es)?)\b)"
+)
+_FRECUENCIAS_POR_NOMBRE = {etiqueta: (etiqueta, periodos) for etiqueta, periodos in FRECUENCIAS_PAGO.values()}
+
+# Campos de cada comando, en el orden de las preguntas guiadas, con las
+# unidades que acepta cada uno (None: un número sin unidad).
+_CAMPOS_COMANDO = {
+    "credito": (
+        ("monto", (None, UNIDAD_PESOS)),
+        ("tasa_anual", (None, UNIDAD_PORCENTAJE)),
+        ("anios", (None, UNIDAD_ANIOS, UNIDAD_MESES)),
+        ("frecuencia", (None,)),
+    ),
+    "tienda": (
+        ("precio_contado", (None, UNIDAD_PESOS)),
+        ("pago_fijo_tienda", (None, UNIDAD_PESOS)),
+        ("numero_pagos_tienda", (None, UNIDAD_MESES)),
+        ("frecuencia", (None,)),
+    ),
+}
+_MONTOS_COMANDO = frozenset(("monto", "precio_contado", "pago_fijo_tienda"))
+
+# (dato del contexto, paso que lo pregunta, pregunta)
+_PASOS_CREDITO = (
+    ("monto", "monto_credito", "Perfecto. Para comenzar, dime el monto del crédito que deseas simular."),
+    (
+        "tasa_anual",
+        "tasa_anual_credito",
+        "¿Cuál es la tasa de interés ANUAL que te ofrecieron?\n"
+        "Es la que normalmente te dicen en el banco o la tienda (ejemplo: si te "
+        "dijeron 45% anual, solo escribe 45).",
+    ),
+    ("anios", "anios_credito", "¿A cuántos años es el crédito? (puedes usar decimales, ejemplo: 2.5)"),
+)
+
+_PASOS_TIENDA = (
+    (
+        "precio_contado",
+        "precio_contado",
+        "Vamos a calcular el costo real de una compra a pagos fijos.\n"
+        "Por favor dime lo siguiente:\n\n"
+        "1️⃣ ¿Cuál es el precio de contado del producto? (ejemplo: 1800)",
+    ),
+    ("pago_fijo_tienda", "pago_fijo_tienda", "2️⃣ ¿De cuánto será cada pago (por ejemplo: 250)?"),
+    ("numero_pagos_tienda", "numero_pagos_tienda", "3️⃣ ¿Cuántos pagos harás en total? (ejemplo: 24)"),
+    (
+        "periodos_anuales",
+        "pedir_periodos_anuales_tienda",
+        "Para calcular la tasa anual real, necesito saber cuántos periodos hay en 1 año.\n"
+        "Por ejemplo:\n"
+        "• 12 si es mensual\n"
+        "• 24 si es quincenal (cada 15 días)\n"
+        "• 26 si es catorcenal (cada 14 días)\n"
+        "• 52 si es semanal\n\n"
+        "Escribe solo el número:",
+    ),
+)
+
+def leer_comando(texto):
+    """
+    Lee un comando de un texto ya normalizado (minúsculas, sin acentos).
+    Devuelve (tipo, valores), donde tipo es "credito" o "tienda" y valores
+    un dict campo -> LecturaNumero (o (etiqueta, periodos) en "frecuencia")
+    con solo los campos que se dieron; None si el texto no es un comando o
+    trae algo que no se puede leer.
+    """
+    partes = _COMANDO_RE.fullmatch(texto)
+    if partes is None:
+        return None
+    tipo = "tienda" if partes[1] == "tienda" else "credito"
+    campos = _CAMPOS_COMANDO[tipo]
+    argumentos = _UNIDAD_SEPARADA_RE.sub("", _POR_CIENTO_RE.sub("%", partes[2])).split()
+    if len(argumentos) > len(campos):
+        return None
+
+    valores = {}
+    sin_unidad = []
+    for argumento in argumentos:
+        if argumento in _FRECUENCIAS_POR_NOMBRE:
+            if "frecuencia" in valores:
+                return None
+            valores["frecuencia"] = _FRECUENCIAS_POR_NOMBRE[argumento]
+            continue
+        lectura = leer_numero(argumento)
+        if lectura.motivo is not None:
+            return None
+        if lectura.unidad is None:
+            sin_unidad.append(lectura)
+            continue
+        campo = next((c for c, unidades in campos if c not in valores and lectura.unidad in unidades), None)
+        if campo is None:
+            return None
+        valores[campo] = lectura
+    # Los números sin unidad llenan, en orden, los campos que quedaron libres
+    for lectura in sin_unidad:
+        campo = next((c for c, _ in campos if c not in valores), None)
+        if campo is None:
+            return None
+        valores[campo] = lectura
+    # En los montos, "150.000" es 150000 (como en el paso guiado)
+    for campo in _MONTOS_COMANDO.intersection(valores):
+        if valores[campo].valor_miles is not None:
+            valores[campo] = valores[campo]._replace(valor=valores[campo].valor_miles)
+    return tipo, valores
+
+def _entero_o_none(valor):
+    if valor > 0 and valor == valor.to_integral_value():
+        return int(valor)
+    return None
+
+def responder_comando(entrada, numero):
+    """
+    Si el mensaje es un comando ("crédito ..." / "tienda ..."), arma el
+    contexto con lo que trae y responde; si no, devuelve None.
+    """
+    comando = leer_comando(entrada.sin_acentos)
+    if comando is None:
+        return None
+    tipo, valores = comando
+    frecuencia = valores.pop("frecuencia", None)
+    contexto = Sesion()
+    if tipo == "credito":
+        for campo, lectura in valores.items():
+            contexto[campo] = lectura.valor
+        if "anios" in valores and valores["anios"].unidad == UNIDAD_MESES:
+            contexto["anios"] = valores["anios"].valor / 12
+        if isinstance(frecuencia, LecturaNumero):
+            frecuencia = ("personalizada", frecuencia.valor)
+        if frecuencia is not None:
+            contexto["frecuencia_comando"], contexto["periodos_comando"] = frecuencia
+        estado_usuario[numero] = contexto
+        return _continuar_credito(contexto)
+
+    for campo, lectura in valores.items():
+        contexto[campo] = lectura.valor
+    # Los pagos y los periodos de la tienda son enteros; si no, se preguntan
+    if "numero_pagos_tienda" in contexto:
+        contexto["numero_pagos_tienda"] = _entero_o_none(contexto["numero_pagos_tienda"])
+    if isinstance(frecuencia, LecturaNumero):
+        contexto["periodos_anuales"] = _entero_o_none(frecuencia.valor)
+    elif frecuencia is not None:
+        contexto["periodos_anuales"] = int(frecuencia[1])
+    for campo in [campo for campo, valor in contexto.items() if valor is None]:
+        del contexto[campo]
+    estado_usuario[numero] = contexto
+    return _continuar_tienda(contexto, numero)
+
+def _continuar_credito(contexto):
+    """Pregunta el primer dato que falte del crédito o, si ya están todos, lo simula."""
+    for campo, paso, pregunta in _PASOS_CREDITO:
+        if campo not in contexto:
+            contexto["esperando"] = paso
+            return pregunta
+    contexto["esperando"] = "frecuencia_credito"
+    if "frecuencia_comando" not in contexto:
+        return MENSAJE_FRECUENCIA
+    frecuencia_label = contexto.pop("frecuencia_comando")
+    periodos_por_anio = contexto.pop("periodos_comando")
+    try:
+        return _resolver_frecuencia_flujo1(contexto, frecuencia_label, periodos_por_anio)
+    except Exception:
+        return "Hubo un error al calcular. Revisa tus datos e intenta de nuevo."
+
+def _continuar_tienda(contexto, numero):
+    """Pregunta el primer dato que falte de la compra o, si ya están todos, calcula su costo."""
+    for campo, paso, pregunta in _PASOS_TIENDA:
+        if campo not in contexto:
+            contexto["esperando"] = paso
+            return pregunta
+    try:
+        mensaje_resultado = calcular_costo_credito_tienda(
+            contexto["precio_contado"],
+            contexto["pago_fijo_tienda"],
+            contexto["numero_pagos_tienda"],
+            contexto["periodos_anuales"]
+        )
+    except Exception as e:
+        registrar_evento("error_calculo", logging.WARNING, calculo="credito_tienda", error=str(e))
+        contexto["esperando"] = "pedir_periodos_anuales_tienda"
+        return "Ocurrió un error. Asegúrate de indicar cuántos periodos hay en un año con un número (ej: 24)."
+    estado_usuario.pop(numero)
+    return mensaje_resultado
+
 # =========================================
 # "Explícamelo más fácil": simplifica los términos técnicos de la
 # última respuesta del bot, sin interrumpir la conversación en curso.
 # =========================================
-def _sin_acentos(texto):
-    return ''.join(
-        c for c in unicodedata.normalize('NFD', texto)
-        if unicodedata.category(c) != 'Mn'
+# Cada mensaje que llega se normaliza UNA vez y esa misma versión se usa en
+# todo el recorrido (explícamelo más fácil, menú principal y el paso de la
+# conversación). Es una tupla inmutable con:
+#   original     el texto tal como llegó
+#   limpio       sin puntuación en los bordes y en minúsculas
+#   sin_acentos  limpio, además sin acentos
+#   lectura      el número que trae, ya interpretado (ver leer_numero)
+MensajeNormalizado = namedtuple("MensajeNormalizado", "original limpio sin_acentos lectura")
+
+def normalizar_mensaje(mensaje):
+    # Minúsculas y sin acentos una sola vez, sobre el mensaje completo: el
+    # número se lee de ahí (quitar la puntuación de los bordes convertiría
+    # ".5" en "5"), y las versiones sin bordes solo recortan lo ya plegado.
+    minusculas = mensaje.strip().lower()
+    plegado = _sin_acentos(minusculas)
+    return MensajeNormalizado(
+        mensaje,
+        _BORDE_PUNTUACION_RE.sub('', minusculas),
+        _BORDE_PUNTUACION_RE.sub('', plegado),
+        leer_numero(plegado),
     )
 
 _FRASES_EXPLICAR_MAS_FACIL = [
@@ -2489,25 +5088,35 @@ _FRASES_EXPLICAR_MAS_FACIL = [
     "explicame mas sencillo", "explicamelo de otra forma", "no entendi",
     "mas facil", "mas sencillo",
 ]
+_EXPLICAR_MAS_FACIL_RE = re.compile("|".join(map(re.escape, _FRASES_EXPLICAR_MAS_FACIL)))
 
-def es_peticion_explicar_mas_facil(texto_limpio):
-    texto_sin_acentos = _sin_acentos(texto_limpio)
-    return any(frase in texto_sin_acentos for frase in _FRASES_EXPLICAR_MAS_FACIL)
+def es_peticion_explicar_mas_facil(entrada):
+    return _EXPLICAR_MAS_FACIL_RE.search(entrada.sin_acentos) is not None
 
 def _explicar_mas_facil(numero):
-    ultimo = _ultimo_mensaje_bot.get(numero)
-    if ultimo is None:
+    mascara = _ultimo_mensaje_bot.get(numero)
+    if mascara is None:
         # Primera vez que este número nos escribe: todavía no le hemos
         # dicho nada que explicarle más fácil, así que lo recibimos normal.
-        estado_usuario[numero] = {}
+        estado_usuario[numero] = Sesion()
         return saludo_inicial
-    terminos = buscar_terminos_glosario(ultimo)
-    if not terminos:
+    return _explicacion_de_terminos(mascara)
+
+# Hay pocas combinaciones distintas de términos (las dan los mensajes fijos
+# del bot), así que cada explicación se arma una vez y se reutiliza.
+@functools.lru_cache(maxsize=256)
+def _explicacion_de_terminos(mascara):
+    if not mascara:
         return (
             "Con gusto 🙂 Pero no encontré ningún término técnico en lo último que te escribí. Si hay "
             "algo puntual que no te quedó claro, cuéntame qué palabra o parte no entendiste, o escribe "
             "*glosario* para ver los términos financieros más comunes explicados de forma simple."
         )
+    terminos = [
+        (nombre, explicacion)
+        for indice, (_, nombre, explicacion) in enumerate(GLOSARIO_TERMINOS)
+        if mascara >> indice & 1
+    ]
     explicacion = "\n\n".join(f"🔑 *{nombre}*\n{exp}" for nombre, exp in terminos)
     return (
         "🧠 Con gusto, aquí te explico más sencillo algunos términos que mencioné:\n\n"
@@ -2515,23 +5124,390 @@ def _explicar_mas_facil(numero):
         "Puedes responder tu pregunta normal cuando quieras continuar, o escribir *menú* para regresar al inicio."
     )
 
+# =========================================
+# Turnos por número
+# =========================================
+# Con gunicorn en hilos (dos POST seguidos del mismo número), dos mensajes
+# rápidos de la misma persona podían correr el paso de la conversación al
+# mismo tiempo y pisarse el contexto (p. ej. subir salud_preg_idx dos
+# veces). Cada número tiene una fila de turnos: sus mensajes se atienden uno
+# a la vez y en el orden en que pidieron turno, y números distintos siguen
+# en paralelo. La fila existe solo mientras alguien la usa, así que no crece
+# con el número de usuarios. Entre procesos (varios workers con
+# BOT_SESIONES=sqlite) lo resuelve la versión de cada sesión (ver
+# AlmacenSesionesSQLite.guardar_si_version).
+class _Turno:
+    __slots__ = ("siguiente", "atendiendo", "condicion")
+
+    def __init__(self):
+        self.siguiente = 0   # el próximo boleto que se entrega
+        self.atendiendo = 0  # el boleto al que le toca
+        self.condicion = None  # se crea solo si alguien tiene que esperar
+
+_turnos = {}
+_candado_turnos = threading.Lock()
+
+def _tomar_turno(numero):
+    with _candado_turnos:
+        turno = _turnos.get(numero)
+        if turno is None:
+            turno = _turnos[numero] = _Turno()
+        boleto = turno.siguiente
+        turno.siguiente += 1
+        if boleto != turno.atendiendo:
+            if turno.condicion is None:
+                turno.condicion = threading.Condition(_candado_turnos)
+            while boleto != turno.atendiendo:
+                turno.condicion.wait()
+    return turno
+
+def _soltar_turno(numero, turno):
+    with _candado_turnos:
+        turno.atendiendo += 1
+        if turno.atendiendo == turno.siguiente:
+            del _turnos[numero]
+        else:
+            turno.condicion.notify_all()
+
+@contextmanager
+def turno_de(numero):
+    """Atiende el bloque cuando le toque a este número (en orden de llegada)."""
+    turno = _tomar_turno(numero)
+    try:
+        yield
+    finally:
+        _soltar_turno(numero, turno)
+
 def procesar_mensaje(mensaje, numero):
     """
     Punto de entrada público: intercepta las peticiones de "explícamelo más
     fácil" (sin importar en qué parte de la conversación esté la persona, y
     sin modificar su estado, para no interrumpir un flujo en curso) y, si no
-    aplica, delega en la lógica normal de la conversación. Además guarda la
-    respuesta del bot como "el último mensaje" para poder simplificarla si
-    la piden después.
+    aplica, delega en la lógica normal de la conversación. Además guarda qué
+    términos del glosario trae la respuesta del bot, para poder explicarlos
+    si la piden después. Espera su turno si ese número ya tiene un mensaje
+    en proceso.
     """
-    texto_limpio = _BORDE_PUNTUACION_RE.sub('', mensaje).lower()
-    if es_peticion_explicar_mas_facil(texto_limpio):
-        return _explicar_mas_facil(numero)
+    with turno_de(numero):
+        return _procesar_mensaje_en_turno(mensaje, numero)
+
+def _procesar_mensaje_en_turno(mensaje, numero):
+    if almacen_sesiones.local:
+        return _procesar_mensaje_con_sesion(mensaje, numero)
+
+    # Almacén compartido: traemos la sesión de este número, la conversación
+    # trabaja sobre estado_usuario como siempre, y la guardamos de vuelta.
+    # Si otro worker guardó la sesión de este número mientras tanto, este
+    # paso se descarta (todavía no se envió nada) y se repite sobre la
+    # sesión nueva; números distintos nunca se esperan entre sí.
+    while True:
+        contexto, ultimo, version = almacen_sesiones.cargar_con_version(numero)
+        if contexto is not None:
+            estado_usuario[numero] = contexto
+        if ultimo is not None:
+            _ultimo_mensaje_bot[numero] = ultimo
+        try:
+            respuesta = _procesar_mensaje_con_sesion(mensaje, numero)
+        finally:
+            guardada = almacen_sesiones.guardar_si_version(
+                numero, estado_usuario.pop(numero, None), _ultimo_mensaje_bot.pop(numero, None),
+                version,
+            )
+        if guardada:
+            return respuesta
+        registrar_evento("sesion_en_conflicto", numero=numero)
+
+def _procesar_mensaje_con_sesion(mensaje, numero):
+    inicio = time.perf_counter()
+    contexto = estado_usuario.get(numero)
+    paso = contexto.get("esperando") if contexto is not None else None
+    etiqueta_anterior = etiquetar_perfil(paso or "ninguno") if PERFIL_ACTIVO else None
+    try:
+        entrada = normalizar_mensaje(mensaje)
+        if es_peticion_explicar_mas_facil(entrada):
+            return _explicar_mas_facil(numero)
+
+        respuesta = _procesar_mensaje_interno(entrada, numero, contexto)
+        _ultimo_mensaje_bot[numero] = mascara_terminos_glosario(respuesta)
+        return respuesta
+    finally:
+        # El envío y el resto de la petición vuelven a contarse para quien
+        # llamó (webhook, lote o ingesta), no para el paso de la conversación
+        if etiqueta_anterior is not None:
+            etiquetar_perfil(etiqueta_anterior)
+        if METRICAS:
+            observar_metrica(
+                "bot_procesar_mensaje_segundos", (paso or "ninguno",), time.perf_counter() - inicio
+            )
 
-    respuesta = _procesar_mensaje_interno(mensaje, numero)
-    _ultimo_mensaje_bot[numero] = respuesta
+def atender_mensaje(mensaje, numero):
+    """
+    Un paso completo de la conversación: calcula la respuesta y se la envía
+    a la persona. Lo usa tanto el webhook (modo normal) como los
+    trabajadores en segundo plano (modo de ingesta). El turno del número
+    abarca también el envío, para que las respuestas salgan en el mismo
+    orden que los mensajes (entre workers distintos ese orden no se
+    garantiza, solo que el contexto no se pise).
+    """
+    with turno_de(numero):
+        respuesta = _procesar_mensaje_en_turno(mensaje, numero)
+        enviar_mensaje(numero, respuesta)
     return respuesta
 
+# =========================================
+# Clasificación rápida de webhooks
+# =========================================
+# La mayoría de los POST que manda WhatsApp no son mensajes sino avisos de
+# estado (enviado / entregado / leído) de nuestras propias respuestas. Miramos
+# la forma del payload antes que nada para contestar esos avisos de inmediato,
+# sin imprimir todo el cuerpo ni pasar por el manejo de errores.
+WEBHOOK_MENSAJES = "mensajes"
+WEBHOOK_ESTADOS = "estados"
+WEBHOOK_OTRO = "otro"
+
+def _dicts(valor):
+    """
+    Los elementos de una lista del payload que son dicts. Lo que no tenga la
+    forma esperada (una lista que es texto, un número en vez de objeto) se
+    ignora en vez de tumbar el webhook con un 500 que WhatsApp reintentaría.
+    """
+    if not isinstance(valor, list):
+        return ()
+    return [elemento for elemento in valor if isinstance(elemento, dict)]
+
+def valores_webhook(data):
+    """Recorre los "value" de todas las entradas y cambios de un webhook."""
+    if not isinstance(data, dict):
+        return
+    for entrada in _dicts(data.get("entry")):
+        for cambio in _dicts(entrada.get("changes")):
+            valor = cambio.get("value")
+            if isinstance(valor, dict):
+                yield valor
+
+def clasificar_webhook(data):
+    """
+    Devuelve WEBHOOK_MENSAJES si el payload trae al menos un mensaje,
+    WEBHOOK_ESTADOS si solo trae avisos de estado, y WEBHOOK_OTRO si no trae
+    ninguno de los dos (o no tiene la forma esperada).
+    """
+    hay_estados = False
+    for valor in valores_webhook(data):
+        if _dicts(valor.get("messages")):
+            return WEBHOOK_MENSAJES
+        if _dicts(valor.get("statuses")):
+            hay_estados = True
+    return WEBHOOK_ESTADOS if hay_estados else WEBHOOK_OTRO
+
+def _registrar_estados_webhook(data):
+    for valor in valores_webhook(data):
+        for estado in _dicts(valor.get("statuses")):
+            registrar_estado_entrega(estado)
+
+# =========================================
+# Webhooks con varios mensajes
+# =========================================
+# Cuando hay mucho tráfico, Meta junta varias entradas, cambios y mensajes en
+# un solo POST. Aquí los recorremos todos (no solo el primero), los agrupamos
+# por número para respetar el orden de cada persona, y atendemos a personas
+# distintas en paralelo.
+LOTE_HILOS = int(os.environ.get('BOT_LOTE_HILOS', '8'))
+
+_ejecutor_lotes = None
+_pid_ejecutor_lotes = None
+_candado_ejecutor_lotes = threading.Lock()
+
+def iterar_mensajes_webhook(data):
+    """
+    Recorre TODOS los mensajes de texto de un webhook, en el orden en que
+    llegaron, y devuelve (numero, texto, id) por cada uno. Los mensajes que
+    no son de texto (imágenes, audios, etc.) o no tienen la forma esperada
+    se saltan.
+    """
+    for valor in valores_webhook(data):
+        for mensaje in _dicts(valor.get("messages")):
+            texto = mensaje.get("text")
+            texto = texto.get("body") if isinstance(texto, dict) else None
+            numero = mensaje.get("from")
+            if not isinstance(texto, str) or not isinstance(numero, str) or not numero:
+                continue
+            message_id = mensaje.get("id")
+            yield numero, texto, message_id if isinstance(message_id, str) else None
+
+def agrupar_por_remitente(mensajes):
+    """
+    Agrupa una lista de (numero, texto) por número, conservando el orden de
+    llegada dentro de cada grupo. Devuelve {numero: [(posicion, texto), ...]},
+    donde posicion es el lugar del mensaje en la lista original.
+    """
+    grupos = {}
+    for posicion, (numero, mensaje) in enumerate(mensajes):
+        grupos.setdefault(numero, []).append((posicion, mensaje))
+    return grupos
+
+def _obtener_ejecutor_lotes():
+    global _ejecutor_lotes, _pid_ejecutor_lotes
+    pid = os.getpid()
+    if _ejecutor_lotes is not None and _pid_ejecutor_lotes == pid:
+        return _ejecutor_lotes
+    with _candado_ejecutor_lotes:
+        if _ejecutor_lotes is None or _pid_ejecutor_lotes != pid:
+            _ejecutor_lotes = ThreadPoolExecutor(
+                max_workers=max(1, LOTE_HILOS), thread_name_prefix="lote"
+            )
+            _pid_ejecutor_lotes = pid
+    return _ejecutor_lotes
+
+def _atender_grupo(numero, mensajes_numero):
+    # Un mensaje que falla no detiene a los demás: sus ids ya quedaron
+    # registrados como procesados, así que el reenvío de WhatsApp (si el
+    # webhook contestara 500) se ignoraría y nadie los atendería.
+    resultado = []
+    for posicion, mensaje in mensajes_numero:
+        try:
+            respuesta = atender_mensaje(mensaje, numero)
+        except Exception as e:
+            registrar_evento("error_mensaje", logging.ERROR, numero=numero, error=str(e))
+            respuesta = None
+        resultado.append((posicion, respuesta))
+    return resultado
+
+def atender_lote(mensajes):
+    """
+    Atiende una lista de (numero, texto): los mensajes de un mismo número van
+    uno tras otro y en orden; números distintos se atienden en paralelo.
+    Devuelve las respuestas en el mismo orden que la lista original (None
+    para los mensajes que fallaron, que quedan en el log).
+    """
+    grupos = agrupar_por_remitente(mensajes)
+    respuestas = [None] * len(mensajes)
+    if len(grupos) == 1:
+        (numero, mensajes_numero), = grupos.items()
+        resultados = [_atender_grupo(numero, mensajes_numero)]
+    else:
+        ejecutor = _obtener_ejecutor_lotes()
+        atender = con_perfil(_atender_grupo) if PERFIL_ACTIVO and perfil_en_curso() else _atender_grupo
+        futuros = [
+            ejecutor.submit(atender, numero, mensajes_numero)
+            for numero, mensajes_numero in grupos.items()
+        ]
+        resultados = [futuro.result() for futuro in futuros]
+    for resultado in resultados:
+        for posicion, respuesta in resultado:
+            respuestas[posicion] = respuesta
+    return respuestas
+
+# =========================================
+# Modo de ingesta: responder 200 de inmediato y procesar en segundo plano
+# =========================================
+# En el modo normal, el webhook calcula la respuesta y espera a que la API de
+# WhatsApp confirme el envío antes de devolver 200. Si eso tarda, WhatsApp
+# reenvía el mensaje. Con BOT_MODO_INGESTA=1 el webhook solo valida y encola
+# el mensaje, responde 200 al instante, y un grupo fijo de trabajadores hace
+# el paso de la conversación y el envío.
+#
+# Cada trabajador tiene su propia cola y cada número siempre cae en la misma
+# (según un hash del número), así los mensajes de una misma persona se
+# atienden en orden y nunca dos a la vez, mientras que personas distintas se
+# atienden en paralelo.
+MODO_INGESTA = os.environ.get('BOT_MODO_INGESTA', '0') == '1'
+INGESTA_TRABAJADORES = int(os.environ.get('BOT_INGESTA_TRABAJADORES', '4'))
+INGESTA_TAMANO_COLA = int(os.environ.get('BOT_INGESTA_TAMANO_COLA', '1000'))
+INGESTA_TIEMPO_DRENADO = float(os.environ.get('BOT_INGESTA_TIEMPO_DRENADO', '10'))
+INGESTA_ESPERA_COLA = float(os.environ.get('BOT_INGESTA_ESPERA_COLA', '2'))
+
+_FIN_INGESTA = object()  # Señal para que un trabajador termine
+_colas_ingesta = []
+_hilos_ingesta = []
+_candado_ingesta = threading.Lock()
+
+def _trabajador_ingesta(cola):
+    while True:
+        tarea = cola.get()
+        try:
+            if tarea is _FIN_INGESTA:
+                return
+            mensaje, numero, perfilar = tarea
+            (con_perfil(atender_mensaje) if perfilar else atender_mensaje)(mensaje, numero)
+        except Exception as e:
+            registrar_evento("error_ingesta", logging.ERROR, error=str(e))
+        finally:
+            cola.task_done()
+
+def _iniciar_ingesta():
+    """
+    Arranca los trabajadores la primera vez que se necesitan (y no al
+    importar el módulo), para que funcione también cuando gunicorn carga la
+    app antes de crear sus procesos (--preload): los hilos no sobreviven a
+    ese fork.
+    """
+    with _candado_ingesta:
+        if _hilos_ingesta:
+            return
+        num_trabajadores = max(1, INGESTA_TRABAJADORES)
+        tamano_por_cola = max(1, INGESTA_TAMANO_COLA // num_trabajadores)
+        for i in range(num_trabajadores):
+            cola = queue.Queue(maxsize=tamano_por_cola)
+            hilo = threading.Thread(
+                target=_trabajador_ingesta, args=(cola,),
+                name=f"ingesta-{i}", daemon=True,
+            )
+            _colas_ingesta.append(cola)
+            _hilos_ingesta.append(hilo)
+            hilo.start()
+
+def encolar_mensaje(mensaje, numero, espera=None):
+    """
+    Deja el mensaje en la cola del trabajador que le corresponde a este
+    número; si está llena espera hasta `espera` segundos a que se libere un
+    lugar. Devuelve False si no cupo, para que quien llama decida qué hacer.
+    No se puede atender en línea: se adelantaría a los mensajes anteriores
+    de ese número que siguen en la cola.
+    """
+    if espera is None:
+        espera = INGESTA_ESPERA_COLA
+    if not _hilos_ingesta:
+        _iniciar_ingesta()
+    cola = _colas_ingesta[zlib.crc32(numero.encode()) % len(_colas_ingesta)]
+    try:
+        cola.put((mensaje, numero, PERFIL_ACTIVO and perfil_en_curso()), timeout=espera)
+    except queue.Full:
+        return False
+    return True
+
+def profundidad_cola_ingesta():
+    """Cuántos mensajes hay esperando en total en las colas de ingesta."""
+    return sum(cola.qsize() for cola in _colas_ingesta)
+
+def detener_ingesta(tiempo_max=None):
+    """
+    Apagado ordenado: deja que cada trabajador termine los mensajes que ya
+    tenía en su cola y luego lo detiene. Se llama sola al salir el proceso
+    (por ejemplo cuando gunicorn reinicia un worker), para no perder mensajes
+    que ya habíamos confirmado a WhatsApp con un 200.
+    """
+    if tiempo_max is None:
+        tiempo_max = INGESTA_TIEMPO_DRENADO
+    with _candado_ingesta:
+        colas = list(_colas_ingesta)
+        hilos = list(_hilos_ingesta)
+        _colas_ingesta.clear()
+        _hilos_ingesta.clear()
+    limite = time.monotonic() + tiempo_max
+    for cola in colas:
+        # La señal de fin queda detrás de los mensajes pendientes; si la cola
+        # está llena, esperamos (hasta el límite) a que se libere un lugar.
+        try:
+            cola.put(_FIN_INGESTA, timeout=max(0.0, limite - time.monotonic()))
+        except queue.Full:
+            pass
+    for hilo in hilos:
+        hilo.join(timeout=max(0.0, limite - time.monotonic()))
+        if hilo.is_alive():
+            registrar_evento("ingesta_sin_drenar", logging.WARNING, trabajador=hilo.name)
+
+atexit.register(detener_ingesta)
+
 @app.route("/webhook", methods=["GET", "POST"])
 def webhook():
     if request.method == "GET":
@@ -2542,30 +5518,82 @@ def webhook():
         return "Token inválido", 403
 
     if request.method == "POST":
-        data = request.get_json()
-        print("📩 Webhook recibido:")
-        print(json.dumps(data, indent=2))  # 👈 muestra todo bonito en logs
-
+        inicio = time.perf_counter()
+        data = request.get_json(silent=True)
+        tipo = clasificar_webhook(data)
         try:
-            mensaje = data['entry'][0]['changes'][0]['value']['messages'][0]['text']['body']
-            numero = data['entry'][0]['changes'][0]['value']['messages'][0]['from']
-            message_id = data['entry'][0]['changes'][0]['value']['messages'][0].get('id')
-        except Exception as e:
-            print("⚠️ No se pudo procesar el mensaje:", e)
-            return "ok", 200
-
-        # WhatsApp puede reenviar el mismo mensaje (mismo id) si no le
-        # respondemos rápido, por ejemplo justo cuando el servicio estaba
-        # dormido y está despertando. Si ya procesamos este id, lo
-        # ignoramos para no responder por duplicado.
-        if ya_fue_procesado(message_id):
-            print(f"⚠️ Mensaje duplicado ignorado (id={message_id})")
-            return {"status": "duplicado_ignorado"}, 200
-
-        respuesta = procesar_mensaje(mensaje, numero)
-        enviar_mensaje(numero, respuesta)
+            if MEDIR_ENTREGA and tipo != WEBHOOK_OTRO:
+                _registrar_estados_webhook(data)
+            if tipo == WEBHOOK_ESTADOS:
+                return "ok", 200
+            if tipo == WEBHOOK_OTRO:
+                registrar_evento("webhook_ignorado", logging.WARNING, motivo="sin_mensajes_ni_estados")
+                return "ok", 200
+
+            mensajes = []
+            ids = []
+            duplicados = 0
+            for numero, mensaje, message_id in iterar_mensajes_webhook(data):
+                # WhatsApp puede reenviar el mismo mensaje (mismo id) si no le
+                # respondemos rápido, por ejemplo justo cuando el servicio estaba
+                # dormido y está despertando. Si ya procesamos este id, lo
+                # ignoramos para no responder por duplicado.
+                if ya_fue_procesado(message_id):
+                    registrar_evento("mensaje_duplicado", numero=numero, message_id=message_id)
+                    duplicados += 1
+                    continue
+                mensajes.append((numero, mensaje))
+                ids.append(message_id)
+            registrar_evento("webhook_recibido", mensajes=len(mensajes), duplicados=duplicados)
+
+            if not mensajes:
+                if duplicados:
+                    return {"status": "duplicado_ignorado"}, 200
+                registrar_evento("webhook_ignorado", motivo="sin_mensajes_de_texto")
+                return "ok", 200
+
+            if MODO_INGESTA:
+                # Si la cola de un número sigue llena después de esperar, ese
+                # mensaje y los siguientes del mismo número NO se atienden en
+                # línea (se adelantarían a los que siguen en la cola): se
+                # olvidan sus ids y se contesta 503 para que WhatsApp los
+                # reenvíe. Los que sí se encolaron quedan registrados, así que
+                # en el reenvío se ignoran como duplicados. La espera es una
+                # sola para todo el POST, no una por cada número rechazado.
+                numeros_rechazados = set()
+                limite = time.monotonic() + INGESTA_ESPERA_COLA
+                for (numero, mensaje), message_id in zip(mensajes, ids):
+                    if numero in numeros_rechazados or not encolar_mensaje(
+                        mensaje, numero, espera=max(0.0, limite - time.monotonic())
+                    ):
+                        numeros_rechazados.add(numero)
+                        olvidar_mensaje(message_id)
+                rechazados = sum(1 for numero, _ in mensajes if numero in numeros_rechazados)
+                registrar_evento(
+                    "webhook_atendido", modo="ingesta", mensajes=len(mensajes) - rechazados,
+                    rechazados=rechazados,
+                    duracion_ms=round((time.perf_counter() - inicio) * 1000, 3),
+                )
+                if rechazados:
+                    return {"status": "cola_llena"}, 503
+                return {"status": "encolado"}, 200
+
+            respuestas = atender_lote(mensajes)
+            registrar_evento(
+                "webhook_atendido", modo="en_linea", mensajes=len(mensajes),
+                duracion_ms=round((time.perf_counter() - inicio) * 1000, 3),
+            )
 
-        return {
-            "status": "success",
-            "respuesta_bot": respuesta
-        }, 200
+            status = "success" if None not in respuestas else "con_errores"
+            if len(respuestas) == 1:
+                return {
+                    "status": status,
+                    "respuesta_bot": respuestas[0]
+                }, 200
+            return {
+                "status": status,
+                "respuestas_bot": respuestas
+            }, 200
+        finally:
+            if METRICAS:
+                observar_metrica("bot_webhook_duracion_segundos", (tipo,), time.perf_counter() - inicio)
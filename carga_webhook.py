@@ -0,0 +1,335 @@
+"""
+Prueba de carga de punta a punta: levanta el bot (Flask o gunicorn) apuntando
+a un Graph API falso (graph_falso.py) y le manda webhooks como los de
+WhatsApp, con muchos usuarios conversando a la vez. Mide, desde que se
+publica cada webhook hasta que la respuesta del bot llega al Graph falso:
+
+  - mensajes por segundo atendidos,
+  - latencia de respuesta p50/p95/p99,
+  - respuestas duplicadas (más de una respuesta por mensaje, por ejemplo
+    cuando WhatsApp reenvía un webhook; ver --tasa-reentrega),
+  - mensajes sin respuesta y cuántos 429/500 devolvió el Graph falso.
+
+Con gunicorn repite la prueba para cada combinación de --workers y --hilos.
+Con más de un worker las sesiones se comparten en SQLite (BOT_SESIONES=sqlite),
+como en producción.
+
+Uso:
+    python carga_webhook.py                                   # Flask, 200 usuarios
+    python carga_webhook.py --servidor gunicorn --workers 1,2,4 --hilos 1,8
+    python carga_webhook.py --latencia-ms 300 --tasa-429 0.05 --tasa-reentrega 0.1
+    python carga_webhook.py --ingesta --json resultados.json
+    python carga_webhook.py --perfil 0.1                      # perfila 10% de los webhooks
+
+Con --perfil el bot se levanta con BOT_PERFIL_CABECERA=1 y una fracción de
+los webhooks lleva la cabecera "X-Bot-Perfil: 1"; al final se imprime el
+resumen de resumen_perfil.py y quedan los .folded en --perfil-dir.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import graph_falso
+import resumen_perfil
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+TOKEN_VERIFICACION = "carga-webhook"
+PHONE_NUMBER_ID = "100000000000001"
+
+# Conversaciones completas que repite cada usuario (una al azar).
+CONVERSACIONES = (
+    ("hola", "2", "1", "100000", "45", "3", "2", "no"),
+    ("crédito 150000 45% 3 años quincenal", "sí", "500", "4"),
+    ("hola", "1", "1", "15000", "2000", "6 meses", "2"),
+    ("hola", "3", "1", "5000", "500", "10", "5", "2", "1"),
+    ("hola", "4", "1", "1500000", "50000", "8", "25 años", "2"),
+    ("tienda 1800 250 12 quincenal",),
+    ("hola", "2", "4", "15000", "2000", "10000", "2", "2"),
+    ("hola", "6", "1", "5", "4", "3", "5", "4", "menú"),
+    ("hola", "7", "no entendí"),
+)
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentil(ordenados, p):
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)] if ordenados else float("nan")
+
+
+def payload_webhook(numero, texto, message_id):
+    """Un webhook de mensaje de texto con la forma que manda WhatsApp Cloud API."""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "100000000000000",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "5215500000000", "phone_number_id": PHONE_NUMBER_ID},
+                    "contacts": [{"profile": {"name": "Carga"}, "wa_id": numero}],
+                    "messages": [{
+                        "from": numero,
+                        "id": message_id,
+                        "timestamp": str(int(time.time())),
+                        "type": "text",
+                        "text": {"body": texto},
+                    }],
+                },
+            }],
+        }],
+    }
+
+
+def _numero_envio(numero):
+    # El bot quita el "1" de los números mexicanos al responder (normalizar_numero)
+    return "52" + numero[3:] if numero.startswith("521") and len(numero) == 13 else numero
+
+
+# =========================================
+# Servidor del bot
+# =========================================
+def _comando_servidor(servidor, puerto, workers, hilos):
+    if servidor == "gunicorn":
+        return [
+            sys.executable, "-m", "gunicorn", "--workers", str(workers), "--threads", str(hilos),
+            "--bind", f"127.0.0.1:{puerto}", "bot_credito:app",
+        ]
+    return [
+        sys.executable, "-c",
+        f"import bot_credito; bot_credito.app.run(host='127.0.0.1', port={puerto}, threaded=True)",
+    ]
+
+
+def levantar_bot(servidor, workers, hilos, url_graph, ingesta, directorio_temporal, perfil_dir=None, tiempo_max=30.0):
+    puerto = _puerto_libre()
+    entorno = dict(
+        os.environ,
+        WHATSAPP_VERIFY_TOKEN=TOKEN_VERIFICACION,
+        WHATSAPP_PHONE_NUMBER_ID=PHONE_NUMBER_ID,
+        WHATSAPP_TOKEN="token-falso",
+        BOT_GRAPH_URL_BASE=url_graph,
+        BOT_LOG_NIVEL="WARNING",
+        BOT_MODO_INGESTA="1" if ingesta else "0",
+    )
+    if perfil_dir:
+        entorno.update(BOT_PERFIL_CABECERA="1", BOT_PERFIL_DIR=perfil_dir)
+    if workers > 1:
+        ruta = os.path.join(directorio_temporal, f"sesiones_{workers}_{hilos}.sqlite3")
+        entorno.update(BOT_SESIONES="sqlite", BOT_SESIONES_SQLITE=ruta)
+    proceso = subprocess.Popen(
+        _comando_servidor(servidor, puerto, workers, hilos), cwd=DIRECTORIO, env=entorno,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    verificacion = f"{url}/webhook?hub.verify_token={TOKEN_VERIFICACION}&hub.challenge=ok"
+    limite = time.monotonic() + tiempo_max
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError(f"El servidor terminó con código {proceso.returncode}")
+        try:
+            with urllib.request.urlopen(verificacion, timeout=1) as respuesta:
+                if respuesta.status == 200:
+                    return proceso, url
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.05)
+    detener_bot(proceso)
+    raise RuntimeError(f"El bot no contestó en {tiempo_max} s")
+
+
+def detener_bot(proceso):
+    proceso.terminate()
+    try:
+        proceso.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+
+
+# =========================================
+# Generador de carga
+# =========================================
+def _publicar(url, payload, perfilar=False):
+    cabeceras = {"Content-Type": "application/json"}
+    if perfilar:
+        cabeceras["X-Bot-Perfil"] = "1"
+    peticion = urllib.request.Request(
+        f"{url}/webhook", data=json.dumps(payload).encode(), headers=cabeceras, method="POST",
+    )
+    try:
+        with urllib.request.urlopen(peticion, timeout=60) as respuesta:
+            respuesta.read()
+            return respuesta.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+
+def correr_carga(url, graph, usuarios, concurrencia, tasa_reentrega, tiempo_max_respuesta, semilla,
+                 fraccion_perfil=0.0):
+    aleatorio = random.Random(semilla)
+    pendientes = queue.Queue()
+    for i in range(usuarios):
+        pendientes.put((f"521{5500000000 + i:010d}", aleatorio.choice(CONVERSACIONES), aleatorio.random()))
+    ids = itertools.count(1)
+    candado = threading.Lock()
+    latencias = []
+    totales = {"mensajes": 0, "sin_respuesta": 0, "webhook_no_200": 0, "reentregas": 0}
+    enviados_por_numero = {}
+
+    def usuario(numero, conversacion, sorteo):
+        aleatorio_usuario = random.Random(sorteo)
+        destino = _numero_envio(numero)
+        for indice, texto in enumerate(conversacion, start=1):
+            with candado:
+                message_id = f"wamid.CARGA{next(ids):012d}"
+            payload = payload_webhook(numero, texto, message_id)
+            inicio = time.time()
+            reentregas = []
+            if aleatorio_usuario.random() < tasa_reentrega:
+                # WhatsApp reenvía el mismo webhook (mismo id) si tardamos en contestar
+                reentregas.append(threading.Thread(target=_publicar, args=(url, payload), daemon=True))
+                reentregas[-1].start()
+            perfilar = fraccion_perfil > 0 and aleatorio_usuario.random() < fraccion_perfil
+            status = _publicar(url, payload, perfilar)
+            llegada = graph.esperar_mensaje(destino, indice, tiempo_max_respuesta)
+            for hilo in reentregas:
+                hilo.join()
+            with candado:
+                totales["mensajes"] += 1
+                totales["reentregas"] += len(reentregas)
+                if status != 200:
+                    totales["webhook_no_200"] += 1
+                if llegada is None:
+                    totales["sin_respuesta"] += 1
+                    enviados_por_numero[destino] = indice
+                    return
+                latencias.append((llegada - inicio) * 1000)
+                enviados_por_numero[destino] = indice
+
+    def trabajador():
+        while True:
+            try:
+                numero, conversacion, sorteo = pendientes.get_nowait()
+            except queue.Empty:
+                return
+            usuario(numero, conversacion, sorteo)
+
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=trabajador, daemon=True) for _ in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    # Un momento para que lleguen respuestas tardías (duplicadas) antes de contar
+    time.sleep(1.0)
+    recibidos = graph.estadisticas()
+    duplicadas = sum(
+        max(0, len(recibidos["recibidos"].get(numero, ())) - enviados)
+        for numero, enviados in enviados_por_numero.items()
+    )
+    latencias.sort()
+    return {
+        "mensajes": totales["mensajes"],
+        "duracion_s": round(duracion, 3),
+        "mensajes_por_segundo": round(totales["mensajes"] / duracion, 1) if duracion else 0.0,
+        "latencia_p50_ms": round(_percentil(latencias, 50), 1),
+        "latencia_p95_ms": round(_percentil(latencias, 95), 1),
+        "latencia_p99_ms": round(_percentil(latencias, 99), 1),
+        "sin_respuesta": totales["sin_respuesta"],
+        "respuestas_duplicadas": duplicadas,
+        "reentregas": totales["reentregas"],
+        "webhook_no_200": totales["webhook_no_200"],
+        "graph": recibidos["contadores"],
+    }
+
+
+def _lista_enteros(texto):
+    return [int(parte) for parte in texto.split(",") if parte.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servidor", choices=("flask", "gunicorn"), default="flask")
+    parser.add_argument("--workers", type=_lista_enteros, default=[1], help="lista, ej. 1,2,4 (solo gunicorn)")
+    parser.add_argument("--hilos", type=_lista_enteros, default=[1], help="lista, ej. 1,8 (solo gunicorn)")
+    parser.add_argument("--usuarios", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=32, help="usuarios conversando al mismo tiempo")
+    parser.add_argument("--tasa-reentrega", type=float, default=0.05,
+                        help="fracción de webhooks que WhatsApp manda dos veces (mismo id)")
+    parser.add_argument("--tiempo-max-respuesta", type=float, default=30.0,
+                        help="segundos que se espera la respuesta de cada mensaje")
+    parser.add_argument("--ingesta", action="store_true", help="levanta el bot con BOT_MODO_INGESTA=1")
+    parser.add_argument("--semilla", type=int, default=2024)
+    parser.add_argument("--json", metavar="ARCHIVO", help="guarda los resultados en JSON")
+    parser.add_argument("--perfil", type=float, default=0.0, metavar="FRACCION",
+                        help="fracción de webhooks que el bot perfila (ver resumen_perfil.py)")
+    parser.add_argument("--perfil-dir", default="perfiles", help="donde el bot deja los .folded")
+    graph_falso.agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    combinaciones = (
+        list(itertools.product(args.workers, args.hilos)) if args.servidor == "gunicorn" else [(1, 1)]
+    )
+    graph = graph_falso.desde_argumentos(args, semilla=args.semilla)
+    servidor_graph, url_graph = graph.iniciar_en_hilo()
+
+    resultados = []
+    with tempfile.TemporaryDirectory() as directorio_temporal:
+        try:
+            for workers, hilos in combinaciones:
+                graph.reiniciar()
+                proceso, url = levantar_bot(
+                    args.servidor, workers, hilos, url_graph, args.ingesta, directorio_temporal,
+                    perfil_dir=os.path.abspath(args.perfil_dir) if args.perfil else None,
+                )
+                try:
+                    resultado = correr_carga(
+                        url, graph, args.usuarios, args.concurrencia, args.tasa_reentrega,
+                        args.tiempo_max_respuesta, args.semilla, args.perfil,
+                    )
+                finally:
+                    detener_bot(proceso)
+                resultado.update(servidor=args.servidor, workers=workers, hilos=hilos)
+                resultados.append(resultado)
+        finally:
+            servidor_graph.shutdown()
+
+    print(
+        f"{'workers':>7s} {'hilos':>5s} {'mensajes':>8s} {'msg/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s} "
+        f"{'p99 ms':>8s} {'sin resp':>8s} {'duplic.':>7s} {'429':>5s} {'500':>5s}"
+    )
+    for r in resultados:
+        print(
+            f"{r['workers']:7d} {r['hilos']:5d} {r['mensajes']:8d} {r['mensajes_por_segundo']:8.1f} "
+            f"{r['latencia_p50_ms']:8.1f} {r['latencia_p95_ms']:8.1f} {r['latencia_p99_ms']:8.1f} "
+            f"{r['sin_respuesta']:8d} {r['respuestas_duplicadas']:7d} "
+            f"{r['graph']['429']:5d} {r['graph']['500']:5d}"
+        )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump(resultados, archivo, ensure_ascii=False, indent=2)
+    if args.perfil:
+        resumen_perfil.imprimir_resumen(args.perfil_dir)
+
+
+if __name__ == "__main__":
+    main()
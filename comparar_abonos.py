@@ -0,0 +1,117 @@
+"""
+Compara, sobre muchos créditos al azar, la fórmula cerrada de
+calcular_ahorro_por_abonos (la que usa el bot) con la simulación periodo por
+periodo (metodo="iterativo"). Las dos tienen que dar exactamente lo mismo al
+centavo: totales sin y con abonos, ahorro y pagos ahorrados.
+
+Los créditos mezclan casos comunes (pagos mensuales, quincenales o
+semanales, tasas y montos razonables) con casos de orilla: tasas altísimas,
+montos con centavos, abonos mayores que el pago, abonos que empiezan antes
+del primer periodo o después del último. Se omiten los que la simulación no
+puede terminar (ver _limite_pagos) o que la fórmula cerrada no acepta.
+
+Uso:
+    python comparar_abonos.py                    # 3000 créditos, semilla 1
+    python comparar_abonos.py --casos 20000 --semilla 7
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+os.environ.setdefault("BOT_LOG_NIVEL", "WARNING")
+os.environ.setdefault("BOT_PRECARGA", "0")
+
+import bot_credito as bot
+
+
+# La simulación se corta si hace más pagos que esto (plazo * 3 + 50): con
+# abonos que no alcanzan a cubrir los intereses nunca terminaría.
+def _limite_pagos(plazo):
+    return plazo * 3 + 50
+
+
+def _credito_al_azar(azar):
+    monto = azar.choice([
+        azar.randint(1, 5000) * 100,
+        azar.randint(100, 10**7),
+        Decimal(azar.randint(1, 10**8)) / 100,
+    ])
+    periodos_por_anio = azar.choice([12, 24, 26, 52, azar.randint(1, 60)])
+    anios = azar.choice([Decimal(azar.randint(1, 30)), Decimal(azar.randint(1, 60)) / 2])
+    tasa_anual = azar.choice([Decimal(azar.randint(1, 120)), Decimal(azar.randint(1, 9999)) / 100])
+    plazo, tasa = bot.calcular_plazo_y_tasa_periodo(anios, tasa_anual, periodos_por_anio)
+    if plazo <= 0:
+        return None
+    abono = azar.choice([
+        0,
+        azar.randint(1, 5000),
+        Decimal(azar.randint(1, 10**6)) / 100,
+        Decimal(monto) / 3,
+    ])
+    desde = azar.choice([1, 0, -3, azar.randint(1, plazo + 5), plazo, plazo + 1, plazo + 10])
+    return monto, tasa, plazo, abono, desde
+
+
+def comparar(casos, semilla):
+    azar = random.Random(semilla)
+    comparados = omitidos = 0
+    diferencias = []
+    tiempo_cerrado = tiempo_iterativo = 0.0
+    for _ in range(casos):
+        credito = _credito_al_azar(azar)
+        if credito is None:
+            omitidos += 1
+            continue
+        inicio = time.perf_counter()
+        try:
+            cerrado = bot.calcular_ahorro_por_abonos(*credito)
+        except (ArithmeticError, ValueError):
+            omitidos += 1
+            continue
+        tiempo_cerrado += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        iterativo = bot._calcular_ahorro_por_abonos_iterativo(
+            *credito, limite_pagos=_limite_pagos(credito[2])
+        )
+        tiempo_iterativo += time.perf_counter() - inicio
+        if iterativo is None:
+            omitidos += 1
+            continue
+
+        comparados += 1
+        if cerrado != iterativo:
+            diferencias.append((credito, cerrado, iterativo))
+    return comparados, omitidos, diferencias, tiempo_cerrado, tiempo_iterativo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--casos", type=int, default=3000)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    comparados, omitidos, diferencias, tiempo_cerrado, tiempo_iterativo = comparar(args.casos, args.semilla)
+    print(f"{comparados} créditos comparados, {omitidos} omitidos (semilla {args.semilla})")
+    if comparados:
+        print(
+            f"fórmula cerrada {tiempo_cerrado / comparados * 1e3:.3f} ms/crédito, "
+            f"simulación {tiempo_iterativo / comparados * 1e3:.3f} ms/crédito"
+        )
+    if not diferencias:
+        print("OK: la fórmula cerrada y la simulación dan lo mismo al centavo")
+        return
+    for (monto, tasa, plazo, abono, desde), cerrado, iterativo in diferencias[:20]:
+        print(
+            f"FALLA: monto={monto} tasa={tasa} plazo={plazo} abono={abono} desde={desde}\n"
+            f"  cerrado   {cerrado}\n  iterativo {iterativo}"
+        )
+    print(f"{len(diferencias)} de {comparados} créditos con resultados distintos")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Prueba de estrés de los turnos por número (ver "Turnos por número" en
+bot_credito.py): deja a varios usuarios en la evaluación de salud
+financiera (las 4 dimensiones, 25 preguntas) y luego les manda a todos
+muchas respuestas "5" al mismo tiempo, desde muchos hilos (y, con
+--procesos, desde varios procesos que comparten las sesiones en SQLite).
+
+Como todos los mensajes son iguales, da lo mismo en qué orden se atiendan:
+si cada número se atiende uno a la vez, el contexto final y las respuestas
+de cada usuario tienen que ser exactamente los de mandarlos uno tras otro.
+Si dos mensajes del mismo número se cruzan, se pierde una respuesta
+(salud_preg_idx avanza de menos) o se repite una pregunta, y la prueba
+termina con código 1.
+
+Uso:
+    python estres_turnos.py                          # 50 usuarios x 20 mensajes, 32 hilos
+    python estres_turnos.py --usuarios 200 --mensajes 25 --hilos 64
+    python estres_turnos.py --procesos 4             # 4 workers con BOT_SESIONES=sqlite
+    python estres_turnos.py --sin-turnos             # muestra que sin turnos sí se corrompe
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("BOT_LOG_NIVEL", "WARNING")
+os.environ.setdefault("BOT_PRECARGA", "0")
+
+PREPARACION = ("hola", "6", "5")  # menú -> salud financiera -> las 4 dimensiones
+RESPUESTA = "5"
+NUMERO_BASE = "5219990000000"
+
+bot = None
+
+
+def _importar_bot(procesos):
+    global bot
+    if procesos > 1:
+        # Varios workers: las sesiones tienen que estar en el almacén compartido
+        os.environ["BOT_SESIONES"] = "sqlite"
+        os.environ["BOT_SESIONES_SQLITE"] = os.path.join(tempfile.mkdtemp(), "sesiones.sqlite3")
+    import bot_credito
+    bot = bot_credito
+
+
+def _quitar_turnos():
+    bot.turno_de = lambda numero: contextlib.nullcontext()
+    # Y entre procesos: guardar sin revisar la versión de la sesión
+    almacen = bot.almacen_sesiones
+    almacen.guardar_si_version = lambda numero, contexto, ultimo, version: (
+        almacen.guardar(numero, contexto, ultimo) or True
+    )
+
+
+def _contexto_final(numero):
+    if bot.almacen_sesiones.local:
+        contexto = bot.estado_usuario.get(numero)
+    else:
+        contexto = bot.almacen_sesiones.cargar(numero)[0]
+    return bot.serializar_sesion(contexto) if contexto is not None else None
+
+
+def _preparar(numeros):
+    for numero in numeros:
+        for mensaje in PREPARACION:
+            bot.procesar_mensaje(mensaje, numero)
+
+
+def _esperado(mensajes):
+    """Contexto final y respuestas de un usuario que manda todo uno tras otro."""
+    _preparar([NUMERO_BASE])
+    respuestas = [bot.procesar_mensaje(RESPUESTA, NUMERO_BASE) for _ in range(mensajes)]
+    return _contexto_final(NUMERO_BASE), respuestas
+
+
+def _disparar(numeros, mensajes, hilos):
+    """
+    Manda `mensajes` respuestas a cada número desde `hilos` hilos, con los
+    usuarios intercalados. Devuelve {numero: [respuestas en orden de envío]}.
+    """
+    enviadas = {numero: [] for numero in numeros}
+    # list.append es atómico: el orden de la lista es el orden de envío
+    bot.enviar_mensaje = lambda numero, texto, *args, **kwargs: enviadas[numero].append(texto)
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        futuros = [
+            ejecutor.submit(bot.atender_mensaje, RESPUESTA, numero)
+            for _ in range(mensajes)
+            for numero in numeros
+        ]
+        for futuro in futuros:
+            futuro.result()
+    return enviadas
+
+
+def _worker(numeros, mensajes, hilos):
+    return _disparar(numeros, mensajes, hilos)
+
+
+def correr(usuarios, mensajes, hilos, procesos, sin_turnos):
+    # Cambios de hilo mucho más frecuentes, para que los cruces aparezcan
+    sys.setswitchinterval(1e-6)
+    if sin_turnos:
+        _quitar_turnos()
+    contexto_esperado, respuestas_esperadas = _esperado(mensajes)
+
+    numeros = [f"5219980{i:06d}" for i in range(usuarios)]
+    _preparar(numeros)
+    if procesos > 1:
+        # Cada proceso manda su parte de los mensajes de TODOS los usuarios
+        partes = [mensajes // procesos + (i < mensajes % procesos) for i in range(procesos)]
+        with multiprocessing.get_context("fork").Pool(procesos) as pool:
+            resultados = pool.starmap(_worker, [(numeros, parte, hilos) for parte in partes])
+        enviadas = {numero: [] for numero in numeros}
+        for resultado in resultados:
+            for numero, textos in resultado.items():
+                enviadas[numero].extend(textos)
+    else:
+        enviadas = _disparar(numeros, mensajes, hilos)
+
+    fallas = Counter()
+    for numero in numeros:
+        if _contexto_final(numero) != contexto_esperado:
+            fallas["contexto final distinto"] += 1
+        if procesos > 1:
+            # Entre workers el orden de los envíos no se garantiza
+            if Counter(enviadas[numero]) != Counter(respuestas_esperadas):
+                fallas["respuestas distintas"] += 1
+        elif enviadas[numero] != respuestas_esperadas:
+            fallas["respuestas distintas o en otro orden"] += 1
+    # Las filas de turnos se borran cuando nadie las usa
+    if bot._turnos:
+        fallas["fila de turnos sin borrar"] += len(bot._turnos)
+    return fallas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--mensajes", type=int, default=20, help="respuestas por usuario (máximo 25)")
+    parser.add_argument("--hilos", type=int, default=32, help="hilos por proceso")
+    parser.add_argument("--procesos", type=int, default=1)
+    parser.add_argument("--sin-turnos", action="store_true", help="desactiva los turnos por número")
+    args = parser.parse_args()
+    if not 1 <= args.mensajes <= 25:
+        sys.exit("--mensajes debe estar entre 1 y 25 (las preguntas de la evaluación)")
+
+    _importar_bot(args.procesos)
+    fallas = correr(args.usuarios, args.mensajes, args.hilos, args.procesos, args.sin_turnos)
+    total = args.usuarios * args.mensajes
+    print(
+        f"{total} mensajes de {args.usuarios} usuarios, {args.hilos} hilos x {args.procesos} "
+        f"proceso(s), sesiones en {bot.SESIONES_BACKEND}"
+        f"{', SIN turnos' if args.sin_turnos else ''}"
+    )
+    if not fallas:
+        print("OK: cada usuario terminó igual que atendiendo sus mensajes uno tras otro")
+        return
+    for motivo, usuarios in fallas.most_common():
+        print(f"FALLA: {usuarios} de {args.usuarios} usuarios con {motivo}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Graph API de WhatsApp falso, para pruebas de carga locales: atiende
+POST /{PHONE_NUMBER_ID}/messages como lo haría graph.facebook.com, con la
+latencia, la tasa de errores y los 429 que se le indiquen, y guarda cada
+mensaje que recibe para poder revisar qué contestó el bot y cuándo.
+
+El bot se apunta a él con BOT_GRAPH_URL_BASE, por ejemplo:
+    python graph_falso.py --puerto 8089 --latencia-ms 120 --tasa-error 0.01
+    BOT_GRAPH_URL_BASE=http://127.0.0.1:8089/v21.0 gunicorn bot_credito:app
+
+Además de la API, expone:
+    GET  /_estadisticas   contadores y mensajes recibidos por número (JSON)
+    POST /_reiniciar      borra lo recibido y los contadores
+
+carga_webhook.py lo levanta dentro de su propio proceso (ver GraphFalso).
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_RUTA_MENSAJES_RE = re.compile(r"^(?:/v[\d.]+)?/[^/]+/messages$")
+
+
+class GraphFalso:
+    """
+    Estado y comportamiento del Graph API falso. Cada respuesta:
+      - espera latencia_ms (± jitter_ms) antes de contestar;
+      - si pasa de limite_por_segundo envíos en el último segundo, o al azar
+        con probabilidad tasa_429, contesta 429 con Retry-After;
+      - al azar con probabilidad tasa_error, contesta 500;
+      - si no, 200 con un wamid nuevo, y guarda el mensaje.
+    """
+
+    def __init__(self, latencia_ms=0.0, jitter_ms=0.0, tasa_error=0.0, tasa_429=0.0,
+                 limite_por_segundo=0, retry_after_s=1, semilla=None):
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.tasa_error = tasa_error
+        self.tasa_429 = tasa_429
+        self.limite_por_segundo = limite_por_segundo
+        self.retry_after_s = retry_after_s
+        self._aleatorio = random.Random(semilla)
+        self._wamids = itertools.count(1)
+        self._candado = threading.Condition()
+        self._ventana = []
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._candado:
+            self.recibidos = {}
+            self.contadores = {"peticiones": 0, "200": 0, "429": 0, "500": 0, "400": 0}
+            self._ventana = []
+
+    def _sortear(self, probabilidad):
+        with self._candado:
+            return self._aleatorio.random() < probabilidad
+
+    def _limitado(self, ahora):
+        if not self.limite_por_segundo:
+            return False
+        with self._candado:
+            self._ventana = [t for t in self._ventana if ahora - t < 1.0]
+            if len(self._ventana) >= self.limite_por_segundo:
+                return True
+            self._ventana.append(ahora)
+            return False
+
+    def atender(self, cuerpo):
+        """Devuelve (status, headers, respuesta JSON) para un POST a /messages."""
+        espera = self.latencia_ms
+        if self.jitter_ms:
+            with self._candado:
+                espera += self._aleatorio.uniform(-self.jitter_ms, self.jitter_ms)
+        if espera > 0:
+            time.sleep(espera / 1000)
+
+        with self._candado:
+            self.contadores["peticiones"] += 1
+        if self._limitado(time.monotonic()) or self._sortear(self.tasa_429):
+            return self._contar(429, {"Retry-After": str(self.retry_after_s)}, {
+                "error": {"message": "(#130429) Rate limit hit", "code": 130429},
+            })
+        if self._sortear(self.tasa_error):
+            return self._contar(500, {}, {"error": {"message": "Error falso", "code": 1}})
+
+        numero = cuerpo.get("to") if isinstance(cuerpo, dict) else None
+        texto = ((cuerpo.get("text") or {}).get("body") if isinstance(cuerpo, dict) else None)
+        if not numero or texto is None:
+            return self._contar(400, {}, {"error": {"message": "Falta to o text.body", "code": 100}})
+
+        wamid = f"wamid.FALSO{next(self._wamids):012d}"
+        with self._candado:
+            self.recibidos.setdefault(numero, []).append((time.time(), texto))
+            self._candado.notify_all()
+        return self._contar(200, {}, {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": numero, "wa_id": numero}],
+            "messages": [{"id": wamid}],
+        })
+
+    def _contar(self, status, headers, respuesta):
+        with self._candado:
+            self.contadores[str(status)] += 1
+        return status, headers, respuesta
+
+    def esperar_mensaje(self, numero, cuantos, tiempo_max):
+        """
+        Espera hasta que `numero` haya recibido al menos `cuantos` mensajes.
+        Devuelve la hora (time.time()) en que llegó el número `cuantos`, o
+        None si no llegó a tiempo.
+        """
+        limite = time.monotonic() + tiempo_max
+        with self._candado:
+            while len(self.recibidos.get(numero, ())) < cuantos:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return None
+                self._candado.wait(restante)
+            return self.recibidos[numero][cuantos - 1][0]
+
+    def estadisticas(self):
+        with self._candado:
+            return {
+                "contadores": dict(self.contadores),
+                "recibidos": {numero: [texto for _, texto in mensajes] for numero, mensajes in self.recibidos.items()},
+            }
+
+    def servidor(self, host="127.0.0.1", puerto=0):
+        """Un ThreadingHTTPServer listo para serve_forever() (puerto 0: uno libre)."""
+        graph = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _responder(self, status, headers, respuesta):
+                cuerpo = json.dumps(respuesta).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                for nombre, valor in headers.items():
+                    self.send_header(nombre, valor)
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def do_POST(self):
+                largo = int(self.headers.get("Content-Length") or 0)
+                datos = self.rfile.read(largo)
+                if self.path == "/_reiniciar":
+                    graph.reiniciar()
+                    return self._responder(200, {}, {"status": "ok"})
+                if not _RUTA_MENSAJES_RE.match(self.path):
+                    return self._responder(404, {}, {"error": {"message": "Ruta desconocida"}})
+                try:
+                    cuerpo = json.loads(datos or b"{}")
+                except ValueError:
+                    cuerpo = None
+                self._responder(*graph.atender(cuerpo))
+
+            def do_GET(self):
+                if self.path == "/_estadisticas":
+                    return self._responder(200, {}, graph.estadisticas())
+                self._responder(404, {}, {"error": {"message": "Ruta desconocida"}})
+
+            def log_message(self, formato, *args):
+                pass
+
+        servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        servidor.daemon_threads = True
+        return servidor
+
+    def iniciar_en_hilo(self, host="127.0.0.1", puerto=0):
+        """Levanta el servidor en un hilo daemon; devuelve (servidor, url_base)."""
+        servidor = self.servidor(host, puerto)
+        threading.Thread(target=servidor.serve_forever, name="graph-falso", daemon=True).start()
+        host, puerto = servidor.server_address[:2]
+        return servidor, f"http://{host}:{puerto}/v21.0"
+
+
+def agregar_argumentos(parser):
+    """Opciones del comportamiento del Graph falso (las comparte carga_webhook.py)."""
+    parser.add_argument("--latencia-ms", type=float, default=100.0, help="latencia de cada envío (100 ms por defecto)")
+    parser.add_argument("--jitter-ms", type=float, default=30.0, help="variación al azar de la latencia (±)")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="fracción de envíos que reciben un 500")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="fracción de envíos que reciben un 429 al azar")
+    parser.add_argument("--limite-por-segundo", type=int, default=0,
+                        help="más envíos que esto en un segundo reciben 429 (0: sin límite)")
+    parser.add_argument("--retry-after", type=int, default=1, help="segundos en el Retry-After de los 429")
+
+
+def desde_argumentos(args, semilla=None):
+    return GraphFalso(
+        latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms, tasa_error=args.tasa_error,
+        tasa_429=args.tasa_429, limite_por_segundo=args.limite_por_segundo,
+        retry_after_s=args.retry_after, semilla=semilla,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8089)
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    servidor = desde_argumentos(args).servidor(args.host, args.puerto)
+    print(f"Graph API falso en http://{args.host}:{args.puerto}/v21.0")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
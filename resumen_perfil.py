@@ -0,0 +1,91 @@
+"""
+Resume los perfiles que escribe el bot con BOT_PERFIL / BOT_PERFIL_CABECERA
+(archivos perfil-<pid>.folded de pilas colapsadas, ver "Perfilado por
+muestreo" en bot_credito.py): para cada paso de la conversación
+(contexto["esperando"]) dice cuánto tiempo se midió y qué funciones se
+llevaron más, tanto en tiempo propio como contando lo que llaman.
+
+Los mismos archivos sirven para una gráfica de flama:
+    cat perfiles/*.folded | flamegraph.pl --countname ns > perfil.svg
+o se pueden abrir directamente en https://www.speedscope.app.
+
+Uso:
+    python resumen_perfil.py                    # lee perfiles/*.folded
+    python resumen_perfil.py otro_dir --top 20
+    python resumen_perfil.py --paso monto_credito
+"""
+import argparse
+import glob
+import os
+
+
+def leer_pilas(rutas):
+    """Devuelve {paso: {pila (tupla de funciones): ns}} sumando todas las líneas."""
+    por_paso = {}
+    for ruta in rutas:
+        with open(ruta, encoding="utf-8") as archivo:
+            for linea in archivo:
+                pila, _, ns = linea.rstrip("\n").rpartition(" ")
+                if not pila:
+                    continue
+                paso, *funciones = pila.split(";")
+                pilas = por_paso.setdefault(paso, {})
+                clave = tuple(funciones)
+                pilas[clave] = pilas.get(clave, 0) + int(ns)
+    return por_paso
+
+
+def resumir_paso(pilas):
+    """(total ns, {funcion: ns propios}, {funcion: ns incluyendo lo que llama})."""
+    propio = {}
+    inclusivo = {}
+    for funciones, ns in pilas.items():
+        if not funciones:
+            continue
+        propio[funciones[-1]] = propio.get(funciones[-1], 0) + ns
+        # Una función recursiva aparece varias veces en la pila: se cuenta una
+        for funcion in set(funciones):
+            inclusivo[funcion] = inclusivo.get(funcion, 0) + ns
+    return sum(pilas.values()), propio, inclusivo
+
+
+def _mas_costosas(tiempos, top):
+    return sorted(tiempos.items(), key=lambda par: par[1], reverse=True)[:top]
+
+
+def imprimir_resumen(directorio, top=10, paso=None):
+    rutas = sorted(glob.glob(os.path.join(directorio, "*.folded")))
+    if not rutas:
+        print(f"No hay archivos .folded en {directorio}")
+        return
+    por_paso = leer_pilas(rutas)
+    if paso:
+        por_paso = {paso: por_paso.get(paso, {})}
+
+    resumenes = sorted(
+        ((paso, *resumir_paso(pilas)) for paso, pilas in por_paso.items()),
+        key=lambda resumen: resumen[1], reverse=True,
+    )
+    for paso, total, propio, inclusivo in resumenes:
+        print(f"\n== {paso}: {total / 1e6:.3f} ms medidos")
+        if not total:
+            continue
+        print(f"   {'propio ms':>10s} {'%':>6s}  función")
+        for funcion, ns in _mas_costosas(propio, top):
+            print(f"   {ns / 1e6:10.3f} {100 * ns / total:6.1f}  {funcion}")
+        print(f"   {'total ms':>10s} {'%':>6s}  función (con lo que llama)")
+        for funcion, ns in _mas_costosas(inclusivo, top):
+            print(f"   {ns / 1e6:10.3f} {100 * ns / total:6.1f}  {funcion}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directorio", nargs="?", default="perfiles", help="donde están los .folded")
+    parser.add_argument("--top", type=int, default=10, help="funciones a mostrar por paso")
+    parser.add_argument("--paso", help="mostrar solo este paso")
+    args = parser.parse_args()
+    imprimir_resumen(args.directorio, args.top, args.paso)
+
+
+if __name__ == "__main__":
+    main()